@@ -0,0 +1,175 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, delete
+
+from config import ADMIN_IDS, ADMIN_REFRESH_INTERVAL, ADMIN_VERIFICATION_TTL, logger
+from database import AsyncSession, insert_for
+from models import Admin, PendingAdmin, RegistryVersion
+
+# Name of the admins row in registry_versions
+VERSION_NAME = 'admins'
+
+
+class AdminRegistry:
+    """
+    In-memory set of admin user IDs backed by the admins table
+
+    Checks are a frozenset lookup with no I/O. Every change bumps a version
+    row in the same transaction; each process polls that single row and
+    reloads the set only when it has changed.
+    """
+
+    def __init__(self):
+        self.ids = frozenset()
+        self.version = None
+
+    def __contains__(self, user_id):
+        return user_id in self.ids
+
+    async def load(self):
+        """Load all admins; init_db() has added the ADMIN_IDS ones"""
+        await self._reload()
+
+    async def _reload(self):
+        async with AsyncSession() as session:
+            version = await session.scalar(
+                select(RegistryVersion.version).where(RegistryVersion.name == VERSION_NAME)
+            )
+            ids = (await session.scalars(select(Admin.user_id))).all()
+        self.ids = frozenset(ids)
+        self.version = version
+
+    async def refresh(self):
+        """
+        Reload the admins if another process changed them
+
+        Returns:
+            bool: True if the admins were reloaded
+        """
+        async with AsyncSession() as session:
+            version = await session.scalar(
+                select(RegistryVersion.version).where(RegistryVersion.name == VERSION_NAME)
+            )
+        if version == self.version:
+            return False
+        await self._reload()
+        return True
+
+    async def add(self, user_id, username=None, added_by=None):
+        """
+        Make a user an admin in every process
+
+        Returns:
+            bool: False if the user already was an admin
+        """
+        async with AsyncSession() as session:
+            # A concurrent add() of the same user inserts nothing instead of failing
+            added = await session.execute(
+                insert_for(session.bind)(Admin)
+                .values(user_id=user_id, username=username, added_by=added_by)
+                .on_conflict_do_nothing(index_elements=['user_id'])
+            )
+            if not added.rowcount:
+                return False
+            await session.execute(_version_bump(insert_for(session.bind)))
+            await session.commit()
+        await self._reload()
+        return True
+
+
+def _version_bump(insert):
+    """Statement bumping the admins version, creating its row if missing"""
+    return (
+        insert(RegistryVersion)
+        .values(name=VERSION_NAME, version=1)
+        .on_conflict_do_update(index_elements=['name'], set_={'version': RegistryVersion.version + 1})
+    )
+
+
+def seed_admins(connection):
+    """
+    Add the ADMIN_IDS admins that are missing
+
+    Called by init_db(), once before any worker process starts. Admins that
+    already exist are left alone, so this can't fail on a duplicate either way.
+
+    Args:
+        connection (Connection): Connection inside a transaction
+    """
+    if not ADMIN_IDS:
+        return
+    insert = insert_for(connection)
+    added = connection.execute(
+        insert(Admin)
+        .values([{'user_id': user_id} for user_id in ADMIN_IDS])
+        .on_conflict_do_nothing(index_elements=['user_id'])
+    )
+    if added.rowcount:
+        connection.execute(_version_bump(insert))
+
+
+async def run_refresh(application, interval=ADMIN_REFRESH_INTERVAL):
+    """Periodically pick up admin changes made by other processes until cancelled"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await admin_registry.refresh():
+                logger.info(f"Reloaded admins: {len(admin_registry.ids)} admins")
+        except Exception:
+            logger.exception("Error refreshing admins")
+
+
+def _cutoff():
+    return datetime.now() - timedelta(seconds=ADMIN_VERIFICATION_TTL)
+
+
+async def request_admin(username, requester_id):
+    """Record that an admin asked to add `username`, replacing any earlier request for it"""
+    async with AsyncSession() as session:
+        await session.execute(delete(PendingAdmin).where(PendingAdmin.username == username))
+        session.add(PendingAdmin(username=username, requester_id=requester_id))
+        await session.commit()
+
+
+async def start_verification(username, user_id):
+    """
+    Move a pending request for `username` to verifying
+
+    Returns:
+        int: ID of the admin who asked, or None if there is no unexpired pending request
+    """
+    async with AsyncSession() as session:
+        # Expired requests are dropped instead of matched
+        await session.execute(delete(PendingAdmin).where(PendingAdmin.created_at < _cutoff()))
+        requester_id = await session.scalar(
+            update(PendingAdmin)
+            .where(PendingAdmin.username == username, PendingAdmin.status == 'pending')
+            .values(status='verifying', user_id=user_id)
+            .returning(PendingAdmin.requester_id)
+        )
+        await session.commit()
+    return requester_id
+
+
+async def finish_verification(username, user_id):
+    """
+    Remove the verifying request matching a confirm/cancel button
+
+    Returns:
+        bool: True if the request existed and had not expired
+    """
+    async with AsyncSession() as session:
+        removed = await session.execute(
+            delete(PendingAdmin).where(
+                PendingAdmin.username == username,
+                PendingAdmin.user_id == user_id,
+                PendingAdmin.status == 'verifying',
+                PendingAdmin.created_at >= _cutoff()
+            )
+        )
+        await session.commit()
+    return removed.rowcount > 0
+
+
+admin_registry = AdminRegistry()
@@ -0,0 +1,175 @@
+import asyncio
+import io
+import time
+
+from cache import LRUCache
+from config import ANALYSIS_ENABLED, ANALYSIS_MIN_SIDE, ANALYSIS_CACHE_SIZE, ANALYSIS_CACHE_TTL, logger
+from workers import run_in_process
+import metrics
+
+try:
+    from PIL import Image as PILImage, ImageFilter, ImageStat
+except ImportError:
+    PILImage = None
+
+# Photos with a shorter side are hard to read
+MIN_READABLE_SIDE = 480
+# Variance of the Laplacian below which a photo is considered blurry
+BLUR_THRESHOLD = 150
+# Grayscale standard deviation below which text is unlikely to be readable;
+# receipts are mostly blank paper, so even sharp ones score low
+MIN_CONTRAST = 12
+# Mean brightness outside this range means under- or overexposed
+BRIGHTNESS_RANGE = (50, 250)
+
+# Analyzers run on every check photo, by name. Each takes a PIL image and
+# returns a dict of findings, with a `warning` for anything admins should see
+ANALYZERS = {}
+
+# Results by file_unique_id, and analyses still running
+_results = LRUCache(maxsize=ANALYSIS_CACHE_SIZE, ttl=ANALYSIS_CACHE_TTL)
+_running = {}
+
+
+def analyzer(name):
+    """Register a function as a check photo analyzer; it runs in a worker process, so it must be module-level"""
+    def decorator(func):
+        ANALYZERS[name] = func
+        return func
+    return decorator
+
+
+@analyzer('size')
+def analyze_size(image):
+    width, height = image.size
+    result = {'width': width, 'height': height}
+    if min(width, height) < MIN_READABLE_SIDE:
+        result['warning'] = "low resolution"
+    return result
+
+
+@analyzer('blur')
+def analyze_blur(image):
+    laplacian = image.convert('L').filter(ImageFilter.Kernel((3, 3), (0, 1, 0, 1, -4, 1, 0, 1, 0), scale=1, offset=128))
+    sharpness = ImageStat.Stat(laplacian).var[0]
+    result = {'sharpness': round(sharpness, 1)}
+    if sharpness < BLUR_THRESHOLD:
+        result['warning'] = "blurry"
+    return result
+
+
+@analyzer('exposure')
+def analyze_exposure(image):
+    stat = ImageStat.Stat(image.convert('L'))
+    brightness, contrast = stat.mean[0], stat.stddev[0]
+    result = {'brightness': round(brightness, 1), 'contrast': round(contrast, 1)}
+    if not BRIGHTNESS_RANGE[0] <= brightness <= BRIGHTNESS_RANGE[1]:
+        result['warning'] = "too dark" if brightness < BRIGHTNESS_RANGE[0] else "overexposed"
+    elif contrast < MIN_CONTRAST:
+        result['warning'] = "low contrast"
+    return result
+
+
+def run_pipeline(data, analyzers):
+    """
+    Decode a photo once and run every analyzer on it
+
+    Runs in a worker process.
+
+    Args:
+        data (bytes): Encoded image
+        analyzers (list[tuple[str, callable]]): Analyzers to run, by name
+
+    Returns:
+        tuple[dict, dict]: Findings and seconds taken, both by analyzer name
+    """
+    findings, timings = {}, {}
+    started = time.perf_counter()
+    with PILImage.open(io.BytesIO(data)) as image:
+        image.load()
+        timings['decode'] = time.perf_counter() - started
+        for name, func in analyzers:
+            started = time.perf_counter()
+            try:
+                findings[name] = func(image)
+            except Exception as e:
+                findings[name] = {'error': str(e)}
+            timings[name] = time.perf_counter() - started
+    return findings, timings
+
+
+def pick_size(photo, min_side=ANALYSIS_MIN_SIDE):
+    """Smallest PhotoSize with both sides at least `min_side`, or the largest one"""
+    for size in photo:
+        if min(size.width, size.height) >= min_side:
+            return size
+    return photo[-1]
+
+
+async def _analyze(bot, photo):
+    started = time.perf_counter()
+    file = await bot.get_file(pick_size(photo).file_id)
+    data = bytes(await file.download_as_bytearray())
+    metrics.observe('check_analysis_seconds', time.perf_counter() - started, stage='download')
+
+    findings, timings = await run_in_process(run_pipeline, data, list(ANALYZERS.items()))
+    for stage, seconds in timings.items():
+        metrics.observe('check_analysis_seconds', seconds, stage=stage)
+    return findings
+
+
+def start(bot, photo):
+    """
+    Start analyzing a check photo in the background, unless it was analyzed before
+
+    Args:
+        bot (Bot): Bot used to download the photo
+        photo (list[PhotoSize]): Sizes of the uploaded photo, smallest first
+    """
+    if not ANALYSIS_ENABLED or PILImage is None:
+        return
+    file_unique_id = photo[-1].file_unique_id
+    if file_unique_id in _running or _results.get(file_unique_id) is not None:
+        return
+
+    async def run():
+        try:
+            _results.set(file_unique_id, await _analyze(bot, photo))
+        except Exception as e:
+            logger.error(f"Error analyzing check photo {file_unique_id}: {e}")
+        finally:
+            del _running[file_unique_id]
+
+    _running[file_unique_id] = asyncio.create_task(run())
+
+
+async def get_result(file_unique_id, timeout):
+    """
+    Findings for a check photo, waiting up to `timeout` seconds if it is still being analyzed
+
+    Returns:
+        dict: Findings by analyzer name, or None if the photo wasn't (successfully) analyzed
+    """
+    task = _running.get(file_unique_id)
+    if task is not None:
+        await asyncio.wait([task], timeout=timeout)
+    return _results.get(file_unique_id)
+
+
+def summarize(findings):
+    """
+    One line describing the findings for admins
+
+    Returns:
+        str: e.g. "1280x960, blurry, low contrast", or "looks fine"
+    """
+    warnings = [result['warning'] for result in findings.values() if 'warning' in result]
+    size = findings.get('size', {})
+    prefix = f"{size['width']}x{size['height']}" if 'width' in size else None
+    return ', '.join(filter(None, [prefix] + (warnings or ["looks fine"])))
+
+
+@metrics.collector
+def count_running():
+    metrics.set_gauge('check_analysis_running', len(_running))
+    metrics.set_gauge('check_analysis_cache_hit_ratio', _results.stats['hit_ratio'])
@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import httpx
+from telegram.error import TimedOut
+from telegram.request import BaseRequest, HTTPXRequest
+
+import metrics
+
+
+class PooledRequest(HTTPXRequest):
+    """
+    HTTPXRequest with a tunable connection pool and pool-wait instrumentation
+
+    Requests wait for a free slot here rather than inside httpx, so the time
+    spent waiting for the pool is measured in the bot_api_pool_wait_seconds
+    histogram and saturation is visible before it turns into pool timeouts.
+    The pool timeout applies to that wait, like it would inside httpx.
+    Request latency per Bot API method and 429 responses are recorded too.
+
+    With http_version "2", HTTP/2 is offered but HTTP/1.1 stays allowed, so
+    servers without HTTP/2, like a local Bot API server, still work.
+
+    HTTPXRequest in python-telegram-bot 20.8 has no public way to pass httpx
+    options, so the keep-alive limits and the HTTP/1.1 fallback are set through
+    its private _client_kwargs and _build_client(). That's why requirements.txt
+    pins the library exactly; newer releases take them as httpx_kwargs instead.
+    """
+
+    def __init__(self, name, pool_size, keepalive_connections=None, keepalive_expiry=None,
+                 http_version='1.1', pool_timeout=None, **kwargs):
+        super().__init__(
+            connection_pool_size=pool_size,
+            http_version=http_version,
+            pool_timeout=pool_timeout,
+            **kwargs
+        )
+        self.name = name
+        self.pool_size = pool_size
+        self._slots = asyncio.Semaphore(pool_size)
+
+        if not hasattr(self, '_client_kwargs') or not hasattr(self, '_build_client'):
+            raise RuntimeError("This python-telegram-bot version changed HTTPXRequest; see PooledRequest")
+        # PTB alone would speak HTTP/2 only
+        self._client_kwargs['http1'] = True
+        self._client_kwargs['limits'] = httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=keepalive_connections if keepalive_connections is not None else pool_size,
+            keepalive_expiry=keepalive_expiry
+        )
+        self._client = self._build_client()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        if self._slots.locked():
+            metrics.inc('bot_api_pool_saturated_total', pool=self.name)
+
+        if isinstance(pool_timeout, type(BaseRequest.DEFAULT_NONE)):
+            pool_timeout = self._client.timeout.pool
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), pool_timeout)
+        except asyncio.TimeoutError:
+            metrics.inc('bot_api_pool_timeouts_total', pool=self.name)
+            raise TimedOut(
+                "Pool timeout: all connections in the connection pool are occupied. "
+                "Request was *not* sent to Telegram."
+            ) from None
+
+        try:
+            metrics.observe('bot_api_pool_wait_seconds', time.perf_counter() - started, pool=self.name)
+
+            # The Bot API method is the last part of the URL, e.g. .../sendMediaGroup
+            api_method = url.rsplit('/', 1)[-1]
+            started = time.perf_counter()
+            code, payload = await super().do_request(
+                url, method, request_data, read_timeout=read_timeout, write_timeout=write_timeout,
+                connect_timeout=connect_timeout, pool_timeout=pool_timeout
+            )
+            metrics.observe('bot_api_request_seconds', time.perf_counter() - started, method=api_method)
+            if code == 429:
+                metrics.inc('bot_api_rate_limited_total', method=api_method)
+            return code, payload
+        finally:
+            self._slots.release()
@@ -0,0 +1,112 @@
+"""
+Compact, versioned encoding of inline button callback_data
+
+Telegram allows 64 bytes of callback_data per button. Data is one version
+character, one action code and the action's fields separated by dots, with
+integers in base62: approving submission 12345 is "1a3D7" instead of
+"approve_" plus a 36-character UUID. Buttons sent before this format are
+still decoded, so old admin notifications keep working.
+"""
+from datetime import datetime, timedelta
+
+import ids
+
+VERSION = '1'
+SEPARATOR = '.'
+MAX_LENGTH = 64
+
+# Action name: (code, field types). Codes must never be reused, since old buttons stay clickable
+ACTIONS = {
+    'approve': ('a', (int,)),
+    'reject': ('r', (int,)),
+    'pending_before': ('b', (datetime, int)),
+    'pending_after': ('n', (datetime, int)),
+    'admin_confirm': ('c', (int, str)),
+    'admin_cancel': ('x', (int, str)),
+}
+_CODES = {code: (action, types) for action, (code, types) in ACTIONS.items()}
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# Usernames and base62 never contain the separator, so fields need no escaping
+_ENCODERS = {
+    int: ids.encode,
+    str: str,
+    datetime: lambda value: ids.encode((value - _EPOCH) // _MICROSECOND),
+}
+_DECODERS = {
+    int: ids.decode,
+    str: str,
+    datetime: lambda text: _EPOCH + ids.decode(text) * _MICROSECOND,
+}
+
+# Formats used before the compact one
+LEGACY_CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+_LEGACY_ACTIONS = {
+    'approve': 'approve', 'reject': 'reject', 'pending': 'pending', 'confirm': 'admin_confirm', 'cancel': 'admin_cancel'
+}
+
+
+def encode(action, *fields):
+    """
+    Returns:
+        str: callback_data for the action
+
+    Raises:
+        ValueError: If the encoded data exceeds Telegram's 64 bytes
+    """
+    code, types = ACTIONS[action]
+    data = VERSION + code + SEPARATOR.join(_ENCODERS[kind](field) for kind, field in zip(types, fields))
+    if len(data.encode()) > MAX_LENGTH:
+        raise ValueError(f"callback_data for {action} is longer than {MAX_LENGTH} bytes")
+    return data
+
+
+def decode(data):
+    """
+    Decode callback_data with a fixed-position lookup instead of trying every format
+
+    Returns:
+        tuple[str | None, list]: Action name and its fields, or (None, []) if the
+            data isn't a known action. Legacy approve/reject buttons carry the
+            public submission ID (str) instead of the row ID (int)
+    """
+    if not isinstance(data, str):
+        return None, []
+    entry = _CODES.get(data[1:2]) if data[:1] == VERSION else None
+    if entry is None:
+        return _decode_legacy(data)
+
+    action, types = entry
+    values = data[2:].split(SEPARATOR, len(types) - 1)
+    if len(values) != len(types):
+        return None, []
+    try:
+        return action, [_DECODERS[kind](value) for kind, value in zip(types, values)]
+    except ValueError:
+        return None, []
+
+
+def _decode_legacy(data):
+    """Decode "approve_<id>", "pending_after_<cursor>_<id>", "confirm_<user id>_<username>" and the like"""
+    prefix, _, rest = data.partition('_')
+    action = _LEGACY_ACTIONS.get(prefix)
+    try:
+        if action in ('approve', 'reject'):
+            return action, [rest]
+        if action == 'pending':
+            direction, created_at, row_id = rest.split('_')
+            return f'pending_{direction}', [datetime.strptime(created_at, LEGACY_CURSOR_FORMAT), int(row_id)]
+        if action in ('admin_confirm', 'admin_cancel'):
+            user_id, username = rest.split('_', 1)
+            return action, [int(user_id), username]
+    except ValueError:
+        pass
+    return None, []
+
+
+def pattern(*actions):
+    """CallbackQueryHandler pattern matching callback_data of the given actions"""
+    actions = frozenset(actions)
+    return lambda data: decode(data)[0] in actions
@@ -8,8 +8,136 @@ load_dotenv()
 # Bot configuration
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 CHANNEL_ID = os.getenv('CHANNEL_ID')
+# Admins are stored in the database; these are added on every start so the bot always has one
 ADMIN_IDS = [int(id) for id in os.getenv('ADMIN_IDS').split(',')]
 DATABASE_URL = os.getenv('DATABASE_URL')
+# Bot API endpoint; point it at a local Bot API server or the load-test fake
+BOT_API_URL = os.getenv('BOT_API_URL', 'https://api.telegram.org/bot')
+
+# Database engine profile. On SQLite, WAL lets readers run alongside the single
+# writer, and NORMAL sync is crash-safe in WAL mode while skipping an fsync per commit
+DB_SQLITE_JOURNAL_MODE = os.getenv('DB_SQLITE_JOURNAL_MODE', 'WAL')
+DB_SQLITE_SYNCHRONOUS = os.getenv('DB_SQLITE_SYNCHRONOUS', 'NORMAL')
+DB_BUSY_TIMEOUT = int(os.getenv('DB_BUSY_TIMEOUT', 5000))  # Milliseconds to wait for SQLite's write lock
+DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', -64000))  # SQLite page cache per connection; negative is KiB
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 256 * 1024 * 1024))  # Bytes of the SQLite file read via mmap
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))  # Connections kept open
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))  # Extra connections opened under load
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))  # Seconds to wait for a free connection
+# Server databases only: test connections before use, and replace them before idle timeouts drop them
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 30 * 60))
+# Separate read-only pool for listing queries, so they never wait behind writers for a
+# connection; 0 sends them through the main pool. DATABASE_READ_URL may point at a replica
+DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', 4))
+DATABASE_READ_URL = os.getenv('DATABASE_READ_URL') or DATABASE_URL
+
+# Outgoing Bot API limits (messages per second)
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', 1))
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', 3))
+TELEGRAM_GROUP_RATE = float(os.getenv('TELEGRAM_GROUP_RATE', 20 / 60))
+NOTIFY_CONCURRENCY = int(os.getenv('NOTIFY_CONCURRENCY', 8))
+CLEANUP_CONCURRENCY = int(os.getenv('CLEANUP_CONCURRENCY', 5))  # Parallel single deletes when bulk deletion fails
+
+# Outgoing Bot API connection pools. Long polling keeps its own small pool so it
+# never competes with regular calls for connections
+BOT_API_POOL_SIZE = int(os.getenv('BOT_API_POOL_SIZE', 64))
+BOT_API_KEEPALIVE = int(os.getenv('BOT_API_KEEPALIVE', 32))  # Idle connections kept open
+BOT_API_KEEPALIVE_EXPIRY = float(os.getenv('BOT_API_KEEPALIVE_EXPIRY', 60))  # Seconds an idle connection is kept
+BOT_API_HTTP_VERSION = os.getenv('BOT_API_HTTP_VERSION', '2')  # "1.1", or "2" to also offer HTTP/2
+BOT_API_POOL_TIMEOUT = float(os.getenv('BOT_API_POOL_TIMEOUT', 10))  # Seconds a call waits for a free connection
+BOT_API_READ_TIMEOUT = float(os.getenv('BOT_API_READ_TIMEOUT', 10))
+GET_UPDATES_POOL_SIZE = int(os.getenv('GET_UPDATES_POOL_SIZE', 2))
+
+# Processes for CPU-bound work: photo hashing and check analysis
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', 2))
+
+# Duplicate photo detection. Perceptual hashes also need Pillow installed
+PHASH_ENABLED = os.getenv('PHASH_ENABLED', 'true').lower() == 'true'
+PHASH_MAX_DISTANCE = int(os.getenv('PHASH_MAX_DISTANCE', 3))  # Differing bits still counted as a near-duplicate; at most 3
+
+# Check photo analysis, run in the worker processes. Also needs Pillow installed
+ANALYSIS_ENABLED = os.getenv('ANALYSIS_ENABLED', 'true').lower() == 'true'
+ANALYSIS_MIN_SIDE = int(os.getenv('ANALYSIS_MIN_SIDE', 640))  # Smallest photo size downloaded for analysis
+ANALYSIS_CACHE_SIZE = int(os.getenv('ANALYSIS_CACHE_SIZE', 1000))
+ANALYSIS_CACHE_TTL = int(os.getenv('ANALYSIS_CACHE_TTL', 24 * 60 * 60))
+ANALYSIS_TIMEOUT = float(os.getenv('ANALYSIS_TIMEOUT', 30))  # Seconds admin notifications wait for a running analysis
+
+# Seconds without another photo after which an album is taken to be complete and acknowledged
+ALBUM_DEBOUNCE = float(os.getenv('ALBUM_DEBOUNCE', 1))
+
+# Admin registry
+ADMIN_REFRESH_INTERVAL = float(os.getenv('ADMIN_REFRESH_INTERVAL', 5))  # Seconds between checks for changes by other processes
+ADMIN_VERIFICATION_TTL = int(os.getenv('ADMIN_VERIFICATION_TTL', 24 * 60 * 60))  # Seconds a /addadmin request stays open
+
+# Throttling of incoming updates. Per-user buckets allow a full album (10 photos) at once
+THROTTLE_USER_RATE = float(os.getenv('THROTTLE_USER_RATE', 2))  # Updates per second per user
+THROTTLE_USER_BURST = int(os.getenv('THROTTLE_USER_BURST', 20))
+THROTTLE_GLOBAL_RATE = float(os.getenv('THROTTLE_GLOBAL_RATE', 100))  # Updates per second overall
+THROTTLE_GLOBAL_BURST = int(os.getenv('THROTTLE_GLOBAL_BURST', 200))
+THROTTLE_MAX_DELAY = float(os.getenv('THROTTLE_MAX_DELAY', 2))  # Seconds an update may be deferred before it's dropped
+THROTTLE_MAX_USERS = int(os.getenv('THROTTLE_MAX_USERS', 10000))  # Per-user buckets kept in memory
+THROTTLE_USER_TTL = int(os.getenv('THROTTLE_USER_TTL', 60))  # Seconds before an idle user's bucket is forgotten
+
+# Concurrent update processing. Updates from different users run in parallel;
+# each user's updates still run one at a time, in the order they arrived. More than
+# the database connection pool (DB_POOL_SIZE + DB_MAX_OVERFLOW) only adds lock contention on SQLite
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', 16))  # Updates being handled at once
+# Updates handled or waiting for their user's turn. As many more wait in the update queue;
+# past that, polling pauses and Telegram keeps the rest
+UPDATE_QUEUE_LIMIT = int(os.getenv('UPDATE_QUEUE_LIMIT', 4096))
+
+# Conversation state persistence (seconds)
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', 5))
+DRAFT_TTL = int(os.getenv('DRAFT_TTL', 24 * 60 * 60))  # Idle drafts older than this are evicted
+EVICTION_INTERVAL = int(os.getenv('EVICTION_INTERVAL', 10 * 60))
+
+# In-process cache of users table rows
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 5 * 60))
+
+# Submissions shown per /pending page
+PENDING_PAGE_SIZE = int(os.getenv('PENDING_PAGE_SIZE', 5))
+
+# Bulk moderation (/approveall, /rejectall)
+BULK_MODERATION_LIMIT = int(os.getenv('BULK_MODERATION_LIMIT', 500))
+# Seconds a bulk approval waits for the outbox to publish another submission before it stops
+# reporting progress; the rest are still published, and their submitters notified one by one
+BULK_PUBLISH_TIMEOUT = float(os.getenv('BULK_PUBLISH_TIMEOUT', 10 * 60))
+
+# Outbox of channel posts and notifications
+OUTBOX_CONCURRENCY = int(os.getenv('OUTBOX_CONCURRENCY', 4))
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 20))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 5))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8))
+OUTBOX_BASE_BACKOFF = float(os.getenv('OUTBOX_BASE_BACKOFF', 2))  # Seconds, doubled per attempt
+OUTBOX_MAX_BACKOFF = float(os.getenv('OUTBOX_MAX_BACKOFF', 10 * 60))
+# Seconds before a claimed message is retried by another worker. Batches are capped to what
+# the channel's rate limit lets through in half of it
+OUTBOX_LEASE = int(os.getenv('OUTBOX_LEASE', 2 * 60))
+
+# Write-behind queue grouping confirmed submissions into shared transactions
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', 100))
+WRITE_BATCH_DELAY = float(os.getenv('WRITE_BATCH_DELAY', 0.01))  # Seconds to wait for more writes
+
+# Update delivery: "polling" or "webhook"
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Public base URL Telegram posts updates to
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # Required; Telegram sends it with every update
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+# Each worker process keeps its own conversation state, so startup refuses
+# anything but 1 until that state is shared between processes
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 1))
+
+# Prometheus metrics endpoint, on its own port so it's never public alongside the
+# webhook; 0 disables it
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '0.0.0.0')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+# Off skips recording altogether: handler, query and Bot API timings and counters
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
 
 # Set up logging
 logging.basicConfig(
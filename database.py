@@ -1,14 +1,246 @@
+import time
+
 import sqlalchemy as db
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
-from config import DATABASE_URL
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from config import (
+    DATABASE_URL, DATABASE_READ_URL, DB_SQLITE_JOURNAL_MODE, DB_SQLITE_SYNCHRONOUS, DB_BUSY_TIMEOUT,
+    DB_CACHE_SIZE, DB_MMAP_SIZE, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE, DB_READ_POOL_SIZE, METRICS_ENABLED
+)
+import metrics
+
+# Dialect-specific INSERT supporting ON CONFLICT
+_INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+# Async drivers used for each sync dialect in DATABASE_URL
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+def to_async_url(url):
+    """
+    Convert a sync database URL into its async driver equivalent
+
+    URLs naming a sync driver, e.g. postgresql+psycopg2://, get the async driver
+    too; URLs already naming an async driver are left alone.
+
+    Args:
+        url (str): Database URL, e.g. sqlite:///foodbot.db
+
+    Returns:
+        URL: The same URL using an async driver, e.g. sqlite+aiosqlite:///foodbot.db
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend in ASYNC_DRIVERS and not url.get_dialect().is_async:
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+    return url
+
+
+def _in_memory(url):
+    """Whether the URL is an in-memory SQLite database, private to its connection"""
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW):
+    """
+    Connection pool settings for an engine on this database
+
+    Args:
+        url (str | URL): Database URL
+        pool_size (int): Connections kept open
+        max_overflow (int): Extra connections opened under load
+
+    Returns:
+        dict: Keyword arguments for create_engine() and create_async_engine()
+    """
+    url = make_url(url)
+    if _in_memory(url):
+        # An in-memory database lives in a single connection, so there is no pool to size
+        return {}
+    options = {'pool_size': pool_size, 'max_overflow': max_overflow, 'pool_timeout': DB_POOL_TIMEOUT}
+    if url.drivername == 'sqlite+aiosqlite':
+        # SQLAlchemy 2.0.23 opens a new connection per session here unless told to pool them
+        options['poolclass'] = AsyncAdaptedQueuePool
+    elif url.get_backend_name() != 'sqlite':
+        # Server connections get dropped by restarts, failovers and idle timeouts in proxies
+        options.update(pool_pre_ping=DB_POOL_PRE_PING, pool_recycle=DB_POOL_RECYCLE)
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply the SQLite profile to every new connection"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f'PRAGMA journal_mode = {DB_SQLITE_JOURNAL_MODE}')
+    cursor.execute(f'PRAGMA synchronous = {DB_SQLITE_SYNCHRONOUS}')
+    cursor.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT}')
+    cursor.execute(f'PRAGMA cache_size = {DB_CACHE_SIZE}')
+    cursor.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+    cursor.close()
+
+
+def _set_sqlite_read_only(dbapi_connection, connection_record):
+    """Refuse writes on SQLite connections of the read-only pool"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA query_only = ON')
+    cursor.close()
+
+
+def _set_read_only(dbapi_connection, connection_record):
+    """Refuse writes on server connections of the read-only pool"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY')
+    cursor.close()
+    # SET is transactional; commit so it outlasts the pool's rollback on checkin
+    dbapi_connection.commit()
+
+
+def _profile(engine, read_only=False):
+    """Attach the connection setup for the engine's database"""
+    sqlite = engine.dialect.name == 'sqlite'
+    if sqlite:
+        db.event.listen(engine, 'connect', _set_sqlite_pragmas)
+    if read_only:
+        db.event.listen(engine, 'connect', _set_sqlite_read_only if sqlite else _set_read_only)
+    return engine
+
 
 # Database setup
 Base = declarative_base()
-engine = db.create_engine(DATABASE_URL)
+engine = _profile(db.create_engine(DATABASE_URL, **engine_options(DATABASE_URL)))
 Session = sessionmaker(bind=engine)
 
+# Async engine used by the handlers so queries don't block the event loop
+async_url = to_async_url(DATABASE_URL)
+async_engine = create_async_engine(async_url, **engine_options(async_url))
+_profile(async_engine.sync_engine)
+AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+# Listing queries get their own read-only pool, if one is configured. A second
+# in-memory engine would be a different, empty database
+if DB_READ_POOL_SIZE and not _in_memory(DATABASE_READ_URL):
+    read_url = to_async_url(DATABASE_READ_URL)
+    read_engine = create_async_engine(read_url, **engine_options(read_url, DB_READ_POOL_SIZE, 0))
+    _profile(read_engine.sync_engine, read_only=True)
+else:
+    read_engine = async_engine
+ReadSession = async_sessionmaker(read_engine, expire_on_commit=False)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Labelled by statement type only, to keep the number of series small
+    operation = statement.lstrip().split(None, 1)[0].upper()
+    metrics.observe('db_query_seconds', time.perf_counter() - context.query_started, operation=operation)
+
+
+# Count and time every query on every engine
+if METRICS_ENABLED:
+    for _engine in {engine, async_engine.sync_engine, read_engine.sync_engine}:
+        db.event.listen(_engine, 'before_cursor_execute', _before_cursor_execute)
+        db.event.listen(_engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def insert_for(bind):
+    """
+    Returns:
+        callable: insert() of the engine's or connection's dialect, supporting ON CONFLICT
+    """
+    return _INSERTS[bind.dialect.name]
+
+
 def init_db():
-    """Initialize database tables"""
-    from models import User, Submission, Image
+    """Initialize database tables and add the ADMIN_IDS admins"""
+    from models import (
+        User, Submission, Image, SavedDraft, SavedConversation, OutboxMessage, Admin, PendingAdmin,
+        RegistryVersion
+    )
+    from admins import seed_admins
+
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        upgrade_db(connection)
+        seed_admins(connection)
+
+
+def upgrade_db(connection):
+    """
+    Bring a database created by an older version up to date
+
+    create_all() skips tables that already exist, so nullable columns and
+    indexes added to the models later are created here.
+
+    Args:
+        connection (Connection): Connection inside a transaction
+    """
+    _rekey_images(connection)
+
+    inspector = db.inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
+
+
+def _rekey_images(connection):
+    """
+    Point images at submissions.id instead of the public submission_id string
+
+    Column types can't be changed in place on SQLite, so the table is copied
+    into a new one with the current schema, looking up each image's
+    submission row ID on the way. Runs once; afterwards the column is an integer.
+    """
+    inspector = db.inspect(connection)
+    if 'images' not in inspector.get_table_names():
+        return
+    old_columns = {column['name']: column['type'] for column in inspector.get_columns('images')}
+    if isinstance(old_columns['submission_id'], db.Integer):
+        return
+
+    images = Base.metadata.tables['images']
+    new_images = images.to_metadata(Base.metadata, name='images_new')
+    # Indexes are named after the table, so upgrade_db creates them once the copy is renamed
+    new_images.indexes.clear()
+    try:
+        new_images.create(connection)
+    finally:
+        Base.metadata.remove(new_images)
+
+    # Columns added since the old table was created stay NULL
+    copied = [column.name for column in images.columns if column.name in old_columns and column.name != 'submission_id']
+    connection.execute(db.text(
+        f'INSERT INTO images_new (submission_id, {", ".join(copied)}) '
+        f'SELECT submissions.id, {", ".join(f"images.{name}" for name in copied)} '
+        f'FROM images LEFT JOIN submissions ON submissions.submission_id = images.submission_id'
+    ))
+    connection.execute(db.text('DROP TABLE images'))
+    connection.execute(db.text('ALTER TABLE images_new RENAME TO images'))
+    if connection.dialect.name == 'postgresql':
+        # Rows were copied with their IDs, which doesn't advance the ID sequence
+        connection.execute(db.text(
+            "SELECT setval(pg_get_serial_sequence('images', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM images"
+        ))
+
 
-    Base.metadata.create_all(engine)
\ No newline at end of file
+async def close_db(application=None):
+    """Dispose of the async engines' connection pools"""
+    await async_engine.dispose()
+    if read_engine is not async_engine:
+        await read_engine.dispose()
@@ -0,0 +1,153 @@
+import io
+
+from sqlalchemy import select, or_
+
+from config import PHASH_ENABLED, PHASH_MAX_DISTANCE, logger
+from database import ReadSession
+from models import Image, Submission
+from workers import run_in_process
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+# dHash size and how it is split into indexed bands. Two hashes at most
+# BANDS - 1 bits apart share at least one band, so looking up every band
+# finds all near-duplicates within that distance
+HASH_BITS = 64
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+# Candidate rows checked per lookup; very common bands (e.g. plain images) would otherwise match everything
+MAX_CANDIDATES = 200
+
+# The bands are fixed by the image table's columns, so wider distances would silently miss matches
+if PHASH_MAX_DISTANCE > BANDS - 1:
+    raise ValueError(f"PHASH_MAX_DISTANCE must be at most {BANDS - 1}, got {PHASH_MAX_DISTANCE}")
+
+
+def dhash(data):
+    """
+    Difference hash of an image: one bit per pixel pair of an 9x8 grayscale thumbnail
+
+    Runs in a worker process.
+
+    Args:
+        data (bytes): Encoded image
+
+    Returns:
+        int: Unsigned 64-bit hash
+    """
+    with PILImage.open(io.BytesIO(data)) as image:
+        pixels = list(image.convert('L').resize((9, 8), PILImage.Resampling.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = value << 1 | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def hamming(a, b):
+    """Number of differing bits between two hashes, signed or unsigned"""
+    return bin((a ^ b) & ((1 << HASH_BITS) - 1)).count('1')
+
+
+def hash_columns(file_unique_id, phash):
+    """
+    Image column values for a photo's unique ID and perceptual hash
+
+    Args:
+        file_unique_id (str): Telegram's ID for the file, stable across uploads
+        phash (int): Unsigned hash from dhash(), or None
+
+    Returns:
+        dict: Values for file_unique_id, phash and the phash_band columns
+    """
+    columns = {'file_unique_id': file_unique_id, 'phash': None}
+    for band in range(BANDS):
+        columns[f'phash_band{band}'] = None
+    if phash is not None:
+        # Stored signed, since databases have no unsigned 64-bit integers
+        columns['phash'] = phash - (1 << HASH_BITS) if phash >= 1 << (HASH_BITS - 1) else phash
+        for band in range(BANDS):
+            columns[f'phash_band{band}'] = phash >> (band * BAND_BITS) & ((1 << BAND_BITS) - 1)
+    return columns
+
+
+async def compute_hash(bot, photo):
+    """
+    Perceptual hash of a photo, computed from its smallest size
+
+    Returns:
+        int: Unsigned hash, or None if hashing is disabled, Pillow is missing or the download failed
+    """
+    if not PHASH_ENABLED or PILImage is None:
+        return None
+    try:
+        file = await bot.get_file(photo[0].file_id)
+        data = bytes(await file.download_as_bytearray())
+        return await run_in_process(dhash, data)
+    except Exception as e:
+        logger.error(f"Error hashing photo {photo[-1].file_unique_id}: {e}")
+        return None
+
+
+async def find_duplicates(file_unique_id, phash=None, max_distance=PHASH_MAX_DISTANCE):
+    """
+    Find stored submissions containing the same or a nearly identical photo
+
+    Uses the file_unique_id index for exact matches and the band indexes for
+    near-duplicates, so the lookup stays logarithmic in the number of images.
+    Exact matches are looked up on their own, so the candidate limit never drops them.
+
+    Returns:
+        list[str]: IDs of matching submissions
+    """
+    if max_distance > BANDS - 1:
+        raise ValueError(f"max_distance must be at most {BANDS - 1}, got {max_distance}")
+
+    query = (
+        select(Submission.submission_id, Image.file_unique_id, Image.phash)
+        .join(Submission, Submission.id == Image.submission_id)
+    )
+    columns = hash_columns(file_unique_id, phash)
+
+    async with ReadSession() as session:
+        rows = (await session.execute(query.where(Image.file_unique_id == file_unique_id))).all()
+        if phash is not None:
+            rows += (await session.execute(
+                query.where(or_(*(
+                    getattr(Image, f'phash_band{band}') == columns[f'phash_band{band}'] for band in range(BANDS)
+                )))
+                .limit(MAX_CANDIDATES)
+            )).all()
+
+    matches = []
+    for submission_id, unique_id, stored in rows:
+        if unique_id == file_unique_id or (
+            stored is not None and hamming(stored, columns['phash']) <= max_distance
+        ):
+            if submission_id not in matches:
+                matches.append(submission_id)
+    return matches
+
+
+async def check_photo(bot, photo):
+    """
+    Identify an uploaded photo and look for earlier submissions that contain it
+
+    Args:
+        bot (Bot): Bot used to download the photo for hashing
+        photo (list[PhotoSize]): Sizes of the uploaded photo, smallest first
+
+    Returns:
+        tuple[list, list[str]]: [file_unique_id, phash] to store with the image, and duplicate submission IDs
+    """
+    file_unique_id = photo[-1].file_unique_id
+    phash = await compute_hash(bot, photo)
+    try:
+        duplicates = await find_duplicates(file_unique_id, phash)
+    except Exception as e:
+        logger.error(f"Error looking up duplicates of photo {file_unique_id}: {e}")
+        duplicates = []
+    return [file_unique_id, phash], duplicates
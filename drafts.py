@@ -0,0 +1,89 @@
+import time
+
+
+class Draft:
+    """
+    Per-user submission draft used as context.user_data
+
+    Supports the subset of the dict interface the handlers use, but only for
+    the fields below, so every user costs a fixed number of slots instead of
+    a free-form dict. Unset fields behave like missing keys.
+    """
+
+    # New fields must be appended so rows saved by older versions still load
+    FIELDS = (
+        'nickname', 'image_count', 'images', 'current_image', 'check_image',
+        'people_count', 'delivery_source', 'submission_id', 'messages',
+        'image_keys', 'check_key', 'duplicates'
+    )
+
+    __slots__ = FIELDS + ('touched_at',)
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        for field in self.FIELDS:
+            setattr(self, field, None)
+        self.touched_at = time.time()
+
+    def _check(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+
+    def __getitem__(self, key):
+        self._check(key)
+        value = getattr(self, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._check(key)
+        setattr(self, key, value)
+        self.touched_at = time.time()
+
+    def __delitem__(self, key):
+        self[key] = None
+
+    def __contains__(self, key):
+        return key in self.FIELDS and getattr(self, key) is not None
+
+    def __iter__(self):
+        return (field for field in self.FIELDS if getattr(self, field) is not None)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return getattr(self, key)
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        if key in self:
+            del self[key]
+        return value
+
+    def to_row(self):
+        """
+        Serialize the draft into a compact list
+
+        Returns:
+            list: Field values in FIELDS order followed by touched_at
+        """
+        return [getattr(self, field) for field in self.FIELDS] + [self.touched_at]
+
+    @classmethod
+    def from_row(cls, row):
+        """Rebuild a draft serialized with to_row()"""
+        draft = cls()
+        # Rows written before a field was added are shorter, so missing fields stay unset
+        *values, draft.touched_at = row
+        for field, value in zip(cls.FIELDS, values):
+            setattr(draft, field, value)
+        return draft
+
+    def __repr__(self):
+        return f"Draft({', '.join(f'{key}={getattr(self, key)!r}' for key in self)})"
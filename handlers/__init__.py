@@ -1,4 +1,7 @@
-from telegram.ext import ConversationHandler, CommandHandler, CallbackQueryHandler
+from collections import Counter
+
+from telegram import Update
+from telegram.ext import ConversationHandler, CommandHandler, CallbackQueryHandler, TypeHandler
 
 from .start_handler import start, change_nickname, cancel
 from .submission_handler import (
@@ -6,11 +9,49 @@ from .submission_handler import (
     get_people_count, get_delivery_source, confirm_submission,
    submit_command
 )
-from .admin_handler import admin_action, delete_post, list_pending, add_admin, verify_admin, admin_confirmation_callback
+from .admin_handler import (
+    admin_action, approve_all, reject_all, delete_post, list_pending, pending_page, add_admin, verify_admin,
+    admin_confirmation_callback
+)
 from .general_handler import help_command
 
+from throttle import UpdateThrottle
 from config import START, NICKNAME, IMAGE_COUNT, UPLOAD_IMAGES, UPLOAD_CHECK, PEOPLE_COUNT, DELIVERY_SOURCE, CONFIRM
+from config import logger
 from telegram.ext import MessageHandler, filters
+import metrics
+import callbacks
+
+# Conversation state names used as metric labels
+STATE_NAMES = {
+    START: 'START', NICKNAME: 'NICKNAME', IMAGE_COUNT: 'IMAGE_COUNT', UPLOAD_IMAGES: 'UPLOAD_IMAGES',
+    UPLOAD_CHECK: 'UPLOAD_CHECK', PEOPLE_COUNT: 'PEOPLE_COUNT', DELIVERY_SOURCE: 'DELIVERY_SOURCE',
+    CONFIRM: 'CONFIRM'
+}
+
+
+def instrument(handler):
+    """Record the latency of a handler's callback, and of every handler inside a ConversationHandler"""
+    if isinstance(handler, ConversationHandler):
+        nested = handler.entry_points + handler.fallbacks
+        for handlers in handler.states.values():
+            nested += handlers
+        for inner in nested:
+            instrument(inner)
+        return
+
+    callback = handler.callback
+    if getattr(callback, '__wrapped__', None):
+        # Already instrumented, e.g. a handler shared between entry points and states
+        return
+    name = getattr(callback, '__name__', type(callback).__name__)
+    handler.callback = metrics.timed('handler_seconds', handler=name)(callback)
+
+
+async def error_handler(update, context):
+    """Log exceptions raised by handlers and count them"""
+    metrics.inc('handler_errors_total', error=type(context.error).__name__)
+    logger.error("Error while handling an update", exc_info=context.error)
 
 
 def setup_handlers(application):
@@ -32,18 +73,42 @@ def setup_handlers(application):
             UPLOAD_CHECK: [MessageHandler(filters.PHOTO, upload_check)],
             PEOPLE_COUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_people_count)],
             DELIVERY_SOURCE: [CallbackQueryHandler(get_delivery_source, pattern=r'^source_')],
-            CONFIRM: [CallbackQueryHandler(confirm_submission, pattern=r'^confirm_')]
+            CONFIRM: [CallbackQueryHandler(confirm_submission, pattern=r'^confirm_(yes|no)$')]
         },
         fallbacks=[CommandHandler('cancel', cancel)],
-        allow_reentry=True
+        allow_reentry=True,
+        name='submission',
+        persistent=True
     )
 
+    # Throttle every update before any other handler sees it
+    application.add_handler(TypeHandler(Update, UpdateThrottle()), group=-1)
+
     # Add all handlers
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler('help', help_command))
-    application.add_handler(CallbackQueryHandler(admin_action, pattern=r'^(approve|reject)_'))
+    application.add_handler(CallbackQueryHandler(admin_action, pattern=callbacks.pattern('approve', 'reject')))
     application.add_handler(CommandHandler("addadmin", add_admin))
     application.add_handler(CommandHandler("verifyadmin", verify_admin))
-    application.add_handler(CallbackQueryHandler(admin_confirmation_callback, pattern=r"^(confirm|cancel)_"))
+    application.add_handler(CallbackQueryHandler(
+        admin_confirmation_callback, pattern=callbacks.pattern('admin_confirm', 'admin_cancel')
+    ))
     application.add_handler(CommandHandler('delete', delete_post))
-    application.add_handler(CommandHandler('pending', list_pending))
\ No newline at end of file
+    application.add_handler(CommandHandler('pending', list_pending))
+    application.add_handler(CommandHandler('approveall', approve_all))
+    application.add_handler(CommandHandler('rejectall', reject_all))
+    application.add_handler(CallbackQueryHandler(
+        pending_page, pattern=callbacks.pattern('pending_before', 'pending_after')
+    ))
+    application.add_error_handler(error_handler)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            instrument(handler)
+
+    @metrics.collector
+    def count_conversation_states():
+        conversations = application._conversation_handler_conversations.get(conv_handler.name, {})
+        counts = Counter(conversations.values())
+        for state, name in STATE_NAMES.items():
+            metrics.set_gauge('conversation_users', counts.get(state, 0), state=name)
\ No newline at end of file
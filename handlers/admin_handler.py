@@ -1,132 +1,143 @@
-from dotenv import set_key, load_dotenv
-from telegram import Update, InputMediaPhoto, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
-from database import Session
-from models import Submission, Image
-import os
+from sqlalchemy import select
+from database import AsyncSession
+from models import Submission
+from repository import get_pending_page
+import time
 from utils import is_admin
-from config import CHANNEL_ID, logger
+from config import CHANNEL_ID, BULK_MODERATION_LIMIT, logger
+from moderation import bulk_moderate, claim, transition
+from outbox import outbox, enqueue
+from admins import admin_registry, request_admin, start_verification, finish_verification
+import callbacks
+
+# Seconds between bulk moderation progress updates
+PROGRESS_INTERVAL = 3
+
+# Pending pages remembered per chat so they can be refreshed after an approve/reject
+MAX_TRACKED_PAGES = 20
+
 
-load_dotenv()
 async def admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle admin approval/rejection of submissions"""
     query = update.callback_query
-    await query.answer()
 
     user_id = update.effective_user.id
     if not await is_admin(user_id):
+        await query.answer()
         return
 
-    action, submission_id = query.data.split('_', 1)
+    action, fields = callbacks.decode(query.data)
+    if not fields:
+        await query.answer("Invalid callback data format.")
+        return
 
-    session = Session()
-    submission = session.query(Submission).filter_by(submission_id=submission_id).first()
+    key, = fields
+    # Buttons sent before the compact callback format carry the public ID instead of the row ID
+    condition = Submission.id == key if isinstance(key, int) else Submission.submission_id == key
 
-    if not submission:
-        await query.message.reply_text("Submission not found.")
-        session.close()
-        return
+    with claim(key) as claimed:
+        if not claimed:
+            # Another admin's click is being handled right now; answer without touching the database
+            await query.answer("Another admin is already handling this submission.")
+            return
+
+        async with AsyncSession() as session:
+            # Only succeeds while the submission is still pending
+            submission = await transition(session, condition, action)
+
+            if not submission:
+                status = await session.scalar(select(Submission.status).where(condition))
+                await query.answer(f"Submission already {status}." if status else "Submission not found.")
+                return
+
+            submission_id = submission.submission_id
+            if action == "approve":
+                # Queue the channel post in the same transaction, so the post is
+                # published exactly once even if Telegram fails or we crash
+                await enqueue(session, 'publish', f"publish:{submission_id}", {
+                    'submission_id': submission_id,
+                    'notify': True
+                })
+            else:
+                await enqueue(session, 'notify', f"notify:reject:{submission_id}", {
+                    'chat_id': submission.user_id,
+                    'text': "Your food combo submission was not approved."
+                })
+            await session.commit()
+        outbox.wake()
 
-    submitter_id = submission.user_id
+    await query.answer()
 
+    # Update the original message with confirmation
     if action == "approve":
-        # Update status in database
-        submission.status = "approved"
-
-        # Get all images - both food and check images
-        food_images = session.query(Image).filter_by(
-            submission_id=submission_id,
-            is_check_image=False
-        ).order_by(Image.sequence).all()
-
-        check_image = session.query(Image).filter_by(
-            submission_id=submission_id,
-            is_check_image=True
-        ).first()
-
-        # Create caption for the post
-        caption = (
-            "🍽️ <b>Food Combo Submission</b> 🚀\n\n"
-            f"👤 <b>Nickname:</b> {submission.nickname}\n"
-            f"📍 <b>Delivery From:</b> {submission.delivery_source}\n"
-            f"👥 <b>Serves:</b> {submission.people_count}\n"
-            f"🔥 <b>Why It’s a Great Deal:</b> { 'No description provided'}\n\n"
-            "📸 <b>Check out my food combo!</b> 😍\n\n"
-            "<b>Send your combo from @wwoffers_bot</b>"
-        )
-
-        # Prepare media group with all images
-        media_group = []
-
-        # Add first food image with caption
-        if food_images:
-            media_group.append(InputMediaPhoto(
-                media=food_images[0].file_id,
-                caption=caption,
-                parse_mode="HTML"
-            ))
-
-            # Add remaining food images without caption
-            for img in food_images[1:]:
-                media_group.append(InputMediaPhoto(media=img.file_id))
-
-        # Add check/payment image
-        if check_image:
-            media_group.append(InputMediaPhoto(media=check_image.file_id))
-
-        # Send all images as a single media group
-        if media_group:
-            messages = await context.bot.send_media_group(
-                chat_id=CHANNEL_ID,
-                media=media_group
-            )
+        new_text = f"✅ Submission {submission_id} approved and queued for publishing to the channel.\n\n"
+    else:
+        new_text = f"❌ Submission {submission_id} rejected.\n\n"
+    new_text += f"Nickname: {submission.nickname}\n"
+    new_text += f"People: {submission.people_count}\n"
+    new_text += f"Source: {submission.delivery_source}"
 
-            # Save the first message ID for reference
-            if messages:
-                submission.channel_post_id = messages[0].message_id
+    await _show_result(query, context, new_text)
 
-        session.commit()
 
-        # Notify user
-        try:
-            await context.bot.send_message(
-                chat_id=submitter_id,
-                text="Your food combo submission has been approved and published to the channel!"
-            )
-        except Exception as e:
-            logger.error(f"Error notifying user {submitter_id}: {e}")
+async def approve_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command to approve pending submissions in bulk"""
+    await _bulk_moderation(update, context, "approve")
+
+
+async def reject_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command to reject pending submissions in bulk"""
+    await _bulk_moderation(update, context, "reject")
+
+
+async def _bulk_moderation(update, context, action):
+    user_id = update.effective_user.id
+    if not await is_admin(user_id):
+        await update.message.reply_text("This command is only available to admins.")
+        return
 
-        # Update the original message with confirmation
-        new_text = f"✅ Submission {submission_id} approved and published to the channel.\n\n"
-        new_text += f"Nickname: {submission.nickname}\n"
-        new_text += f"People: {submission.people_count}\n"
-        new_text += f"Source: {submission.delivery_source}"
+    # Either a maximum count or a list of submission IDs
+    limit, submission_ids = BULK_MODERATION_LIMIT, None
+    if len(context.args) == 1 and context.args[0].isdigit():
+        limit = int(context.args[0])
+    elif context.args:
+        submission_ids = context.args
 
-        await query.message.edit_text(new_text)
+    verb = "Approving" if action == "approve" else "Rejecting"
+    status_msg = await update.message.reply_text(f"{verb} pending submissions...")
 
-    elif action == "reject":
-        # Update status in database
-        submission.status = "rejected"
-        session.commit()
+    last_report = 0
 
-        # Notify user
+    async def progress(done, total):
+        nonlocal last_report
+        now = time.monotonic()
+        # Editing a message is itself rate limited, so only report every few seconds
+        if done < total and now - last_report < PROGRESS_INTERVAL:
+            return
+        last_report = now
         try:
-            await context.bot.send_message(
-                chat_id=submitter_id,
-                text="Your food combo submission was not approved."
-            )
+            await status_msg.edit_text(f"{verb} submissions: {done}/{total}")
         except Exception as e:
-            logger.error(f"Error notifying user {submitter_id}: {e}")
+            logger.error(f"Error reporting bulk moderation progress: {e}")
 
-        # Update the original message with confirmation
-        new_text = f"❌ Submission {submission_id} rejected.\n\n"
-        new_text += f"Nickname: {submission.nickname}\n"
-        new_text += f"People: {submission.people_count}\n"
-        new_text += f"Source: {submission.delivery_source}"
+    async def run():
+        result = await bulk_moderate(action, submission_ids=submission_ids, limit=limit, progress=progress)
+        text = f"Done: {result['moderated']} submissions {'approved' if action == 'approve' else 'rejected'}."
+        if result['failed']:
+            text += f"\n{result['failed']} could not be published and are pending again."
+        if result['partial']:
+            text += f"\n{result['partial']} were only partly published; see the outbox for errors."
+        if result['queued']:
+            text += f"\n{result['queued']} are still queued and will be published when the outbox catches up."
+        await status_msg.edit_text(text)
+
+    # Publishing hundreds of posts takes minutes under the channel rate limit,
+    # so don't hold up other updates while it runs
+    context.application.create_task(run(), update=update)
 
-        await query.message.edit_text(new_text)
 
-    session.close()
 async def delete_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin command to delete a published post"""
     user_id = update.effective_user.id
@@ -140,34 +151,39 @@ async def delete_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     submission_id = context.args[0]
 
-    session = Session()
-    submission = session.query(Submission).filter_by(submission_id=submission_id).first()
-
-    if not submission or submission.status != "approved" or not submission.channel_post_id:
-        await update.message.reply_text("No published post found with that ID.")
-        session.close()
-        return
-
-    # Delete from channel
-    try:
-        await context.bot.delete_message(
-            chat_id=CHANNEL_ID,
-            message_id=submission.channel_post_id
-        )
+    with claim(submission_id) as claimed:
+        if not claimed:
+            await update.message.reply_text("This submission is already being moderated.")
+            return
 
-        # Update status in database
-        submission.status = "deleted"
-        submission.channel_post_id = None
-        session.commit()
+        async with AsyncSession() as session:
+            channel_post_id = await session.scalar(
+                select(Submission.channel_post_id).filter_by(submission_id=submission_id, status="approved")
+            )
+            # Mark the post deleted first, so only one admin goes on to delete it
+            deleted = channel_post_id and await transition(
+                session, Submission.submission_id == submission_id, "delete", channel_post_id=None
+            )
+            await session.commit()
 
-        await update.message.reply_text(f"Post with ID {submission_id} has been deleted from the channel.")
-    except Exception as e:
-        await update.message.reply_text(f"Error deleting post: {e}")
-    finally:
-        session.close()
+        if not deleted:
+            await update.message.reply_text("No published post found with that ID.")
+            return
 
+        # Delete from channel
+        try:
+            await context.bot.delete_message(chat_id=CHANNEL_ID, message_id=channel_post_id)
+        except Exception as e:
+            # The post is still up, so put the submission back
+            async with AsyncSession() as session:
+                await transition(
+                    session, Submission.submission_id == submission_id, "restore", channel_post_id=channel_post_id
+                )
+                await session.commit()
+            await update.message.reply_text(f"Error deleting post: {e}")
+            return
 
-pending_admin_additions = {}
+    await update.message.reply_text(f"Post with ID {submission_id} has been deleted from the channel.")
 
 
 async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -189,6 +205,9 @@ async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if username.startswith('@'):
         username = username[1:]
 
+    # Store this pending admin request
+    await request_admin(username.lower(), user_id)
+
     # Send instructions to the admin
     await update.message.reply_text(
         f"To add @{username} as an admin, ask them to:\n\n"
@@ -197,12 +216,6 @@ async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Once they do this, you will receive a notification to confirm"
     )
 
-    # Store this pending admin request
-    pending_admin_additions[username.lower()] = {
-        'requester_id': user_id,
-        'status': 'pending'
-    }
-
 
 async def verify_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Command for users to verify their identity for admin addition"""
@@ -215,32 +228,28 @@ async def verify_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     username = username.lower()
 
-    # Check if this user has a pending admin addition
-    if username in pending_admin_additions and pending_admin_additions[username]['status'] == 'pending':
-        requester_id = pending_admin_additions[username]['requester_id']
-
-        # Send confirmation to the admin who requested this
-        keyboard = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("Confirm", callback_data=f"confirm_{user_id}_{username}"),
-                InlineKeyboardButton("Cancel", callback_data=f"cancel_{user_id}_{username}")
-            ]
-        ])
-
-        await context.bot.send_message(
-            chat_id=requester_id,
-            text=f"@{username} (ID: {user_id}) wants to be added as an admin. Confirm?",
-            reply_markup=keyboard
-        )
+    # Check if this user has a pending admin addition, and mark it as verifying
+    requester_id = await start_verification(username, user_id)
+    if requester_id is None:
+        await update.message.reply_text("There is no pending admin verification request for your username.")
+        return
 
-        # Notify the user
-        await update.message.reply_text("Verification request sent to the admin. Please wait for confirmation.")
+    # Send confirmation to the admin who requested this
+    keyboard = InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("Confirm", callback_data=callbacks.encode('admin_confirm', user_id, username)),
+            InlineKeyboardButton("Cancel", callback_data=callbacks.encode('admin_cancel', user_id, username))
+        ]
+    ])
+
+    await context.bot.send_message(
+        chat_id=requester_id,
+        text=f"@{username} (ID: {user_id}) wants to be added as an admin. Confirm?",
+        reply_markup=keyboard
+    )
 
-        # Update status
-        pending_admin_additions[username]['status'] = 'verifying'
-        pending_admin_additions[username]['user_id'] = user_id
-    else:
-        await update.message.reply_text("There is no pending admin verification request for your username.")
+    # Notify the user
+    await update.message.reply_text("Verification request sent to the admin. Please wait for confirmation.")
 
 async def admin_confirmation_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle admin confirmation callbacks"""
@@ -254,38 +263,23 @@ async def admin_confirmation_callback(update: Update, context: ContextTypes.DEFA
         await query.edit_message_text("You are not authorized to perform this action.")
         return
 
-    # Parse the callback data more safely
-    parts = query.data.split('_')
-    action = parts[0]  # confirm or cancel
-
-    if len(parts) < 3:
+    action, fields = callbacks.decode(query.data)
+    if not fields:
         await query.edit_message_text("Invalid callback data format.")
         return
 
-    user_id_to_add = int(parts[2])
-    username = parts[3] if len(parts) > 3 else "Unknown"
+    user_id_to_add, username = fields
 
-    if action == "confirm":
-        # Get current admin IDs from .env
-        admin_ids_str = os.getenv('ADMIN_IDS', '')
-        admin_ids = [int(id.strip()) for id in admin_ids_str.split(',') if id.strip()]
+    # Only act on a request that is still waiting, so a button can't be used twice or after it expired
+    if not await finish_verification(username, user_id_to_add):
+        await query.edit_message_text(f"The admin request for @{username} has expired or was already handled.")
+        return
 
-        # Check if user is already an admin
-        if user_id_to_add in admin_ids:
+    if action == "admin_confirm":
+        if not await admin_registry.add(user_id_to_add, username, added_by=user_id):
             await query.edit_message_text(f"User @{username} is already an admin.")
             return
 
-        # Add new admin ID to the list
-        admin_ids.append(user_id_to_add)
-
-        # Update .env file with the new admin list
-        new_admin_ids_str = ','.join(str(id) for id in admin_ids)
-        dotenv_path = os.path.join(os.getcwd(), '.env')
-        set_key(dotenv_path, 'ADMIN_IDS', new_admin_ids_str)
-
-        # Reload environment variables
-        load_dotenv()
-
         await query.edit_message_text(f"✅ Successfully added @{username} as an admin.")
 
         # Notify the new admin
@@ -297,11 +291,7 @@ async def admin_confirmation_callback(update: Update, context: ContextTypes.DEFA
         except Exception as e:
             logger.error(f"Error notifying new admin {user_id_to_add}: {e}")
 
-        # Clean up pending addition
-        if username.lower() in pending_admin_additions:
-            del pending_admin_additions[username.lower()]
-
-    elif action == "cancel":
+    elif action == "admin_cancel":
         await query.edit_message_text(f"❌ Admin addition for @{username} has been cancelled.")
 
         # Notify the user
@@ -313,29 +303,105 @@ async def admin_confirmation_callback(update: Update, context: ContextTypes.DEFA
         except Exception as e:
             logger.error(f"Error notifying user {user_id_to_add}: {e}")
 
-        # Clean up pending addition
-        if username.lower() in pending_admin_additions:
-            del pending_admin_additions[username.lower()]
+
+async def _render_pending_page(after=None, before=None):
+    """
+    Build the text and keyboard for one page of pending submissions
+
+    Returns:
+        tuple[str, InlineKeyboardMarkup, tuple | None] | None: Text, keyboard and the cursor the
+            page starts after, or None if there is nothing to show
+    """
+    rows, has_prev, has_next = await get_pending_page(after=after, before=before)
+    if not rows and before:
+        # Everything before the page was moderated in the meantime, show the first page
+        rows, has_prev, has_next = await get_pending_page()
+    if not rows:
+        return None
+
+    message = "Pending submissions:\n\n"
+    keyboard = []
+    for i, row in enumerate(rows, 1):
+        message += f"{i}. ID: {row.submission_id}\n"
+        message += f"Nickname: {row.nickname}\n"
+        message += f"Images: {row.image_count}\n"
+        message += f"Created: {row.created_at.strftime('%Y-%m-%d %H:%M')}\n\n"
+        keyboard.append([
+            InlineKeyboardButton(f"✅ Approve {i}", callback_data=callbacks.encode('approve', row.id)),
+            InlineKeyboardButton(f"❌ Reject {i}", callback_data=callbacks.encode('reject', row.id))
+        ])
+
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(
+            "⬅️ Prev", callback_data=callbacks.encode('pending_before', rows[0].created_at, rows[0].id)
+        ))
+    if has_next:
+        navigation.append(InlineKeyboardButton(
+            "Next ➡️", callback_data=callbacks.encode('pending_after', rows[-1].created_at, rows[-1].id)
+        ))
+    if navigation:
+        keyboard.append(navigation)
+
+    # The page starts right after the key preceding its first row, which stays valid when
+    # rows on the page are approved or rejected
+    start = (rows[0].created_at, rows[0].id - 1) if has_prev else None
+    return message, InlineKeyboardMarkup(keyboard), start
+
+
+def _track_page(context, message_id, start):
+    pages = context.chat_data.setdefault('pending_pages', {})
+    pages[message_id] = start
+    while len(pages) > MAX_TRACKED_PAGES:
+        pages.pop(next(iter(pages)))
+
+
 async def list_pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Admin command to list pending submissions"""
+    """Admin command to list pending submissions one page at a time"""
     user_id = update.effective_user.id
     if not await is_admin(user_id):
         await update.message.reply_text("This command is only available to admins.")
         return
 
-    session = Session()
-    pending = session.query(Submission).filter_by(status="pending").all()
-
-    if not pending:
+    page = await _render_pending_page()
+    if not page:
         await update.message.reply_text("No pending submissions.")
-        session.close()
         return
 
-    message = "Pending submissions:\n\n"
-    for sub in pending:
-        message += f"ID: {sub.submission_id}\n"
-        message += f"Nickname: {sub.nickname}\n"
-        message += f"Created: {sub.created_at.strftime('%Y-%m-%d %H:%M')}\n\n"
+    message, keyboard, start = page
+    msg = await update.message.reply_text(message, reply_markup=keyboard)
+    _track_page(context, msg.message_id, start)
+
 
-    await update.message.reply_text(message)
-    session.close()
\ No newline at end of file
+async def pending_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle prev/next navigation of the pending submissions list"""
+    query = update.callback_query
+    await query.answer()
+
+    if not await is_admin(update.effective_user.id):
+        return
+
+    action, cursor = callbacks.decode(query.data)
+    direction = 'before' if action == 'pending_before' else 'after'
+    page = await _render_pending_page(**{direction: tuple(cursor)})
+    await _show_page(query, context, page)
+
+
+async def _show_page(query, context, page):
+    if not page:
+        await query.message.edit_text("No pending submissions.")
+        return
+
+    message, keyboard, start = page
+    await query.message.edit_text(message, reply_markup=keyboard)
+    _track_page(context, query.message.message_id, start)
+
+
+async def _show_result(query, context, text):
+    """Refresh the pending page the action came from, or replace the message with `text`"""
+    pages = context.chat_data.get('pending_pages', {})
+    if query.message.message_id in pages:
+        start = pages[query.message.message_id]
+        await _show_page(query, context, await _render_pending_page(after=start))
+    else:
+        await query.message.edit_text(text)
@@ -1,7 +1,6 @@
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import ContextTypes, ConversationHandler
-from database import Session
-from models import User
+from repository import get_user
 from config import NICKNAME, IMAGE_COUNT
 
 
@@ -9,17 +8,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the conversation and handle user registration"""
     user = update.effective_user
 
-    # Check if user exists in database
-    session = Session()
-    existing_user = session.query(User).filter_by(user_id=user.id).first()
-
-    if not existing_user:
-        # New user - create record and ask for nickname
-        new_user = User(user_id=user.id)
-        session.add(new_user)
-        session.commit()
-        session.close()
+    # Check if user exists in database, creating the record for new users
+    existing_user, created = await get_user(user.id, create=True)
 
+    if created:
+        # New user - ask for nickname
         await update.message.reply_text(
             f"Welcome to the Food Combo Channel Bot! 🍔🍕\n\n"
             f"This bot helps you submit your favorite food combinations to our channel.\n\n"
@@ -29,7 +22,6 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         # Returning user - check if they have a nickname
         nickname = existing_user.nickname
-        session.close()
 
         if nickname:
             # User already has a nickname - store it in context and skip to next step
@@ -1,43 +1,46 @@
-import uuid
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import asyncio
+import time
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
 from telegram.ext import ContextTypes, ConversationHandler
 
-from config import IMAGE_COUNT, UPLOAD_IMAGES, UPLOAD_CHECK, PEOPLE_COUNT, DELIVERY_SOURCE, CONFIRM, ADMIN_IDS, NICKNAME
-from database import Session
-from models import User, Submission, Image
+from config import (
+    IMAGE_COUNT, UPLOAD_IMAGES, UPLOAD_CHECK, PEOPLE_COUNT, DELIVERY_SOURCE, CONFIRM, NICKNAME,
+    ANALYSIS_TIMEOUT, ALBUM_DEBOUNCE
+)
+from repository import get_user, set_nickname
+from writer import submission_writer
+from utils import send_album, delete_messages
+from notifications import build_admin_bundle, notify_admins
+from dedup import check_photo
+from admins import admin_registry
+import analysis
+import ids
 
 
 async def clear_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Delete all previous messages from the conversation."""
-    # Get the correct chat ID and bot
+    """Delete all previous messages from the conversation in the background."""
+    # Get the correct chat ID
     if hasattr(update, 'callback_query') and update.callback_query:
         # For callback queries
         chat_id = update.callback_query.message.chat_id
-        bot = context.bot  # Use context.bot instead of message.bot
     else:
         # For regular updates
         chat_id = update.effective_chat.id
-        bot = context.bot  # Use context.bot instead of message.bot
-
-    for msg_id in context.user_data.get('messages', []):
-        try:
-            await bot.delete_message(
-                chat_id=chat_id, message_id=msg_id
-            )
-        except Exception as e:
-            print(f"Error deleting message {msg_id}: {e}")  # Add logging for debugging
-            pass  # Ignore errors if message is already deleted
 
+    message_ids = context.user_data.get('messages', [])
     context.user_data['messages'] = []  # Reset message storage
 
+    # Deleting doesn't need to finish before the next reply is sent
+    if message_ids:
+        context.application.create_task(delete_messages(context.bot, chat_id, message_ids), update=update)
+
 
 async def submit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /submit command to start a new submission with existing nickname"""
     user_id = update.effective_user.id
 
     # Check if user has a nickname saved
-    session = Session()
-    user = session.query(User).filter_by(user_id=user_id).first()
+    user, _ = await get_user(user_id)
 
     if user and user.nickname:
         # User exists and has a nickname
@@ -48,7 +51,6 @@ async def submit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         context.user_data.setdefault('messages', []).append(msg.message_id)
 
-        session.close()
         return IMAGE_COUNT
     else:
         # User doesn't exist or doesn't have a nickname
@@ -57,7 +59,6 @@ async def submit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         context.user_data.setdefault('messages', []).append(msg.message_id)
 
-        session.close()
         return NICKNAME
 
 
@@ -74,14 +75,7 @@ async def get_nickname(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     context.user_data['nickname'] = nickname
 
-    session = Session()
-    user = session.query(User).filter_by(user_id=update.effective_user.id).first()
-
-    if user:
-        user.nickname = nickname
-        session.commit()
-
-    session.close()
+    await set_nickname(update.effective_user.id, nickname)
 
     msg = await update.message.reply_text(
         f"Thanks, {nickname}! How many food images do you want to upload? (1-10)"
@@ -101,6 +95,8 @@ async def get_image_count(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         context.user_data['image_count'] = image_count
         context.user_data['images'] = []
+        context.user_data['image_keys'] = []
+        context.user_data['duplicates'] = []
         context.user_data['current_image'] = 1
 
         msg = await update.message.reply_text(
@@ -116,10 +112,108 @@ async def get_image_count(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return IMAGE_COUNT
 
 
+async def _check_duplicates(update, context):
+    """
+    Note earlier submissions containing the uploaded photo
+
+    Returns:
+        list: The photo's [file_unique_id, phash], stored with the image
+    """
+    key, duplicates = await check_photo(context.bot, update.message.photo)
+    known = context.user_data.setdefault('duplicates', [])
+    known.extend(d for d in duplicates if d not in known)
+    return key
+
+
+class _Album:
+    """Photos of an album still arriving, and the draft lists they belong to"""
+
+    __slots__ = ('parts', 'images', 'image_keys', 'last_part', 'extra')
+
+    def __init__(self, images, image_keys):
+        # (index in the draft's images, photo sizes)
+        self.parts = []
+        self.images = images
+        self.image_keys = image_keys
+        self.last_part = time.monotonic()
+        # Photos past the draft's image count, left out
+        self.extra = 0
+
+
+# Albums being received, by media_group_id
+_albums = {}
+
+
+async def _acknowledge_album(context, chat_id, media_group_id):
+    """Once an album stops growing, check its photos for duplicates and send one reply for all of them"""
+    album = _albums[media_group_id]
+    while (delay := album.last_part + ALBUM_DEBOUNCE - time.monotonic()) > 0:
+        await asyncio.sleep(delay)
+    del _albums[media_group_id]
+
+    # One concurrent batch of duplicate checks instead of one per handler run
+    results = await asyncio.gather(*(check_photo(context.bot, photo) for _, photo in album.parts))
+    for (index, _), (key, _) in zip(album.parts, results):
+        album.image_keys[index] = key
+
+    # The user may have started over while the album was arriving
+    if album.images is not context.user_data.get('images'):
+        return
+
+    known = context.user_data.setdefault('duplicates', [])
+    for _, duplicates in results:
+        known.extend(d for d in duplicates if d not in known)
+
+    received = len(album.images)
+    total = context.user_data['image_count']
+    text = f"Got {len(album.parts)} images."
+    if album.extra:
+        text += f" You said {total}, so the other {album.extra} were left out."
+    if received < total:
+        text += f" Please upload image {received + 1} of {total} for your food combo."
+    elif 'check_image' not in context.user_data:
+        text += " Now, please upload a check photo of your order."
+    msg = await context.bot.send_message(chat_id=chat_id, text=text)
+    context.user_data.setdefault('messages', []).append(msg.message_id)
+
+
+def _add_album_photo(update, context):
+    """
+    Add a photo sent as part of an album to the draft without replying
+
+    The duplicate check and the reply are left to a task acknowledging the
+    whole album, so an album of ten photos costs one reply instead of ten.
+    """
+    media_group_id = update.message.media_group_id
+    images = context.user_data['images']
+    image_keys = context.user_data.setdefault('image_keys', [])
+
+    album = _albums.get(media_group_id)
+    if album is None:
+        album = _albums[media_group_id] = _Album(images, image_keys)
+        context.application.create_task(
+            _acknowledge_album(context, update.effective_chat.id, media_group_id), update=update
+        )
+    album.last_part = time.monotonic()
+    album.parts.append((len(images), update.message.photo))
+
+    images.append(update.message.photo[-1].file_id)
+    # The perceptual hash is filled in once the album is acknowledged
+    image_keys.append([update.message.photo[-1].file_unique_id, None])
+
+
 async def upload_images(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.photo and update.message.media_group_id:
+        _add_album_photo(update, context)
+        total = context.user_data['image_count']
+        received = len(context.user_data['images'])
+        context.user_data['current_image'] = min(received + 1, total)
+        return UPLOAD_IMAGES if received < total else UPLOAD_CHECK
+
     if update.message.photo:
         file_id = update.message.photo[-1].file_id
         context.user_data['images'].append(file_id)
+        context.user_data.setdefault('image_keys', []).append(await _check_duplicates(update, context))
 
         current = context.user_data['current_image']
         total = context.user_data['image_count']
@@ -144,9 +238,23 @@ async def upload_images(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def upload_check(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.photo and update.message.media_group_id:
+        album = _albums.get(update.message.media_group_id)
+        if album is not None and album.images is context.user_data.get('images'):
+            # The food album has more photos than the user said; the album's reply mentions them
+            album.extra += 1
+            album.last_part = time.monotonic()
+        else:
+            msg = await update.message.reply_text("Please upload the check photo on its own, not in an album.")
+            context.user_data.setdefault('messages', []).append(msg.message_id)
+        return UPLOAD_CHECK
+
     if update.message.photo:
         file_id = update.message.photo[-1].file_id
         context.user_data['check_image'] = file_id
+        context.user_data['check_key'] = await _check_duplicates(update, context)
+        # Analysis is CPU-bound, so it runs in a worker process while the conversation goes on
+        analysis.start(context.bot, update.message.photo)
 
         msg = await update.message.reply_text(
             "How many people ordered this food combo?"
@@ -217,21 +325,18 @@ async def get_delivery_source(update: Update, context: ContextTypes.DEFAULT_TYPE
         f"✅ <b>If everything is correct, please confirm below:</b>"
     )
 
-    preview_msg = await query.message.reply_text(preview_text, parse_mode="HTML")
-    context.user_data.setdefault('messages', []).append(preview_msg.message_id)
-
-    # Send images
-    for file_id in context.user_data['images']:
-        image_msg = await query.message.reply_photo(photo=file_id)
-        context.user_data.setdefault('messages', []).append(image_msg.message_id)
-
-    # Send check image
-    check_msg = await query.message.reply_photo(
-        photo=context.user_data['check_image'],
+    # Send the preview as one media group: food images, then the check image,
+    # with the preview text as the caption of the first photo
+    media = [InputMediaPhoto(media=file_id) for file_id in context.user_data['images']]
+    media.append(InputMediaPhoto(
+        media=context.user_data['check_image'],
         caption="🧾 <b>Check Image</b>",
         parse_mode="HTML"
-    )
-    context.user_data.setdefault('messages', []).append(check_msg.message_id)
+    ))
+    media[0] = InputMediaPhoto(media=media[0].media, caption=preview_text, parse_mode="HTML")
+
+    preview_msgs = await send_album(context.bot, query.message.chat_id, media)
+    context.user_data.setdefault('messages', []).extend(msg.message_id for msg in preview_msgs)
 
     # Confirmation buttons
     confirm_msg = await query.message.reply_text(
@@ -258,45 +363,23 @@ async def confirm_submission(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return ConversationHandler.END
 
     # Generate unique submission ID
-    submission_id = str(uuid.uuid4())
+    submission_id = ids.new_public_id()
     context.user_data['submission_id'] = submission_id
 
-    # Save submission to database
-    session = Session()
-
-    new_submission = Submission(
-        submission_id=submission_id,
-        user_id=update.effective_user.id,
-        nickname=context.user_data['nickname'],
-        image_count=context.user_data['image_count'],
-        people_count=context.user_data['people_count'],
-        delivery_source=context.user_data['delivery_source']
-    )
-
-    session.add(new_submission)
-    session.commit()
+    # Save submission and images to database in one transaction
+    row_id = await submission_writer.save({
+        'submission_id': submission_id,
+        'user_id': update.effective_user.id,
+        'nickname': context.user_data['nickname'],
+        'image_count': context.user_data['image_count'],
+        'people_count': context.user_data['people_count'],
+        'delivery_source': context.user_data['delivery_source'],
+        'images': context.user_data['images'],
+        'check_image': context.user_data['check_image'],
+        'image_keys': context.user_data.get('image_keys'),
+        'check_key': context.user_data.get('check_key')
+    })
 
-    # Save images
-    for i, file_id in enumerate(context.user_data['images']):
-        image = Image(
-            submission_id=submission_id,
-            file_id=file_id,
-            is_check_image=False,
-            sequence=i + 1
-        )
-        session.add(image)
-
-    # Save check image
-    check_image = Image(
-        submission_id=submission_id,
-        file_id=context.user_data['check_image'],
-        is_check_image=True
-    )
-    session.add(check_image)
-
-    session.commit()
-    session.close()
-    print(f"Messages to delete: {context.user_data.get('messages', [])}")
     # Clear all previous messages from the chat
     await clear_chat(update, context)
 
@@ -306,6 +389,8 @@ async def confirm_submission(update: Update, context: ContextTypes.DEFAULT_TYPE)
     saved_check_image = context.user_data.get('check_image')
     saved_people_count = context.user_data.get('people_count')
     saved_delivery_source = context.user_data.get('delivery_source')
+    saved_duplicates = context.user_data.get('duplicates', [])
+    saved_check_key = context.user_data.get('check_key')
 
     # Clear user data but keep nickname for future submissions
     context.user_data.clear()
@@ -319,45 +404,21 @@ async def confirm_submission(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
     context.user_data['messages'].append(thank_you_msg.message_id)
 
-    # Notify admins
-    for admin_id in ADMIN_IDS:
-        # First, send submission details
-        await context.bot.send_message(
-            chat_id=admin_id,
-            text=f"New submission received (ID: {submission_id}):\n\n"
-                 f"👤 Nickname: {saved_nickname}\n"
-                 f"👥 Number of People: {saved_people_count}\n"
-                 f"🚚 Delivery Source: {saved_delivery_source}"
+    # Notify admins in the background so the user's update isn't held up by the
+    # check analysis or the fan-out
+    async def notify():
+        findings = None
+        if saved_check_key:
+            findings = await analysis.get_result(saved_check_key[0], ANALYSIS_TIMEOUT)
+        media, text, keyboard = build_admin_bundle(
+            submission_id, row_id, saved_nickname, saved_people_count, saved_delivery_source,
+            saved_images, saved_check_image, duplicates=saved_duplicates,
+            check_analysis=analysis.summarize(findings) if findings else None
         )
+        await notify_admins(context.bot, sorted(admin_registry.ids), media, text, keyboard)
 
-        # Send food images with caption for each image
-        for i, file_id in enumerate(saved_images):
-            caption = f"Food Image {i + 1}/{len(saved_images)}"
-            await context.bot.send_photo(
-                chat_id=admin_id,
-                photo=file_id,
-                caption=caption
-            )
-
-        # Send check image
-        if saved_check_image:
-            await context.bot.send_photo(
-                chat_id=admin_id,
-                photo=saved_check_image,
-                caption="🧾 Check image"
-            )
+    context.application.create_task(notify())
 
-        # Send approval buttons
-        await context.bot.send_message(
-            chat_id=admin_id,
-            text=f"Do you approve this submission (ID: {submission_id})?",
-            reply_markup=InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("✅ Approve", callback_data=f"approve_{submission_id}"),
-                    InlineKeyboardButton("❌ Reject", callback_data=f"reject_{submission_id}")
-                ]
-            ])
-        )
     return ConversationHandler.END
 
 
@@ -0,0 +1,42 @@
+import secrets
+
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+_VALUES = {char: value for value, char in enumerate(ALPHABET)}
+
+# Characters in a public submission ID: 62**8 is about 2*10**14, so random IDs practically never collide
+PUBLIC_ID_LENGTH = 8
+
+
+def encode(number):
+    """Base62 representation of a non-negative integer"""
+    if number < 0:
+        raise ValueError(f"Can't encode negative number {number}")
+    chars = []
+    while True:
+        number, digit = divmod(number, 62)
+        chars.append(ALPHABET[digit])
+        if not number:
+            return ''.join(reversed(chars))
+
+
+def decode(text):
+    """
+    Inverse of encode()
+
+    Raises:
+        ValueError: If `text` is empty or not base62
+    """
+    if not text:
+        raise ValueError("Empty base62 number")
+    number = 0
+    for char in text:
+        try:
+            number = number * 62 + _VALUES[char]
+        except KeyError:
+            raise ValueError(f"Invalid base62 number {text!r}") from None
+    return number
+
+
+def new_public_id():
+    """Random short ID shown to admins, e.g. "4fK9xQ2b"; unguessable, unlike the row ID"""
+    return ''.join(secrets.choice(ALPHABET) for _ in range(PUBLIC_ID_LENGTH))
@@ -0,0 +1,43 @@
+"""Load-testing harness: a fake Telegram Bot API and simulated users driving the real application"""
+import os
+import tempfile
+
+CHANNEL_ID = '-1001000000000'
+ADMIN_ID = 1000000000
+# Rate that effectively lifts a limit
+UNLIMITED = 1000000
+
+
+def configure(name, base_url=None, **overrides):
+    """
+    Set the environment the application reads when config is first imported
+
+    Points the application at a scratch SQLite database, and at the fake Bot
+    API if `base_url` is given, so call this before importing any application
+    module. Photo hashing and check analysis are off, since the fake API
+    doesn't serve file downloads.
+
+    Args:
+        name (str): Scenario name, used for the bot token, webhook secret and database
+        base_url (str): Bot API URL of the fake API
+        **overrides: Any other settings, by environment variable name
+
+    Returns:
+        str: Path of the scratch database
+    """
+    database = os.path.join(tempfile.mkdtemp(prefix=f"foodbot-{name}-"), f"{name}.db")
+    settings = {
+        'TELEGRAM_BOT_TOKEN': f"123456:{name}",
+        'DATABASE_URL': f"sqlite:///{database}",
+        'ADMIN_IDS': str(ADMIN_ID),
+        'CHANNEL_ID': CHANNEL_ID,
+        'WEBHOOK_SECRET': name,
+        'METRICS_PORT': '0',
+        'PHASH_ENABLED': 'false',
+        'ANALYSIS_ENABLED': 'false',
+    }
+    if base_url:
+        settings['BOT_API_URL'] = base_url
+    settings.update({key: str(value) for key, value in overrides.items()})
+    os.environ.update(settings)
+    return database
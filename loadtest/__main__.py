@@ -0,0 +1,307 @@
+"""
+End-to-end load test against a fake Bot API
+
+Runs the real application, with its handlers, persistence, write-behind queue
+and outbox, against a local stand-in for the Bot API and a scratch SQLite
+database, then reports per-step latency percentiles and throughput:
+
+    python -m loadtest --users 2000 --concurrency 200 --save-baseline loadtest/baseline.json
+    python -m loadtest --users 2000 --concurrency 200 --baseline loadtest/baseline.json
+
+With --pipeline each user sends all of their updates at once, like a client
+that doesn't wait for replies; the run then also checks that they were
+handled in order.
+
+With --db-delay SQL statements take that much longer, like on a slow
+or distant database server. Statements wait without blocking the event loop,
+so only the steps that use the database slow down, by their own statements'
+delay, and the run exits with status 1 if the event loop lag grows anyway:
+
+    python -m loadtest --users 500 --concurrency 100 --db-delay 0.05
+
+With --baseline the run exits with status 1 if any step's p95 latency or
+the overall throughput regressed by more than --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import defaultdict
+
+from loadtest import configure, CHANNEL_ID, ADMIN_ID, UNLIMITED
+from loadtest.fake_api import FakeBotAPI
+
+# Latency differences smaller than this are noise, whatever the relative change
+MIN_REGRESSION_MS = 1.0
+# Admins approving the submissions, unless --approvers asks for more
+ADMINS = 3
+# Seconds to wait for the outbox to publish everything before shutting down
+DRAIN_TIMEOUT = 60
+# Seconds between event loop lag samples, and the p99 lag above which a run with --db-delay fails
+LAG_INTERVAL = 0.01
+MAX_LOOP_LAG_MS = 50
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m loadtest', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=500, help="Simulated users, each making one submission")
+    parser.add_argument('--concurrency', type=int, default=100, help="Users going through the flow at once")
+    parser.add_argument('--images', type=int, default=3, help="Food images per submission")
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds the fake Bot API takes per call")
+    parser.add_argument('--jitter', type=float, default=0.01, help="Extra random seconds per Bot API call")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help="Fraction of Bot API calls answered with 429")
+    parser.add_argument('--approvers', type=int, default=1,
+                        help="Admins clicking Approve on each submission at the same moment")
+    parser.add_argument('--album', action='store_true', help="Send each user's food images as one album")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="Send each user's updates all at once instead of one after another")
+    parser.add_argument('--db-delay', type=float, default=0.0,
+                        help="Seconds added to SQL statements, like a slow database server")
+    parser.add_argument('--keep-limits', action='store_true',
+                        help="Keep the configured update throttle and outgoing rate limits instead of lifting them")
+    parser.add_argument('--save-baseline', metavar='PATH', help="Write the results to this JSON file")
+    parser.add_argument('--baseline', metavar='PATH', help="Compare the results with this JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative regression (default 0.2)")
+    return parser.parse_args()
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values"""
+    index = max(0, min(len(values) - 1, round(fraction * len(values)) - 1))
+    return values[index]
+
+
+def slow_down_database(seconds):
+    """
+    Make statements of the application's engines wait `seconds` before they run
+
+    Statements inside a write transaction don't wait: SQLite locks the whole
+    database for it, so every other writer would queue behind the delay until
+    it timed out with "database is locked", which a server database doesn't do.
+    """
+    from sqlalchemy import event
+    from sqlalchemy.util import await_only
+    from database import async_engine, read_engine
+
+    def delay(conn, *args):
+        if conn.connection.driver_connection.in_transaction:
+            return
+        # Statements run in SQLAlchemy's greenlet, so this waits the way the driver's I/O does
+        await_only(asyncio.sleep(seconds))
+
+    for engine in {async_engine.sync_engine, read_engine.sync_engine}:
+        event.listen(engine, 'before_cursor_execute', delay)
+
+
+async def sample_loop_lag(lags):
+    """Record how late the event loop wakes up from short sleeps, until cancelled"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(time.perf_counter() - started - LAG_INTERVAL)
+
+
+def summarize(timings, errors, duration, users, api, approved, lags):
+    steps = {}
+    for step, values in timings.items():
+        values.sort()
+        steps[step] = {
+            'count': len(values),
+            'errors': errors[step],
+            'mean_ms': round(sum(values) / len(values) * 1000, 3),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        }
+    updates = sum(step['count'] for step in steps.values())
+    submissions = steps.get('confirm', {}).get('count', 0) - errors['confirm']
+    return {
+        'users': users,
+        'duration_s': round(duration, 3),
+        'throughput': {
+            'updates_per_s': round(updates / duration, 1),
+            'submissions_per_s': round(submissions / duration, 1),
+        },
+        'steps': steps,
+        'loop_lag': {
+            'p50_ms': round(percentile(sorted(lags), 0.50) * 1000, 3),
+            'p99_ms': round(percentile(sorted(lags), 0.99) * 1000, 3),
+            'max_ms': round(max(lags) * 1000, 3),
+        },
+        'api_calls': dict(sorted(api.counts.items())),
+        'api_rate_limited': dict(sorted(api.rate_limited.items())),
+        # More posts than approved submissions means something was published twice
+        'channel_posts': {'approved': approved, 'posted': len(api.calls_to('sendMediaGroup', CHANNEL_ID))},
+    }
+
+
+def print_report(results):
+    print(f"{'step':<14}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for step, stats in results['steps'].items():
+        print(
+            f"{step:<14}{stats['count']:>8}{stats['errors']:>8}"
+            f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+        )
+    throughput = results['throughput']
+    print(
+        f"\n{results['users']} users in {results['duration_s']:.1f}s: "
+        f"{throughput['updates_per_s']} updates/s, {throughput['submissions_per_s']} submissions/s"
+    )
+    lag = results['loop_lag']
+    print(f"Event loop lag: p50 {lag['p50_ms']:.1f} ms, p99 {lag['p99_ms']:.1f} ms, max {lag['max_ms']:.1f} ms")
+    print(f"Bot API calls: {results['api_calls']}")
+    if results['api_rate_limited']:
+        print(f"Injected 429s: {results['api_rate_limited']}")
+    posts = results['channel_posts']
+    print(f"Channel posts: {posts['posted']} for {posts['approved']} approved submissions")
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns:
+        list[str]: Description of every regression against the baseline
+    """
+    regressions = []
+    for step, stats in results['steps'].items():
+        before = baseline['steps'].get(step)
+        if not before:
+            continue
+        if (stats['p95_ms'] > before['p95_ms'] * (1 + tolerance)
+                and stats['p95_ms'] - before['p95_ms'] > MIN_REGRESSION_MS):
+            regressions.append(f"{step}: p95 {before['p95_ms']:.1f} ms -> {stats['p95_ms']:.1f} ms")
+        if stats['errors'] > before['errors']:
+            regressions.append(f"{step}: errors {before['errors']} -> {stats['errors']}")
+
+    before = baseline['throughput']['updates_per_s']
+    after = results['throughput']['updates_per_s']
+    if after < before * (1 - tolerance):
+        regressions.append(f"throughput: {before} -> {after} updates/s")
+    return regressions
+
+
+async def run(args):
+    api = FakeBotAPI(latency=args.latency, jitter=args.jitter, rate_limit_ratio=args.rate_limit_ratio)
+    base_url = await api.start()
+
+    overrides = {}
+    if not args.keep_limits:
+        # Measure the bot, not the limits: otherwise the run is paced by the global
+        # update throttle, and shutdown waits minutes for admin notifications and
+        # channel posts at Telegram's per-chat rates
+        for name in ('THROTTLE_GLOBAL_RATE', 'THROTTLE_GLOBAL_BURST', 'TELEGRAM_GLOBAL_RATE',
+                     'TELEGRAM_CHAT_RATE', 'TELEGRAM_CHAT_BURST', 'TELEGRAM_GROUP_RATE'):
+            overrides[name] = UNLIMITED
+    configure(
+        'loadtest', base_url,
+        ADMIN_IDS=','.join(str(ADMIN_ID + i) for i in range(max(ADMINS, args.approvers))),
+        BOT_MODE='polling',
+        **overrides
+    )
+
+    from config import ADMIN_IDS
+    from database import init_db
+    from loadtest.users import SimulatedUser, UpdateFactory
+    from main import build_application
+    from webhook import WebhookApp
+
+    init_db()
+    if args.db_delay:
+        slow_down_database(args.db_delay)
+    application = build_application()
+    # Same startup and shutdown sequence the webhook server uses
+    lifecycle = WebhookApp(application)
+    await lifecycle.startup()
+
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+
+    def record(step, seconds, ok):
+        timings[step].append(seconds)
+        if not ok:
+            errors[step] += 1
+
+    factory = UpdateFactory(application.bot)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def simulate(user_id):
+        async with semaphore:
+            # Each admin's updates are handled in order, so spread the approvals out
+            admin_ids = [ADMIN_IDS[(user_id + i) % len(ADMIN_IDS)] for i in range(args.approvers)]
+            user = SimulatedUser(user_id, admin_ids, image_count=args.images, album=args.album)
+            await user.run(application, factory, record, pipeline=args.pipeline)
+
+    lags = []
+    sampler = asyncio.create_task(sample_loop_lag(lags))
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(simulate(user_id) for user_id in range(1, args.users + 1)))
+        duration = time.perf_counter() - started
+        sampler.cancel()
+        approved = await drain_outbox()
+    finally:
+        sampler.cancel()
+        await lifecycle.shutdown()
+        await api.stop()
+
+    return summarize(timings, errors, duration, args.users, api, approved, lags)
+
+
+async def drain_outbox():
+    """
+    Wait for the outbox to deliver everything queued, up to DRAIN_TIMEOUT
+
+    Returns:
+        int: Number of approved submissions
+    """
+    from sqlalchemy import select, func
+    from database import AsyncSession
+    from models import OutboxMessage, Submission
+
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    async with AsyncSession() as session:
+        while time.monotonic() < deadline:
+            queued = await session.scalar(
+                select(func.count()).select_from(OutboxMessage)
+                .where(OutboxMessage.status.in_(('pending', 'sending')))
+            )
+            await session.commit()
+            if not queued:
+                break
+            await asyncio.sleep(0.2)
+        return await session.scalar(select(func.count()).select_from(Submission).filter_by(status='approved'))
+
+
+def main():
+    args = parse_args()
+    results = asyncio.run(run(args))
+    print_report(results)
+
+    posts = results['channel_posts']
+    if posts['posted'] > posts['approved']:
+        print(f"\n{posts['posted'] - posts['approved']} submissions were published more than once")
+        sys.exit(1)
+
+    lag = results['loop_lag']['p99_ms']
+    if args.db_delay and lag > MAX_LOOP_LAG_MS:
+        print(f"\nThe slow database blocked the event loop: p99 lag {lag:.1f} ms, limit {MAX_LOOP_LAG_MS} ms")
+        sys.exit(1)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""
+Bulk approval of queued submissions against a fake Bot API
+
+Seeds pending submissions in a scratch SQLite database, then approves them
+all with bulk_moderate while the outbox publishes them to the channel:
+
+    python -m loadtest.bulk --submissions 500
+
+A few channel posts are answered with an error: those submissions have to be
+pending again afterwards, every other one has to be posted exactly once, and
+each submitter notified once. Then a few more are approved with the outbox
+stopped, and the approval has to give up after --timeout seconds without
+progress instead of waiting forever.
+
+Exits with status 1 if any of this doesn't hold.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from loadtest import configure, CHANNEL_ID, UNLIMITED
+from loadtest.fake_api import FakeBotAPI
+
+# Food photos per submission; with the check photo they fit one media group
+IMAGES = 3
+# Submissions per submitter, who get one notification for all of them
+PER_SUBMITTER = 2
+# Submissions approved while the outbox is stopped
+STALLED = 5
+# Seconds to wait for the outbox to send the notifications
+DRAIN_TIMEOUT = 60
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m loadtest.bulk', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--submissions', type=int, default=500, help="Pending submissions approved at once")
+    parser.add_argument('--failures', type=int, default=3, help="Channel posts answered with an error")
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds the fake Bot API takes per call")
+    parser.add_argument('--timeout', type=float, default=2,
+                        help="Seconds the approval with the outbox stopped waits for progress")
+    return parser.parse_args()
+
+
+async def seed(count, start):
+    """Insert `count` pending submissions; returns their public IDs"""
+    from database import AsyncSession
+    from repository import save_submissions
+
+    ids = [f"b{start + i}" for i in range(count)]
+    async with AsyncSession() as session:
+        await save_submissions(session, [{
+            'submission_id': submission_id,
+            'user_id': (start + i) // PER_SUBMITTER + 1,
+            'nickname': f"User {(start + i) // PER_SUBMITTER + 1}",
+            'image_count': IMAGES,
+            'people_count': 2,
+            'delivery_source': 'Test',
+            'images': [f"{submission_id}-food-{n}" for n in range(IMAGES)],
+            'check_image': f"{submission_id}-check",
+        } for i, submission_id in enumerate(ids)])
+        await session.commit()
+    return ids
+
+
+async def statuses(ids):
+    """
+    Returns:
+        dict[str, str]: Status of each submission
+    """
+    from sqlalchemy import select
+    from database import AsyncSession
+    from models import Submission
+
+    async with AsyncSession() as session:
+        rows = await session.execute(
+            select(Submission.submission_id, Submission.status).where(Submission.submission_id.in_(ids))
+        )
+    return dict(rows.all())
+
+
+async def drain_outbox():
+    """Wait for the outbox to deliver everything queued"""
+    from sqlalchemy import select, func
+    from database import AsyncSession
+    from models import OutboxMessage
+
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while time.monotonic() < deadline:
+        async with AsyncSession() as session:
+            queued = await session.scalar(
+                select(func.count()).select_from(OutboxMessage)
+                .where(OutboxMessage.status.in_(('pending', 'sending')))
+            )
+        if not queued:
+            return
+        await asyncio.sleep(0.2)
+    raise TimeoutError("Timed out waiting for the outbox to send the notifications")
+
+
+def check(api, ids, result, after):
+    """
+    Returns:
+        list[str]: What went wrong approving the submissions
+    """
+    # Each post is one media group, starting with the submission's first food photo
+    attempts = [params['media'][0]['media'].rsplit('-food-', 1)[0] for params in api.calls_to('sendMediaGroup', CHANNEL_ID)]
+    posted = [params['media'][0]['media'].rsplit('-food-', 1)[0]
+              for params in api.calls_to('sendMediaGroup', CHANNEL_ID, answered=True)]
+    rejected = set(attempts) - set(posted)
+
+    problems = []
+    for submission_id in ids:
+        expected = 'pending' if submission_id in rejected else 'approved'
+        if after.get(submission_id) != expected:
+            problems.append(f"{submission_id}: {after.get(submission_id)}, expected {expected}")
+        if submission_id not in rejected and posted.count(submission_id) != 1:
+            problems.append(f"{submission_id}: posted {posted.count(submission_id)} times")
+    if result['failed'] != len(rejected) or result['moderated'] != len(ids) - len(rejected):
+        problems.append(f"reported {result}, but {len(rejected)} of {len(ids)} posts failed")
+
+    # Submitters whose every submission was published get one notification
+    submitters = {int(submission_id[1:]) // PER_SUBMITTER + 1 for submission_id in ids if submission_id not in rejected}
+    notified = [params['chat_id'] for params in api.calls_to('sendMessage', answered=True)]
+    for user_id in submitters:
+        if notified.count(user_id) != 1:
+            problems.append(f"user {user_id} was notified {notified.count(user_id)} times")
+    return problems
+
+
+async def run(args):
+    # Spread the failures over the run
+    fail = {(n + 1) * args.submissions // (args.failures + 1) for n in range(args.failures)}
+    api = FakeBotAPI(latency=args.latency, fail_calls={'sendMediaGroup': fail})
+    base_url = await api.start()
+    # A failed post isn't retried, and the channel limits are lifted to measure the pipeline itself
+    configure(
+        'bulk', base_url, OUTBOX_MAX_ATTEMPTS=1, BULK_MODERATION_LIMIT=args.submissions,
+        TELEGRAM_GLOBAL_RATE=UNLIMITED, TELEGRAM_CHAT_RATE=UNLIMITED, TELEGRAM_CHAT_BURST=UNLIMITED,
+        TELEGRAM_GROUP_RATE=UNLIMITED
+    )
+
+    from telegram import Bot
+    from config import TOKEN, BOT_API_URL
+    from database import init_db, close_db
+    from moderation import bulk_moderate
+    from outbox import outbox
+
+    init_db()
+    ids = await seed(args.submissions, 0)
+    reports = []
+
+    async def progress(done, total):
+        reports.append(done)
+
+    async with Bot(TOKEN, base_url=BOT_API_URL) as bot:
+        outbox.start(bot)
+        try:
+            started = time.perf_counter()
+            result = await bulk_moderate('approve', progress=progress)
+            duration = time.perf_counter() - started
+            await drain_outbox()
+        finally:
+            await outbox.stop()
+        problems = check(api, ids, result, await statuses(ids))
+
+        # Nothing drains the outbox now
+        stalled_ids = await seed(STALLED, args.submissions)
+        started = time.perf_counter()
+        stalled = await bulk_moderate('approve', submission_ids=stalled_ids, timeout=args.timeout)
+        waited = time.perf_counter() - started
+    await close_db()
+    await api.stop()
+
+    if stalled['queued'] != STALLED:
+        problems.append(f"with the outbox stopped, reported {stalled}, expected {STALLED} still queued")
+    # Polled once a second, so it may take up to a second longer
+    if waited > args.timeout + 2:
+        problems.append(f"with the outbox stopped, waited {waited:.1f}s, timeout {args.timeout}s")
+
+    print(f"{args.submissions} submissions approved in {duration:.2f}s "
+          f"({args.submissions / duration:.1f}/s), {len(reports)} progress reports")
+    print(f"Result: {result}")
+    print(f"Channel posts answered: {len(api.calls_to('sendMediaGroup', CHANNEL_ID, answered=True))}, "
+          f"notifications: {len(api.calls_to('sendMessage', answered=True))}")
+    print(f"With the outbox stopped: gave up after {waited:.1f}s, {stalled}")
+    return problems
+
+
+def main():
+    problems = asyncio.run(run(parse_args()))
+    if problems:
+        print("\nBulk approval went wrong:")
+        for problem in problems[:20]:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("\nEvery post was published once or put back to pending, and every submitter notified once")
+
+
+if __name__ == '__main__':
+    main()
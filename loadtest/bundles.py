@@ -0,0 +1,149 @@
+"""
+Latency of the admin notification and the submission preview, before and after
+
+Sends both against the fake Bot API, --rounds times each, the way the bot
+used to and the way it does now:
+
+- notify: every admin got the details, one photo per image, the check photo
+  and the keyboard, one admin after another; now notify_admins() sends each
+  admin one media group and the keyboard, to all admins at once
+- preview: the user got the preview text, one photo per image, the check
+  photo and the keyboard; now get_delivery_source() sends one media group
+  through send_album() and the keyboard
+
+The outgoing rate limits are lifted, so only the Bot API round trips count:
+
+    python -m loadtest.bundles --admins 5 --images 10 --latency 0.05
+
+Exits with status 1 if a new path wasn't at least --min-speedup times faster
+at the median than the old one.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from loadtest import configure, ADMIN_ID, UNLIMITED
+from loadtest.fake_api import FakeBotAPI
+from loadtest.__main__ import percentile
+
+# Chat the preview is sent to
+USER_ID = 42
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m loadtest.bundles', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--admins', type=int, default=5, help="Admins notified of each submission")
+    parser.add_argument('--images', type=int, default=10, help="Food images per submission")
+    parser.add_argument('--rounds', type=int, default=5, help="Times each path is timed")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds the fake Bot API takes per call")
+    parser.add_argument('--min-speedup', type=float, default=2, help="How much faster a new path has to be")
+    return parser.parse_args()
+
+
+async def send_serially(bot, chat_id, text, images, check_image, keyboard_text, keyboard):
+    """The old way: the text, every photo on its own, then the keyboard, one call after another"""
+    await bot.send_message(chat_id=chat_id, text=text)
+    for file_id in images:
+        await bot.send_photo(chat_id=chat_id, photo=file_id)
+    await bot.send_photo(chat_id=chat_id, photo=check_image, caption="🧾 Check image")
+    await bot.send_message(chat_id=chat_id, text=keyboard_text, reply_markup=keyboard)
+
+
+def paths(bot, args):
+    """
+    Returns:
+        dict[str, callable]: Coroutine functions sending one notification or preview, by name
+    """
+    from telegram import InputMediaPhoto
+    from notifications import build_admin_bundle, notify_admins
+    from utils import send_album
+
+    admin_ids = [ADMIN_ID + i for i in range(args.admins)]
+    images = [f"food-{i}" for i in range(args.images)]
+    media, text, keyboard = build_admin_bundle(
+        'bundle', 1, 'Nickname', 2, 'Wolt', images, 'check'
+    )
+    details = media[0].caption
+
+    async def notify_before():
+        for admin_id in admin_ids:
+            await send_serially(bot, admin_id, details, images, 'check', text, keyboard)
+
+    async def notify_after():
+        assert await notify_admins(bot, admin_ids, media, text, keyboard) == len(admin_ids)
+
+    # Same media the preview handler builds: food images, then the check image, captioned first
+    preview = [InputMediaPhoto(media=file_id) for file_id in images]
+    preview.append(InputMediaPhoto(media='check', caption="🧾 <b>Check Image</b>", parse_mode="HTML"))
+    preview[0] = InputMediaPhoto(media=preview[0].media, caption="Submission Preview", parse_mode="HTML")
+
+    async def preview_before():
+        await send_serially(bot, USER_ID, "Submission Preview", images, 'check',
+                            "Would you like to submit this post?", keyboard)
+
+    async def preview_after():
+        await send_album(bot, USER_ID, preview)
+        await bot.send_message(chat_id=USER_ID, text="Would you like to submit this post?", reply_markup=keyboard)
+
+    return {
+        'notify before': notify_before,
+        'notify after': notify_after,
+        'preview before': preview_before,
+        'preview after': preview_after,
+    }
+
+
+async def run(args):
+    api = FakeBotAPI(latency=args.latency)
+    base_url = await api.start()
+    configure(
+        'bundles', base_url,
+        TELEGRAM_GLOBAL_RATE=UNLIMITED, TELEGRAM_CHAT_RATE=UNLIMITED, TELEGRAM_CHAT_BURST=UNLIMITED
+    )
+
+    from main import build_application
+
+    # The bot with the connection pool the application uses
+    bot = build_application().bot
+    results = {}
+    try:
+        async with bot:
+            for name, path in paths(bot, args).items():
+                calls = len(api.calls)
+                durations = []
+                for _ in range(args.rounds):
+                    started = time.perf_counter()
+                    await path()
+                    durations.append(time.perf_counter() - started)
+                results[name] = (sorted(durations), (len(api.calls) - calls) // args.rounds)
+    finally:
+        await api.stop()
+    return results
+
+
+def main():
+    args = parse_args()
+    results = asyncio.run(run(args))
+
+    for name, (durations, calls) in results.items():
+        print(f"{name:<16}{calls:>4} calls  p50 {percentile(durations, 0.50) * 1000:8.1f} ms  "
+              f"p95 {percentile(durations, 0.95) * 1000:8.1f} ms")
+
+    problems = []
+    for path in ('notify', 'preview'):
+        before = percentile(results[f"{path} before"][0], 0.50)
+        after = percentile(results[f"{path} after"][0], 0.50)
+        print(f"{path}: {before / after:.1f}x faster")
+        if before / after < args.min_speedup:
+            problems.append(f"{path}: {before / after:.1f}x faster, expected at least {args.min_speedup}x")
+    if problems:
+        print("\nThe new paths aren't fast enough:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("\nBoth new paths are faster")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Fairness of the update throttle: one flooding user among many light users
+
+Feeds /start updates through the application's update queue, against the fake
+Bot API and a scratch SQLite database, with the configured update throttle:
+
+1. alone: light users each send one update a second
+2. flood: the same, while one more user sends --flood-rate updates a second
+
+A flooding user has to be cut back to their own limit without slowing anyone
+else down, so the light users' latency from queueing an update until its
+handlers had run should barely change:
+
+    python -m loadtest.fairness --light-users 50 --flood-rate 200
+
+Exits with status 1 if a light user's update was dropped, their p95 latency
+grew more than --tolerance over the run without the flood, or the flooding
+user got more updates handled than their limit allows.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from loadtest import configure, UNLIMITED
+from loadtest.fake_api import FakeBotAPI
+from loadtest.__main__ import percentile
+
+PHASES = ('alone', 'flood')
+# Seconds between a light user's updates
+LIGHT_INTERVAL = 1.0
+# Added to the allowed p95 growth, so a few milliseconds of noise on a fast run don't fail it
+MIN_REGRESSION_MS = 20.0
+# Seconds to wait for the last updates to be handled
+DRAIN_TIMEOUT = 30
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m loadtest.fairness', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--light-users', type=int, default=50, help="Users sending one update a second")
+    parser.add_argument('--flood-rate', type=float, default=200, help="Updates per second from the flooding user")
+    parser.add_argument('--duration', type=float, default=5, help="Seconds each phase sends updates for")
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds the fake Bot API takes per call")
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help="Allowed relative growth of the light users' p95 latency under the flood")
+    return parser.parse_args()
+
+
+async def send_every(application, updates, interval, queued):
+    """Put the updates on the application's update queue `interval` seconds apart"""
+    started = time.perf_counter()
+    for i, update in enumerate(updates):
+        await asyncio.sleep(max(0.0, started + i * interval - time.perf_counter()))
+        queued[update.update_id] = time.perf_counter()
+        await application.update_queue.put(update)
+
+
+async def run_phase(application, factory, handled, light_users, flood_user, args):
+    """
+    Returns:
+        dict: The light users' latency percentiles and dropped updates, and the flooding user's counts
+    """
+    count = int(args.duration / LIGHT_INTERVAL)
+    light = {user_id: [factory.text(user_id, '/start') for _ in range(count)] for user_id in light_users}
+    flood = [factory.text(flood_user, '/start') for _ in range(int(args.duration * args.flood_rate))] if flood_user else []
+
+    queued = {}
+    senders = [send_every(application, updates, LIGHT_INTERVAL, queued) for updates in light.values()]
+    if flood:
+        senders.append(send_every(application, flood, 1 / args.flood_rate, queued))
+    await asyncio.gather(*senders)
+    await asyncio.wait_for(application.update_queue.join(), DRAIN_TIMEOUT)
+
+    light_ids = [update.update_id for updates in light.values() for update in updates]
+    latencies = sorted(handled[update_id] - queued[update_id] for update_id in light_ids if update_id in handled)
+    return {
+        'light_updates': len(light_ids),
+        'light_dropped': len(light_ids) - len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'flood_sent': len(flood),
+        'flood_handled': sum(update.update_id in handled for update in flood),
+    }
+
+
+async def run(args):
+    api = FakeBotAPI(latency=args.latency)
+    base_url = await api.start()
+    # The update throttle keeps its configured limits; replies shouldn't wait on the outgoing ones
+    configure(
+        'fairness', base_url,
+        TELEGRAM_GLOBAL_RATE=UNLIMITED, TELEGRAM_CHAT_RATE=UNLIMITED, TELEGRAM_CHAT_BURST=UNLIMITED
+    )
+
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    from database import init_db
+    from loadtest.users import UpdateFactory
+    from main import build_application
+    from webhook import WebhookApp
+
+    init_db()
+    application = build_application()
+    factory = UpdateFactory(application.bot)
+    handled = {}
+
+    async def mark_handled(update, context):
+        handled[update.update_id] = time.perf_counter()
+
+    # Runs once the bot's own handlers are done; updates dropped by the throttle never get here
+    application.add_handler(TypeHandler(Update, mark_handled), group=1)
+
+    lifecycle = WebhookApp(application)
+    await lifecycle.startup()
+    results = {}
+    try:
+        # Fresh users in each phase, so the flood phase starts with full buckets
+        for n, phase in enumerate(PHASES):
+            first = 1 + n * (args.light_users + 1)
+            light_users = range(first, first + args.light_users)
+            flood_user = first + args.light_users if phase == 'flood' else None
+            results[phase] = await run_phase(application, factory, handled, light_users, flood_user, args)
+    finally:
+        await lifecycle.shutdown()
+        await api.stop()
+    return results
+
+
+def main():
+    args = parse_args()
+    results = asyncio.run(run(args))
+
+    from config import THROTTLE_USER_RATE, THROTTLE_USER_BURST
+
+    print(f"{'phase':<8}{'light updates':>15}{'dropped':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'flood sent':>12}{'handled':>9}")
+    for phase, stats in results.items():
+        print(
+            f"{phase:<8}{stats['light_updates']:>15}{stats['light_dropped']:>9}{stats['p50_ms']:>9.1f}"
+            f"{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}{stats['flood_sent']:>12}{stats['flood_handled']:>9}"
+        )
+
+    alone, flood = results['alone'], results['flood']
+    problems = []
+    for phase, stats in results.items():
+        if stats['light_dropped']:
+            problems.append(f"{phase}: {stats['light_dropped']} of the light users' updates were dropped")
+    if flood['p95_ms'] > alone['p95_ms'] * (1 + args.tolerance) + MIN_REGRESSION_MS:
+        problems.append(f"light users' p95 {alone['p95_ms']:.1f} ms -> {flood['p95_ms']:.1f} ms under the flood")
+    # The flooding user's bucket starts full and refills during the phase and while it drains
+    allowed = THROTTLE_USER_BURST + THROTTLE_USER_RATE * (args.duration + 1)
+    if flood['flood_handled'] > allowed:
+        problems.append(f"flooding user got {flood['flood_handled']} updates handled, limit {allowed:.0f}")
+
+    if problems:
+        print("\nThe flooding user was not contained:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("\nThe flooding user was held to their limit without slowing down the light users")
+
+
+if __name__ == '__main__':
+    main()
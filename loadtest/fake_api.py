@@ -0,0 +1,194 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from urllib.parse import parse_qsl
+
+# Returned by getMe
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Load Test', 'username': 'loadtest_bot'}
+
+REASONS = {200: 'OK', 400: 'Bad Request', 429: 'Too Many Requests'}
+# Methods answered with a single Message
+MESSAGE_METHODS = {'sendMessage', 'sendPhoto', 'editMessageText', 'editMessageCaption', 'editMessageReplyMarkup'}
+
+
+def _parse_params(body, content_type):
+    """Decode form parameters; PTB JSON-encodes every non-string value"""
+    if not content_type.startswith('application/x-www-form-urlencoded'):
+        return {}
+    params = {}
+    for key, value in parse_qsl(body.decode()):
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+class FakeBotAPI:
+    """
+    Local stand-in for the Telegram Bot API
+
+    Answers every method with a plausible result, records the calls it
+    received and can inject latency and 429 responses. Updates appended to
+    `updates` are handed out by getUpdates.
+
+    Args:
+        latency (float): Seconds added to every response
+        jitter (float): Up to this many extra seconds, chosen at random per call
+        rate_limit_ratio (float): Fraction of calls answered with 429 Too Many Requests
+        retry_after (int): retry_after sent with injected 429s
+        rate_limit_calls (dict[str, set[int]]): Calls answered with 429, by method and
+            1-based number of the call to that method
+        stall_calls (dict[str, set[int]]): Calls never answered, the same way, e.g. to
+            kill the bot while it waits for one
+        fail_calls (dict[str, set[int]]): Calls answered with 400 Bad Request, the same way
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit_ratio=0.0, retry_after=1,
+                 rate_limit_calls=None, stall_calls=None, fail_calls=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.rate_limit_calls = rate_limit_calls or {}
+        self.stall_calls = stall_calls or {}
+        self.fail_calls = fail_calls or {}
+        # Calls received per Bot API method, and 429s injected per method
+        self.counts = Counter()
+        self.rate_limited = Counter()
+        # (time, method, params) of every call received, and of those answered successfully
+        self.calls = []
+        self.answered = []
+        # Update dicts served by getUpdates, in update_id order
+        self.updates = []
+        self._message_id = 0
+        self._server = None
+        # Open connections, and the tasks serving them
+        self._writers = set()
+        self._handlers = set()
+        self._stopped = asyncio.Event()
+
+    async def start(self, host='127.0.0.1', port=0):
+        """
+        Returns:
+            str: Base URL to use as BOT_API_URL
+        """
+        self._server = await asyncio.start_server(self._handle, host, port)
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/bot"
+
+    async def stop(self):
+        self._stopped.set()
+        if self._server:
+            self._server.close()
+            # Keep-alive connections outlive the server; closing them ends their handlers
+            for writer in list(self._writers):
+                writer.close()
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+            await self._server.wait_closed()
+
+    def calls_to(self, method, chat_id=None, answered=False):
+        """
+        Recorded parameters of calls to `method`, optionally only those for one chat
+
+        With `answered`, only calls that succeeded, i.e. that Telegram would have carried out.
+        """
+        return [
+            params for _, called, params in (self.answered if answered else self.calls)
+            if called == method and (chat_id is None or str(params.get('chat_id')) == str(chat_id))
+        ]
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        self._handlers.add(asyncio.current_task())
+        try:
+            # Keep-alive: serve requests on this connection until the client closes it
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                headers = {}
+                for line in header_lines:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                # The path is /bot<token>/<method>
+                method = request_line.split(' ')[1].rsplit('/', 1)[-1]
+                params = _parse_params(body, headers.get('content-type', ''))
+                status, payload = await self._respond(method, params)
+
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    async def _respond(self, method, params):
+        self.counts[method] += 1
+        number = self.counts[method]
+        self.calls.append((time.monotonic(), method, params))
+
+        if number in self.stall_calls.get(method, ()):
+            # Never answer; the client gives up or goes away first
+            await self._stopped.wait()
+            raise ConnectionError("Fake Bot API stopped")
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if method == 'getUpdates':
+            return 200, {'ok': True, 'result': await self._get_updates(params)}
+
+        if number in self.rate_limit_calls.get(method, ()) or (
+                method != 'getMe' and random.random() < self.rate_limit_ratio):
+            self.rate_limited[method] += 1
+            return 429, {
+                'ok': False,
+                'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after}
+            }
+        if number in self.fail_calls.get(method, ()):
+            return 400, {'ok': False, 'error_code': 400, 'description': "Bad Request: injected failure"}
+        self.answered.append((time.monotonic(), method, params))
+        return 200, {'ok': True, 'result': self._result(method, params)}
+
+    async def _get_updates(self, params):
+        """Updates from `offset` on, long polling up to `timeout` seconds while there are none"""
+        offset, limit = params.get('offset') or 0, params.get('limit') or 100
+        deadline = time.monotonic() + (params.get('timeout') or 0)
+        while True:
+            pending = [update for update in self.updates if update['update_id'] >= offset][:limit]
+            if pending or time.monotonic() >= deadline or self._stopped.is_set():
+                return pending
+            await asyncio.sleep(0.05)
+
+    def _message(self, chat_id):
+        self._message_id += 1
+        try:
+            chat = {'id': int(chat_id), 'type': 'private' if int(chat_id) > 0 else 'channel'}
+        except (TypeError, ValueError):
+            # A channel given by @username
+            chat = {'id': -1, 'type': 'channel', 'username': str(chat_id).lstrip('@')}
+        return {'message_id': self._message_id, 'date': int(time.time()), 'chat': chat}
+
+    def _result(self, method, params):
+        if method == 'getMe':
+            return BOT_USER
+        if method in MESSAGE_METHODS:
+            return self._message(params.get('chat_id', 1))
+        if method == 'sendMediaGroup':
+            return [self._message(params['chat_id']) for _ in params['media']]
+        return True
@@ -0,0 +1,151 @@
+"""
+Near-duplicate lookups among a million stored photo hashes
+
+Seeds a scratch SQLite database with --hashes random perceptual hashes, four
+photos per submission, then looks up photos with find_duplicates the way an
+upload does: half of them a few bits away from a stored photo, half of them
+new. Every lookup's result is compared with a brute-force Hamming scan over
+all stored hashes:
+
+    python -m loadtest.hashes --hashes 1000000
+
+Exits with status 1 if a lookup found other submissions than the scan, or
+the lookups' p95 took longer than --max-ms.
+"""
+import argparse
+import asyncio
+import random
+import sqlite3
+import sys
+import time
+
+from loadtest import configure
+
+PHOTOS_PER_SUBMISSION = 4
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m loadtest.hashes', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hashes', type=int, default=1000000, help="Photo hashes stored")
+    parser.add_argument('--lookups', type=int, default=50, help="Photos looked up")
+    parser.add_argument('--max-ms', type=float, default=50, help="Most milliseconds the lookups' p95 may take")
+    return parser.parse_args()
+
+
+def seed(database, hashes):
+    """
+    Store the hashes with SQL of their own, four photos to a submission
+
+    Secondary indexes are dropped during the inserts and built again afterwards.
+    """
+    from dedup import hash_columns, BANDS
+
+    connection = sqlite3.connect(database)
+    try:
+        indexes = connection.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+            "AND tbl_name IN ('submissions', 'images')"
+        ).fetchall()
+        for name, _ in indexes:
+            connection.execute(f"DROP INDEX {name}")
+        submissions = -(-len(hashes) // PHOTOS_PER_SUBMISSION)
+        connection.executemany(
+            "INSERT INTO submissions (id, submission_id, user_id, status) VALUES (?, ?, ?, 'approved')",
+            ((i, f"h{i}", i) for i in range(1, submissions + 1))
+        )
+        columns = ['file_unique_id', 'phash'] + [f"phash_band{band}" for band in range(BANDS)]
+        connection.executemany(
+            f"INSERT INTO images (submission_id, file_id, is_check_image, sequence, {', '.join(columns)}) "
+            f"VALUES (?, ?, 0, ?, {', '.join('?' * len(columns))})",
+            (
+                (i // PHOTOS_PER_SUBMISSION + 1, f"photo-{i}", i % PHOTOS_PER_SUBMISSION + 1,
+                 *hash_columns(f"photo-{i}", phash).values())
+                for i, phash in enumerate(hashes)
+            )
+        )
+        for _, sql in indexes:
+            connection.execute(sql)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def near(phash, bits, rng):
+    """The hash with `bits` random bits flipped"""
+    for bit in rng.sample(range(64), bits):
+        phash ^= 1 << bit
+    return phash
+
+
+def brute_force(hashes, phash, max_distance):
+    """
+    Returns:
+        set[str]: IDs of submissions with a photo within `max_distance` bits, from scanning every hash
+    """
+    return {
+        f"h{i // PHOTOS_PER_SUBMISSION + 1}" for i, stored in enumerate(hashes)
+        if (stored ^ phash).bit_count() <= max_distance
+    }
+
+
+async def run_lookups(hashes, count, rng):
+    """
+    Returns:
+        tuple[list[float], int, list[str]]: Lookup durations in seconds, how many found a
+            duplicate, and lookups that disagreed with the scan
+    """
+    from database import close_db
+    from dedup import find_duplicates, PHASH_MAX_DISTANCE
+
+    durations, matched, problems = [], 0, []
+    try:
+        for n in range(count):
+            if n % 2:
+                phash = rng.getrandbits(64)
+            else:
+                phash = near(rng.choice(hashes), rng.randint(0, PHASH_MAX_DISTANCE), rng)
+            started = time.perf_counter()
+            found = set(await find_duplicates(f"upload-{n}", phash))
+            durations.append(time.perf_counter() - started)
+            matched += bool(found)
+
+            expected = brute_force(hashes, phash, PHASH_MAX_DISTANCE)
+            if found != expected:
+                problems.append(f"{phash:016x}: found {sorted(found)}, scan found {sorted(expected)}")
+    finally:
+        await close_db()
+    return durations, matched, problems
+
+
+def main():
+    args = parse_args()
+    database = configure('hashes', PHASH_ENABLED='true')
+
+    from database import init_db
+    from loadtest.__main__ import percentile
+
+    init_db()
+    rng = random.Random(0)
+    hashes = [rng.getrandbits(64) for _ in range(args.hashes)]
+    started = time.perf_counter()
+    seed(database, hashes)
+    print(f"Seeded {args.hashes} hashes in {time.perf_counter() - started:.1f}s")
+
+    durations, matched, problems = asyncio.run(run_lookups(hashes, args.lookups, rng))
+    durations.sort()
+    p95 = percentile(durations, 0.95) * 1000
+    print(f"{args.lookups} lookups, {matched} finding a duplicate: p50 {percentile(durations, 0.50) * 1000:.2f} ms, "
+          f"p95 {p95:.2f} ms, max {durations[-1] * 1000:.2f} ms")
+
+    if p95 > args.max_ms:
+        problems.append(f"p95 {p95:.2f} ms, limit {args.max_ms} ms")
+    if problems:
+        print("\nLookups went wrong:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("\nEvery lookup found the same submissions as the scan")
+
+
+if __name__ == '__main__':
+    main()
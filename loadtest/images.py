@@ -0,0 +1,163 @@
+"""
+Photo hashing and check analysis on generated sample images
+
+Draws food photos and check photos with Pillow, then runs them through the
+worker processes the bot uses: near-duplicates of a food photo (resized,
+re-encoded or slightly brightened) have to be found by find_duplicates, other
+photos must not be, and each check photo has to get the expected warnings:
+
+    python -m loadtest.images
+
+Exits with status 1 if any image was judged wrongly.
+"""
+import asyncio
+import io
+import random
+import sys
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+
+from loadtest import configure
+
+
+def encode(image, quality=90):
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def food_photo(seed, size=(1280, 960)):
+    """A plate of randomly placed, coloured shapes on a table"""
+    rng = random.Random(seed)
+    image = Image.new('RGB', size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    draw.ellipse((width * 0.15, height * 0.1, width * 0.85, height * 0.9), fill=(240, 240, 235))
+    for _ in range(12):
+        x, y = rng.uniform(0.2, 0.7) * width, rng.uniform(0.2, 0.7) * height
+        r = rng.uniform(0.05, 0.15) * width
+        draw.ellipse((x, y, x + r, y + r * rng.uniform(0.5, 1.5)), fill=tuple(rng.randrange(256) for _ in range(3)))
+    return image.filter(ImageFilter.GaussianBlur(2))
+
+
+def check_photo(size=(900, 1400)):
+    """A receipt: lines of dark text on white paper"""
+    rng = random.Random(0)
+    image = Image.new('L', size, 235)
+    draw = ImageDraw.Draw(image)
+    for line in range(40, size[1] - 40, 30):
+        x = 40
+        while x < size[0] - 120:
+            word = rng.randrange(30, 110)
+            draw.rectangle((x, line, x + word, line + 16), fill=20)
+            x += word + 20
+    return image
+
+
+# Food photos that must count as duplicates of the original, by description
+DUPLICATES = {
+    'same file': lambda image: image,
+    'resized': lambda image: image.resize((640, 480)),
+    're-encoded': lambda image: Image.open(io.BytesIO(encode(image, quality=40))),
+    'brightened': lambda image: ImageEnhance.Brightness(image).enhance(1.1),
+}
+# Seeds of food photos that must not
+DIFFERENT = range(1, 6)
+
+# Check photos and the warnings they must get
+CHECKS = {
+    'sharp receipt': (lambda: check_photo(), set()),
+    'blurred receipt': (lambda: check_photo().filter(ImageFilter.GaussianBlur(4)), {'blurry'}),
+    'small receipt': (lambda: check_photo().resize((300, 466)), {'low resolution'}),
+    'dark receipt': (lambda: ImageEnhance.Brightness(check_photo()).enhance(0.15), {'too dark'}),
+}
+
+
+async def check_hashes():
+    """
+    Returns:
+        list[str]: Photos judged wrongly
+    """
+    from database import AsyncSession
+    from dedup import dhash, hamming, find_duplicates, PHASH_MAX_DISTANCE
+    from repository import save_submissions
+    from workers import run_in_process
+
+    original = food_photo(0)
+    phash = await run_in_process(dhash, encode(original))
+    async with AsyncSession() as session:
+        await save_submissions(session, [{
+            'submission_id': 'original',
+            'user_id': 1,
+            'nickname': 'Images',
+            'image_count': 1,
+            'people_count': 1,
+            'delivery_source': 'Test',
+            'images': ['original-food'],
+            'check_image': None,
+            'image_keys': [['original', phash]],
+        }])
+        await session.commit()
+
+    problems = []
+    photos = {name: (variant(original), True) for name, variant in DUPLICATES.items()}
+    photos.update({f"other photo {seed}": (food_photo(seed), False) for seed in DIFFERENT})
+    for name, (image, duplicate) in photos.items():
+        # The same file keeps its file_unique_id; everything else was uploaded anew
+        file_unique_id = 'original' if name == 'same file' else name
+        other = await run_in_process(dhash, encode(image))
+        found = await find_duplicates(file_unique_id, other) == ['original']
+        print(f"{name:<20}{hamming(phash, other):>4} bits  {'duplicate' if found else 'new'}")
+        if found != duplicate:
+            problems.append(f"{name}: expected {'a duplicate' if duplicate else 'no duplicate'} "
+                            f"at {hamming(phash, other)} bits (max {PHASH_MAX_DISTANCE})")
+    return problems
+
+
+async def check_analysis():
+    """
+    Returns:
+        list[str]: Check photos given the wrong warnings
+    """
+    from analysis import ANALYZERS, run_pipeline, summarize
+    from workers import run_in_process
+
+    problems = []
+    for name, (draw, expected) in CHECKS.items():
+        findings, _ = await run_in_process(run_pipeline, encode(draw()), list(ANALYZERS.items()))
+        warnings = {result['warning'] for result in findings.values() if 'warning' in result}
+        print(f"{name:<20}{summarize(findings)}")
+        if warnings != expected:
+            problems.append(f"{name}: warned {sorted(warnings)}, expected {sorted(expected)}")
+    return problems
+
+
+async def run():
+    configure('images', PHASH_ENABLED='true', ANALYSIS_ENABLED='true')
+
+    from database import init_db, close_db
+    import workers
+
+    init_db()
+    try:
+        problems = await check_hashes()
+        print()
+        problems += await check_analysis()
+    finally:
+        await workers.shutdown()
+        await close_db()
+    return problems
+
+
+def main():
+    problems = asyncio.run(run())
+    if problems:
+        print("\nImages judged wrongly:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("\nEvery image was judged as expected")
+
+
+if __name__ == '__main__':
+    main()
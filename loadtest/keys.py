@@ -0,0 +1,183 @@
+"""
+Images keyed by the submission's public ID string vs its integer row ID
+
+Seeds a scratch SQLite database the way older versions stored it: images
+referencing their submission by its UUID submission_id string, indexed the
+same way as now. Then init_db() moves the images onto submissions.id, and
+both layouts are measured on the same rows:
+
+- the size of the images table and of ix_images_submission_check_sequence
+- a submission joined with its images, looked up by public ID
+- a range of --batch submissions joined with their images
+
+    python -m loadtest.keys --submissions 200000
+
+Exits with status 1 if the integer-keyed index isn't smaller, or a join got
+slower by more than --tolerance.
+"""
+import argparse
+import random
+import sqlite3
+import sys
+import time
+
+from loadtest import configure
+
+INDEX = 'ix_images_submission_check_sequence'
+# Runs per query, of which the fastest counts
+REPEAT = 20
+# Images per submission: three food photos and the check photo
+PHOTOS = 4
+# Latency differences smaller than this are noise, whatever the relative change
+MIN_REGRESSION_MS = 0.05
+
+# The join each query makes, by layout: the column images.submission_id holds
+JOINS = {
+    'string': 'images.submission_id = submissions.submission_id',
+    'integer': 'images.submission_id = submissions.id',
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m loadtest.keys', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--submissions', type=int, default=200000, help="Submissions seeded")
+    parser.add_argument('--batch', type=int, default=1000, help="Submissions joined by the range query")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed relative slowdown (default 0.1)")
+    return parser.parse_args()
+
+
+def seed_string_keyed(database, count):
+    """Replace the images table with the old layout and fill both tables, with SQL of their own"""
+    connection = sqlite3.connect(database)
+    try:
+        connection.executescript(
+            "DROP TABLE images;"
+            "CREATE TABLE images (id INTEGER PRIMARY KEY, submission_id VARCHAR, file_id VARCHAR, "
+            "is_check_image BOOLEAN, sequence INTEGER);"
+        )
+        # UUID4-shaped public IDs, like older versions generated
+        connection.execute(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?), "
+            "hex(i, h) AS (SELECT i, lower(hex(randomblob(16))) FROM n) "
+            "INSERT INTO submissions (id, submission_id, user_id, nickname, image_count, people_count, "
+            "delivery_source, status, created_at) "
+            "SELECT i, substr(h, 1, 8) || '-' || substr(h, 9, 4) || '-4' || substr(h, 14, 3) || '-' || "
+            "substr(h, 17, 4) || '-' || substr(h, 21, 12), i, 'User ' || i, 3, 2, 'Test', 'approved', "
+            "strftime('%Y-%m-%d %H:%M:%f', '2024-01-01', '+' || (i * 10) || ' seconds') FROM hex",
+            (count,)
+        )
+        connection.execute(
+            "INSERT INTO images (submission_id, file_id, is_check_image, sequence) "
+            "SELECT submissions.submission_id, 'photo-' || submissions.id || '-' || k.k, k.k = 4, "
+            "CASE WHEN k.k < 4 THEN k.k END "
+            "FROM submissions, (SELECT 1 AS k UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4) AS k"
+        )
+        connection.execute(f"CREATE INDEX {INDEX} ON images (submission_id, is_check_image, sequence)")
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def fastest(connection, sql, parameters):
+    """
+    Returns:
+        tuple[float, list]: Fastest of REPEAT runs in milliseconds, and the rows
+    """
+    best = None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        rows = connection.execute(sql, parameters).fetchall()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+
+def measure(database, layout, public_ids, batch):
+    """
+    Returns:
+        dict: Table and index bytes, and milliseconds and rows of each join
+    """
+    join = JOINS[layout]
+    connection = sqlite3.connect(database)
+    try:
+        sizes = dict(connection.execute(
+            "SELECT name, SUM(pgsize) FROM dbstat WHERE name IN ('images', ?) GROUP BY name", (INDEX,)
+        ).fetchall())
+        detail, detail_rows = 0.0, 0
+        for public_id in public_ids:
+            ms, rows = fastest(
+                connection,
+                f"SELECT submissions.nickname, images.file_id, images.is_check_image, images.sequence "
+                f"FROM submissions JOIN images ON {join} WHERE submissions.submission_id = ? "
+                f"ORDER BY images.is_check_image, images.sequence",
+                (public_id,)
+            )
+            detail += ms / len(public_ids)
+            detail_rows += len(rows)
+        start = len(public_ids)
+        batch_ms, batch_rows = fastest(
+            connection,
+            f"SELECT submissions.id, images.file_id FROM submissions JOIN images ON {join} "
+            f"WHERE submissions.id BETWEEN ? AND ?",
+            (start, start + batch - 1)
+        )
+    finally:
+        connection.close()
+    return {
+        'table': sizes.get('images', 0),
+        'index': sizes.get(INDEX, 0),
+        'detail': (detail, detail_rows),
+        'batch': (batch_ms, len(batch_rows)),
+    }
+
+
+def main():
+    args = parse_args()
+    database = configure('keys')
+
+    from database import init_db
+
+    init_db()
+    started = time.perf_counter()
+    seed_string_keyed(database, args.submissions)
+    print(f"Seeded {args.submissions} submissions and {args.submissions * PHOTOS} string-keyed images "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    connection = sqlite3.connect(database)
+    try:
+        ids = [row[0] for row in connection.execute("SELECT submission_id FROM submissions").fetchall()]
+    finally:
+        connection.close()
+    public_ids = random.Random(0).sample(ids, min(100, len(ids)))
+
+    results = {'string': measure(database, 'string', public_ids, args.batch)}
+    started = time.perf_counter()
+    init_db()
+    print(f"init_db() moved the images onto integer keys in {time.perf_counter() - started:.1f}s\n")
+    results['integer'] = measure(database, 'integer', public_ids, args.batch)
+
+    print(f"{'layout':<10}{'table MB':>10}{'index MB':>10}{'detail ms':>11}{'batch ms':>10}")
+    for layout, result in results.items():
+        print(f"{layout:<10}{result['table'] / 2 ** 20:>10.1f}{result['index'] / 2 ** 20:>10.1f}"
+              f"{result['detail'][0]:>11.3f}{result['batch'][0]:>10.3f}")
+
+    string, integer = results['string'], results['integer']
+    problems = []
+    if integer['index'] >= string['index']:
+        problems.append(f"{INDEX}: {integer['index']} bytes keyed by integer, {string['index']} by string")
+    for query in ('detail', 'batch'):
+        if integer[query][1] != string[query][1]:
+            problems.append(f"{query}: {integer[query][1]} rows keyed by integer, {string[query][1]} by string")
+        if (integer[query][0] > string[query][0] * (1 + args.tolerance)
+                and integer[query][0] - string[query][0] > MIN_REGRESSION_MS):
+            problems.append(f"{query}: {string[query][0]:.3f} ms -> {integer[query][0]:.3f} ms")
+    if problems:
+        print("\nInteger keys didn't pay off:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print(f"\nThe integer-keyed index is {1 - integer['index'] / string['index']:.0%} smaller")
+
+
+if __name__ == '__main__':
+    main()
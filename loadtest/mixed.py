@@ -0,0 +1,164 @@
+"""
+Mixed reads and writes on SQLite, with and without WAL and the read-only pool
+
+For --seconds, --readers tasks page through the pending list the way admins
+do, while --writers tasks save confirmed submissions, on a scratch SQLite
+database seeded with --submissions submissions. The same workload runs with:
+
+- rollback: the rollback journal, every query through the main pool
+- wal: write-ahead logging, every query through the main pool
+- wal+read-pool: write-ahead logging, the pending list through the read-only pool
+
+Each setup runs in its own process, since the journal mode and the pools are
+set up when the database module is imported:
+
+    python -m loadtest.mixed --readers 8 --writers 4 --seconds 10
+
+Exits with status 1 if wal+read-pool had a failed read or write, or its read
+p95 was worse than the rollback journal's by more than --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+from loadtest import configure
+from loadtest.__main__ import percentile
+
+# Settings of each setup
+MODES = {
+    'rollback': {'DB_SQLITE_JOURNAL_MODE': 'DELETE', 'DB_READ_POOL_SIZE': 0},
+    'wal': {'DB_SQLITE_JOURNAL_MODE': 'WAL', 'DB_READ_POOL_SIZE': 0},
+    'wal+read-pool': {'DB_SQLITE_JOURNAL_MODE': 'WAL', 'DB_READ_POOL_SIZE': 4},
+}
+# Latency differences smaller than this are noise, whatever the relative change
+MIN_REGRESSION_MS = 5.0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m loadtest.mixed', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--submissions', type=int, default=20000, help="Submissions seeded")
+    parser.add_argument('--readers', type=int, default=8, help="Tasks paging through the pending list")
+    parser.add_argument('--writers', type=int, default=4, help="Tasks saving submissions")
+    parser.add_argument('--seconds', type=float, default=10, help="Seconds the workload runs")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative regression (default 0.2)")
+    parser.add_argument('--mode', choices=MODES, help="Run only this setup, printing its results as JSON")
+    return parser.parse_args()
+
+
+def summarize(durations, failed, seconds):
+    durations.sort()
+    return {
+        'count': len(durations),
+        'failed': failed,
+        'per_s': round(len(durations) / seconds, 1),
+        'p50_ms': round(percentile(durations, 0.50) * 1000, 3) if durations else None,
+        'p95_ms': round(percentile(durations, 0.95) * 1000, 3) if durations else None,
+    }
+
+
+async def workload(args):
+    """
+    Returns:
+        dict: Reads and writes summarized, see summarize()
+    """
+    from database import close_db
+    from repository import get_pending_page
+    from writer import submission_writer
+
+    deadline = time.monotonic() + args.seconds
+    timings = {'reads': [], 'writes': []}
+    failed = {'reads': 0, 'writes': 0}
+    written = 0
+
+    async def timed(kind, call):
+        started = time.perf_counter()
+        try:
+            await call()
+        except Exception:
+            failed[kind] += 1
+        else:
+            timings[kind].append(time.perf_counter() - started)
+
+    async def reader():
+        while time.monotonic() < deadline:
+            async def read():
+                rows, _, _ = await get_pending_page()
+                await get_pending_page(after=(rows[-1].created_at, rows[-1].id))
+            await timed('reads', read)
+
+    async def writer(n):
+        nonlocal written
+        while time.monotonic() < deadline:
+            written += 1
+            submission_id = f"mixed-{n}-{written}"
+            # The writer isn't started, so every save commits its own transaction
+            await timed('writes', lambda: submission_writer.save({
+                'submission_id': submission_id, 'user_id': n, 'nickname': f"User {n}", 'image_count': 3,
+                'people_count': 2, 'delivery_source': 'Test',
+                'images': [f"{submission_id}-food-{i}" for i in range(3)], 'check_image': f"{submission_id}-check",
+            }))
+
+    try:
+        await asyncio.gather(*(reader() for _ in range(args.readers)), *(writer(n) for n in range(args.writers)))
+    finally:
+        await close_db()
+    return {kind: summarize(timings[kind], failed[kind], args.seconds) for kind in timings}
+
+
+def run_mode(mode, args):
+    database = configure('mixed', **MODES[mode])
+
+    from database import init_db
+    from loadtest.plans import seed
+
+    init_db()
+    seed(database, args.submissions)
+    return asyncio.run(workload(args))
+
+
+def main():
+    args = parse_args()
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args)))
+        return
+
+    results = {}
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, '-m', 'loadtest.mixed', '--mode', mode, '--submissions', str(args.submissions),
+             '--readers', str(args.readers), '--writers', str(args.writers), '--seconds', str(args.seconds)],
+            stdout=subprocess.PIPE, text=True, check=True
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{'setup':<15}{'reads/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'failed':>8}"
+          f"{'writes/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'failed':>8}")
+    for mode, result in results.items():
+        line = f"{mode:<15}"
+        for kind, width in (('reads', 9), ('writes', 10)):
+            stats = result[kind]
+            line += (f"{stats['per_s']:>{width}.1f}{stats['p50_ms'] or 0:>9.1f}{stats['p95_ms'] or 0:>9.1f}"
+                     f"{stats['failed']:>8}")
+        print(line)
+
+    best, baseline = results['wal+read-pool'], results['rollback']
+    problems = []
+    for kind in ('reads', 'writes'):
+        if best[kind]['failed']:
+            problems.append(f"wal+read-pool: {best[kind]['failed']} {kind} failed")
+    before, after = baseline['reads']['p95_ms'] or 0, best['reads']['p95_ms'] or 0
+    if after > before * (1 + args.tolerance) and after - before > MIN_REGRESSION_MS:
+        problems.append(f"read p95 {before:.1f} ms with the rollback journal, {after:.1f} ms with wal+read-pool")
+    if problems:
+        print("\nWAL and the read pool didn't hold up:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("\nwal+read-pool served every read and write")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Overhead of recording metrics, from end-to-end runs with metrics on and off
+
+Runs the end-to-end load test (python -m loadtest) --rounds times with
+METRICS_ENABLED on and as often with it off, each run in its own process.
+Which setting goes first flips every round, and the best throughput of each
+setting is compared, so a run slowed down by something else on the machine
+doesn't count against either. End-to-end runs on a small machine still vary
+by several percent from one to the next, well above what recording costs
+(a few microseconds per update), so the default budget leaves room for that:
+
+    python -m loadtest.overhead --users 300 --rounds 4 --budget 0.1
+
+Exits with status 1 if recording metrics cost more than --budget of the
+throughput.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+SETTINGS = {'on': 'true', 'off': 'false'}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m loadtest.overhead', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=300, help="Simulated users per run")
+    parser.add_argument('--concurrency', type=int, default=100, help="Users going through the flow at once")
+    parser.add_argument('--rounds', type=int, default=4, help="Runs with each setting")
+    parser.add_argument('--budget', type=float, default=0.1, help="Allowed share of throughput lost (default 0.1)")
+    return parser.parse_args()
+
+
+def run_loadtest(metrics, args):
+    """
+    Returns:
+        dict: Results of one end-to-end run, as saved by --save-baseline
+    """
+    with tempfile.TemporaryDirectory(prefix='foodbot-overhead-') as directory:
+        path = os.path.join(directory, 'results.json')
+        subprocess.run(
+            [sys.executable, '-m', 'loadtest', '--users', str(args.users), '--concurrency', str(args.concurrency),
+             '--save-baseline', path],
+            env={**os.environ, 'METRICS_ENABLED': SETTINGS[metrics]},
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True
+        )
+        with open(path) as f:
+            return json.load(f)
+
+
+def main():
+    args = parse_args()
+
+    runs = {metrics: [] for metrics in SETTINGS}
+    for round_ in range(args.rounds):
+        order = list(SETTINGS) if round_ % 2 == 0 else list(reversed(SETTINGS))
+        for metrics in order:
+            results = run_loadtest(metrics, args)
+            runs[metrics].append(results)
+            print(f"round {round_ + 1}, metrics {metrics}: {results['throughput']['updates_per_s']} updates/s")
+
+    best = {
+        metrics: max(results, key=lambda results: results['throughput']['updates_per_s'])
+        for metrics, results in runs.items()
+    }
+    print(f"\n{'step':<14}{'p50 ms on':>11}{'p50 ms off':>12}")
+    for step, stats in best['on']['steps'].items():
+        off = best['off']['steps'].get(step, {}).get('p50_ms', 0)
+        print(f"{step:<14}{stats['p50_ms']:>11.1f}{off:>12.1f}")
+
+    on = best['on']['throughput']['updates_per_s']
+    off = best['off']['throughput']['updates_per_s']
+    overhead = 1 - on / off
+    print(f"\nBest throughput: {on} updates/s with metrics, {off} without: {overhead:.1%} overhead")
+    if overhead > args.budget:
+        print(f"\nRecording metrics costs more than the budget of {args.budget:.0%}")
+        sys.exit(1)
+    print(f"\nWithin the budget of {args.budget:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Query plans of the pending list and the submission detail on a large database
+
+Seeds a scratch SQLite database with --submissions submissions, one in a
+hundred of them pending, each with three food photos and a check photo. Then
+it runs the pending list's pages and the submission detail the way the bot
+does, and shows SQLite's plan and the duration of every statement they execute:
+
+    python -m loadtest.plans --submissions 1000000
+
+Exits with status 1 if a plan scans submissions or images instead of
+searching them through ix_submissions_status_created_at and
+ix_images_submission_check_sequence.
+"""
+import argparse
+import asyncio
+import sqlite3
+import sys
+import time
+
+from loadtest import configure
+
+# Index each query has to search, by name
+EXPECTED = {
+    'first page': 'ix_submissions_status_created_at',
+    'next page': 'ix_submissions_status_created_at',
+    'previous page': 'ix_submissions_status_created_at',
+    'submission detail': 'ix_images_submission_check_sequence',
+}
+# Runs per query, of which the fastest counts
+REPEAT = 5
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m loadtest.plans', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--submissions', type=int, default=1000000, help="Submissions seeded")
+    return parser.parse_args()
+
+
+def seed(database, count):
+    """
+    Fill the tables with SQL of their own; far faster than going through the application
+
+    Secondary indexes are dropped during the inserts and built again afterwards.
+    """
+    connection = sqlite3.connect(database)
+    try:
+        indexes = connection.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+            "AND tbl_name IN ('submissions', 'images')"
+        ).fetchall()
+        for name, _ in indexes:
+            connection.execute(f"DROP INDEX {name}")
+        connection.execute(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?) "
+            "INSERT INTO submissions (id, submission_id, user_id, nickname, image_count, people_count, "
+            "delivery_source, status, created_at) "
+            "SELECT i, 's' || i, i % 50000, 'User ' || i, 3, 2, 'Test', "
+            "CASE WHEN i % 100 = 0 THEN 'pending' ELSE 'approved' END, "
+            "strftime('%Y-%m-%d %H:%M:%f', '2024-01-01', '+' || (i * 10) || ' seconds') FROM n",
+            (count,)
+        )
+        connection.execute(
+            "INSERT INTO images (submission_id, file_id, is_check_image, sequence) "
+            "SELECT submissions.id, 'photo-' || submissions.id || '-' || k.k, k.k = 4, "
+            "CASE WHEN k.k < 4 THEN k.k END "
+            "FROM submissions, (SELECT 1 AS k UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4) AS k"
+        )
+        for _, sql in indexes:
+            connection.execute(sql)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+class StatementRecorder:
+    """Records the statements executed by the application's engines, with their parameters"""
+
+    def __init__(self, engines):
+        from sqlalchemy import event
+
+        self.statements = []
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append((statement, parameters))
+
+    async def capture(self, query):
+        """
+        Returns:
+            tuple[list[tuple[str, tuple]], float]: Statements run by `query`, and its fastest
+                run in milliseconds
+        """
+        fastest = None
+        for _ in range(REPEAT):
+            self.statements = []
+            started = time.perf_counter()
+            await query()
+            elapsed = (time.perf_counter() - started) * 1000
+            fastest = elapsed if fastest is None else min(fastest, elapsed)
+        return self.statements, fastest
+
+
+async def run_queries(recorder):
+    """
+    Returns:
+        dict[str, tuple[list[tuple[str, tuple]], float]]: Statements and milliseconds per query
+    """
+    from database import AsyncSession
+    from repository import get_pending_page, get_submission
+
+    rows, _, _ = await get_pending_page()
+    middle, _, _ = await get_pending_page(after=(rows[-1].created_at, rows[-1].id))
+    cursor = (middle[0].created_at, middle[0].id)
+
+    async def detail():
+        async with AsyncSession() as session:
+            submission = await get_submission(session, middle[0].submission_id)
+        assert len(submission.food_images) == 3 and submission.check_image
+
+    queries = {
+        'first page': get_pending_page,
+        'next page': lambda: get_pending_page(after=cursor),
+        'previous page': lambda: get_pending_page(before=cursor),
+        'submission detail': detail,
+    }
+    return {name: await recorder.capture(query) for name, query in queries.items()}
+
+
+def explain(database, statements):
+    """
+    Returns:
+        list[str]: SQLite's query plan steps for every statement
+    """
+    connection = sqlite3.connect(database)
+    try:
+        return [
+            row[3]
+            for statement, parameters in statements
+            for row in connection.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        ]
+    finally:
+        connection.close()
+
+
+def main():
+    args = parse_args()
+    database = configure('plans')
+
+    from database import init_db, close_db, async_engine, read_engine
+
+    init_db()
+    started = time.perf_counter()
+    seed(database, args.submissions)
+    print(f"Seeded {args.submissions} submissions and {args.submissions * 4} images "
+          f"in {time.perf_counter() - started:.1f}s\n")
+
+    async def run():
+        recorder = StatementRecorder({async_engine.sync_engine, read_engine.sync_engine})
+        try:
+            return await run_queries(recorder)
+        finally:
+            await close_db()
+
+    problems = []
+    for name, (statements, ms) in asyncio.run(run()).items():
+        plan = explain(database, statements)
+        print(f"{name}: {len(statements)} statements, {ms:.2f} ms")
+        for step in plan:
+            print(f"  {step}")
+        scans = [step for step in plan if step.startswith(('SCAN submissions', 'SCAN images'))]
+        if scans:
+            problems.append(f"{name}: {'; '.join(scans)}")
+        if not any(EXPECTED[name] in step for step in plan):
+            problems.append(f"{name}: doesn't use {EXPECTED[name]}")
+
+    if problems:
+        print("\nQueries not served by their index:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("\nEvery query searches its index")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""
+Statement counts and latency of the list and detail views
+
+Seeds a scratch SQLite database, then runs each view against a small and a
+large number of submissions, counting the SQL statements it executes:
+
+    python -m loadtest.queries
+
+A view whose statement count grows with the number of rows has an N+1
+query, and one running more statements than it needs loads data it doesn't
+use. Either exits with status 1. The submission detail is also loaded the
+old way, the submission, its food images and its check image one query
+after another, as a baseline.
+"""
+import asyncio
+import sys
+import time
+
+from loadtest import configure
+
+# Submissions per run, and food photos per submission
+SIZES = (10, 500)
+IMAGES = 3
+# Most statements each view should need
+EXPECTED = {
+    'pending page': 1,
+    'submission detail': 1,
+    'detail, 3 queries': 3,
+    'channel post': 1,
+    'approve one': 1,
+    'reject all': 3,
+}
+
+
+class StatementCounter:
+    """Counts statements executed by the application's engines"""
+
+    def __init__(self, engines):
+        from sqlalchemy import event
+
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+    async def measure(self, view):
+        """
+        Returns:
+            tuple[int, float]: Statements executed by the view and its duration in milliseconds
+        """
+        before = self.count
+        started = time.perf_counter()
+        await view()
+        return self.count - before, (time.perf_counter() - started) * 1000
+
+
+async def seed(count, start):
+    """Insert `count` pending submissions; returns their public IDs"""
+    from database import AsyncSession
+    from repository import save_submissions
+
+    ids = [f"q{start + i}" for i in range(count)]
+    async with AsyncSession() as session:
+        await save_submissions(session, [{
+            'submission_id': submission_id,
+            'user_id': start + i,
+            'nickname': f"User {start + i}",
+            'image_count': IMAGES,
+            'people_count': 2,
+            'delivery_source': 'Test',
+            'images': [f"{submission_id}-food-{n}" for n in range(IMAGES)],
+            'check_image': f"{submission_id}-check",
+        } for i, submission_id in enumerate(ids)])
+        await session.commit()
+    return ids
+
+
+async def run_views(counter, ids):
+    """
+    Returns:
+        dict[str, tuple[int, float]]: Statements and milliseconds per view
+    """
+    from database import AsyncSession
+    from handlers.admin_handler import _render_pending_page
+    from sqlalchemy import select
+    from models import Submission, Image
+    from moderation import bulk_moderate, transition
+    from notifications import build_channel_media
+    from repository import get_submission
+
+    async def detail():
+        async with AsyncSession() as session:
+            submission = await get_submission(session, ids[0])
+        assert len(submission.food_images) == IMAGES and submission.check_image
+
+    async def detail_before():
+        # The way the detail used to be loaded, before get_submission() joined the images in
+        async with AsyncSession() as session:
+            submission = await session.scalar(select(Submission).filter_by(submission_id=ids[0]))
+            food_images = (await session.scalars(
+                select(Image).filter_by(submission_id=submission.id, is_check_image=False).order_by(Image.sequence)
+            )).all()
+            check_image = await session.scalar(
+                select(Image).filter_by(submission_id=submission.id, is_check_image=True)
+            )
+        assert len(food_images) == IMAGES and check_image
+
+    async def channel_post():
+        async with AsyncSession() as session:
+            submission = await get_submission(session, ids[1])
+        assert len(build_channel_media(submission)) == IMAGES + 1
+
+    async def approve_one():
+        async with AsyncSession() as session:
+            assert await transition(session, Submission.submission_id == ids[2], 'approve')
+            await session.commit()
+
+    async def reject_all():
+        result = await bulk_moderate('reject', limit=len(ids))
+        assert result['moderated'] == len(ids) - 1
+
+    views = {
+        'pending page': _render_pending_page,
+        'submission detail': detail,
+        'detail, 3 queries': detail_before,
+        'channel post': channel_post,
+        'approve one': approve_one,
+        'reject all': reject_all,
+    }
+    return {name: await counter.measure(view) for name, view in views.items()}
+
+
+async def run():
+    configure('queries', BULK_MODERATION_LIMIT=max(SIZES))
+
+    from database import init_db, close_db, async_engine, read_engine
+
+    init_db()
+    counter = StatementCounter({async_engine.sync_engine, read_engine.sync_engine})
+    results = {}
+    start = 0
+    try:
+        for size in SIZES:
+            ids = await seed(size, start)
+            start += size
+            results[size] = await run_views(counter, ids)
+    finally:
+        await close_db()
+    return results
+
+
+def main():
+    results = asyncio.run(run())
+
+    print(f"{'view':<20}" + ''.join(f"{f'{size} rows':>22}" for size in SIZES))
+    problems = []
+    for view, expected in EXPECTED.items():
+        cells = []
+        for size in SIZES:
+            statements, ms = results[size][view]
+            cells.append(f"{statements:>6} stmts {ms:>7.1f} ms")
+            if statements > expected:
+                problems.append(f"{view}: {statements} statements with {size} rows, expected {expected}")
+        print(f"{view:<20}" + ''.join(f"{cell:>22}" for cell in cells))
+
+    if problems:
+        print("\nViews running more statements than they need:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("\nEvery view runs a fixed number of statements")
+
+
+if __name__ == '__main__':
+    main()
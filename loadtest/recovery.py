@@ -0,0 +1,200 @@
+"""
+Crash-recovery check of channel publishing against a fake Bot API
+
+Publishes approved submissions of 10 food photos plus the check photo,
+which takes two media groups each:
+
+1. The first is published by an outbox worker in a child process, which is
+   killed while Telegram hasn't answered its second media group yet. The
+   outbox in this process takes the message over once its lease expires.
+2. The second gets a 429 for its second media group and is retried.
+3. The third was already published, but the process stopped before the
+   submitter's approval notice was queued.
+
+Each media group has to reach the channel exactly once, and each submitter
+has to get exactly one approval notice:
+
+    python -m loadtest.recovery
+
+Exits with status 1 if any was sent twice or not at all.
+"""
+import asyncio
+import signal
+import sys
+import time
+
+from loadtest import configure, CHANNEL_ID, UNLIMITED
+from loadtest.fake_api import FakeBotAPI
+
+# Submitter of each submission, so their notices can be told apart
+USER_IDS = {'crash': 42, 'throttled': 43, 'published': 44}
+FOOD_IMAGES = 10
+# Seconds to wait for each step before giving up
+TIMEOUT = 30
+
+
+async def wait_for(condition, what):
+    deadline = time.monotonic() + TIMEOUT
+    while not await condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Timed out waiting for {what}")
+        await asyncio.sleep(0.1)
+
+
+async def approve(submission_id, published=False):
+    """
+    Store an approved submission and queue its channel post
+
+    With `published`, the post is stored as if all of its media groups had
+    already reached the channel.
+    """
+    from sqlalchemy import update
+    from database import AsyncSession
+    from models import Submission
+    from outbox import enqueue, POST_PARTS
+    from repository import get_user, save_submissions
+
+    user_id = USER_IDS[submission_id]
+    await get_user(user_id, create=True)
+    async with AsyncSession() as session:
+        await save_submissions(session, [{
+            'submission_id': submission_id,
+            'user_id': user_id,
+            'nickname': 'Recovery',
+            'image_count': FOOD_IMAGES,
+            'people_count': 2,
+            'delivery_source': 'Test',
+            'status': 'approved',
+            'images': [f"{submission_id}-food-{i}" for i in range(FOOD_IMAGES)],
+            'check_image': f"{submission_id}-check",
+        }])
+        if published:
+            await session.execute(
+                update(Submission).where(Submission.submission_id == submission_id)
+                .values(channel_post_id=1, channel_parts_sent=POST_PARTS)
+            )
+        await enqueue(session, 'publish', f"publish:{submission_id}", {
+            'submission_id': submission_id,
+            'notify': True
+        })
+        await session.commit()
+
+
+async def delivered(submission_id):
+    """Whether the channel post and the approval notice it queues were both sent"""
+    from outbox import get_statuses
+
+    keys = [f"publish:{submission_id}", f"notify:approve:{submission_id}"]
+    statuses = await get_statuses(keys)
+    return all(statuses.get(key) == 'done' for key in keys)
+
+
+def check(api, submission_id, published=False):
+    """
+    Returns:
+        list[str]: What went wrong publishing the submission or notifying its submitter
+    """
+    parts = [
+        params['media'][0]['media'] for params in api.calls_to('sendMediaGroup', CHANNEL_ID, answered=True)
+        if params['media'][0]['media'].startswith(f"{submission_id}-")
+    ]
+    expected = [] if published else [f"{submission_id}-food-0", f"{submission_id}-check"]
+    # The last media group has only the check photo, which is sent with sendPhoto
+    parts += [
+        params['photo'] for params in api.calls_to('sendPhoto', CHANNEL_ID, answered=True)
+        if params['photo'].startswith(f"{submission_id}-")
+    ]
+    problems = [
+        f"{submission_id}: media group starting with {part} sent {parts.count(part)} times"
+        for part in expected if parts.count(part) != 1
+    ]
+    if published and parts:
+        problems.append(f"{submission_id}: already published, but {len(parts)} media groups were sent again")
+    notices = len(api.calls_to('sendMessage', USER_IDS[submission_id], answered=True))
+    if notices != 1:
+        problems.append(f"{submission_id}: notify:approve:{submission_id} delivered {notices} times")
+    return problems
+
+
+async def run():
+    # A lone check photo is sent with sendPhoto. The first post's is never answered,
+    # and the second post's gets a 429
+    api = FakeBotAPI(stall_calls={'sendPhoto': {1}}, rate_limit_calls={'sendPhoto': {2}})
+    base_url = await api.start()
+    # Inherited by the worker this process kills. It takes over the killed worker's message quickly
+    configure(
+        'recovery', base_url, OUTBOX_LEASE=1, OUTBOX_POLL_INTERVAL=0.2,
+        TELEGRAM_GROUP_RATE=UNLIMITED, TELEGRAM_CHAT_RATE=UNLIMITED, TELEGRAM_CHAT_BURST=UNLIMITED
+    )
+
+    from telegram import Bot
+    from config import TOKEN, BOT_API_URL
+    from database import init_db, close_db
+    from outbox import outbox
+
+    init_db()
+    await approve('crash')
+
+    worker = await asyncio.create_subprocess_exec(sys.executable, '-m', 'loadtest.recovery', '--worker')
+    try:
+        async def stalled():
+            return api.counts['sendPhoto'] >= 1
+
+        await wait_for(stalled, "the worker to send its second media group")
+    finally:
+        worker.send_signal(signal.SIGKILL)
+        await worker.wait()
+    print("Killed the worker while it waited for its second media group")
+
+    async with Bot(TOKEN, base_url=BOT_API_URL) as bot:
+        outbox.start(bot)
+        try:
+            await wait_for(lambda: delivered('crash'), "the crashed post to be taken over")
+            await approve('throttled')
+            outbox.wake()
+            await wait_for(lambda: delivered('throttled'), "the throttled post to be retried")
+            await approve('published', published=True)
+            outbox.wake()
+            await wait_for(lambda: delivered('published'), "the published post's notice to be queued")
+        finally:
+            await outbox.stop()
+            await close_db()
+            await api.stop()
+
+    problems = check(api, 'crash') + check(api, 'throttled') + check(api, 'published', published=True)
+    sent, answered = (
+        len(api.calls_to('sendMediaGroup', CHANNEL_ID, answered)) + len(api.calls_to('sendPhoto', CHANNEL_ID, answered))
+        for answered in (False, True)
+    )
+    print(f"Channel media groups answered: {answered} of {sent} sent; injected 429s: {dict(api.rate_limited)}")
+    print(f"Approval notices answered: {len(api.calls_to('sendMessage', answered=True))}")
+    return problems
+
+
+async def work():
+    """Drain the outbox until killed"""
+    from telegram import Bot
+    from config import TOKEN, BOT_API_URL
+    from outbox import outbox
+
+    async with Bot(TOKEN, base_url=BOT_API_URL) as bot:
+        outbox.start(bot)
+        await asyncio.Event().wait()
+
+
+def main():
+    if sys.argv[1:] == ['--worker']:
+        asyncio.run(work())
+        return
+
+    problems = asyncio.run(run())
+    if problems:
+        print("\nChannel posts or approval notices were not sent exactly once:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("\nEvery media group and approval notice was sent exactly once")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Concurrent Bot API sends through the default request pool and PooledRequest
+
+Sends --sends messages at once against the fake Bot API, first through
+python-telegram-bot's default HTTPXRequest, then through PooledRequest
+configured the way build_application() configures the bot's pool:
+
+    python -m loadtest.sends --sends 100 --latency 0.05
+
+Each pool reports its throughput, the latency of the sends that succeeded,
+and how many timed out waiting for a connection. Exits with status 1 if any
+send through PooledRequest failed, or its throughput wasn't at least
+--min-speedup times the default's.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from loadtest import configure, UNLIMITED
+from loadtest.fake_api import FakeBotAPI
+from loadtest.__main__ import percentile
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m loadtest.sends', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sends', type=int, default=100, help="Messages sent at once")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds the fake Bot API takes per call")
+    parser.add_argument('--min-speedup', type=float, default=5, help="Throughput PooledRequest has to gain")
+    return parser.parse_args()
+
+
+def build_requests():
+    """
+    Returns:
+        dict[str, BaseRequest]: Request objects to compare, by name
+    """
+    from telegram.request import HTTPXRequest
+    from bot_request import PooledRequest
+    from config import (
+        BOT_API_POOL_SIZE, BOT_API_KEEPALIVE, BOT_API_KEEPALIVE_EXPIRY, BOT_API_HTTP_VERSION,
+        BOT_API_POOL_TIMEOUT, BOT_API_READ_TIMEOUT
+    )
+
+    return {
+        'default': HTTPXRequest(),
+        'pooled': PooledRequest(
+            'bot',
+            pool_size=BOT_API_POOL_SIZE,
+            keepalive_connections=BOT_API_KEEPALIVE,
+            keepalive_expiry=BOT_API_KEEPALIVE_EXPIRY,
+            http_version=BOT_API_HTTP_VERSION,
+            pool_timeout=BOT_API_POOL_TIMEOUT,
+            read_timeout=BOT_API_READ_TIMEOUT
+        ),
+    }
+
+
+async def send_all(bot, count):
+    """
+    Returns:
+        tuple[float, list[float], int]: Seconds for all sends, sorted seconds per successful
+            send, and the number of sends that failed
+    """
+    async def send(chat_id):
+        started = time.perf_counter()
+        await bot.send_message(chat_id=chat_id, text="Hello")
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(send(chat_id) for chat_id in range(1, count + 1)), return_exceptions=True)
+    duration = time.perf_counter() - started
+    durations = sorted(result for result in results if not isinstance(result, BaseException))
+    return duration, durations, len(results) - len(durations)
+
+
+async def run(args):
+    api = FakeBotAPI(latency=args.latency)
+    base_url = await api.start()
+    configure('sends', base_url, TELEGRAM_GLOBAL_RATE=UNLIMITED, TELEGRAM_CHAT_RATE=UNLIMITED)
+
+    from telegram import Bot
+    from config import TOKEN, BOT_API_URL
+    import metrics
+
+    results = {}
+    try:
+        for name, request in build_requests().items():
+            async with Bot(TOKEN, base_url=BOT_API_URL, request=request) as bot:
+                results[name] = await send_all(bot, args.sends)
+    finally:
+        await api.stop()
+    waits = metrics.histogram('bot_api_pool_wait_seconds', pool='bot')
+    return results, waits
+
+
+def main():
+    args = parse_args()
+    results, waits = asyncio.run(run(args))
+
+    throughput = {}
+    for name, (duration, durations, failed) in results.items():
+        throughput[name] = len(durations) / duration
+        latency = (f"p50 {percentile(durations, 0.50) * 1000:.1f} ms, p95 {percentile(durations, 0.95) * 1000:.1f} ms"
+                   if durations else "no send succeeded")
+        print(f"{name}: {args.sends} sends in {duration:.2f}s, {throughput[name]:.1f}/s, "
+              f"{failed} failed, {latency}")
+    if waits:
+        print(f"PooledRequest waited for a connection {waits.sum / waits.count * 1000:.2f} ms on average")
+
+    problems = []
+    if results['pooled'][2]:
+        problems.append(f"{results['pooled'][2]} sends through PooledRequest failed")
+    speedup = throughput['pooled'] / throughput['default'] if throughput['default'] else float('inf')
+    print(f"Speedup: {speedup:.1f}x")
+    if speedup < args.min_speedup:
+        problems.append(f"speedup {speedup:.1f}x, expected at least {args.min_speedup}x")
+    if problems:
+        print("\nPooledRequest didn't keep up:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("\nEvery send through PooledRequest succeeded")
+
+
+if __name__ == '__main__':
+    main()
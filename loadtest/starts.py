@@ -0,0 +1,161 @@
+"""
+A /start storm of returning users, with and without the user cache
+
+Seeds --users users who already picked a nickname, then has each of them send
+/start --repeat times, all at once up to --concurrency, against the fake Bot
+API and a scratch SQLite database. The storm runs twice: once with the user
+cache emptied and sized 0, so every /start reads the users table, and once
+with the cache. Each run reports the SQL statements executed and the round
+trip of a /start, from handing the update over until its handlers finished:
+
+    python -m loadtest.starts --users 1000 --repeat 5
+
+Exits with status 1 if the cached run reads the users table more than once
+per user, or its hit and miss counts don't add up to that.
+"""
+import argparse
+import asyncio
+import sqlite3
+import sys
+import time
+
+from loadtest import configure, UNLIMITED
+from loadtest.fake_api import FakeBotAPI
+from loadtest.__main__ import percentile
+
+PHASES = ('uncached', 'cached')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m loadtest.starts', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000, help="Returning users sending /start")
+    parser.add_argument('--repeat', type=int, default=5, help="/start commands per user")
+    parser.add_argument('--concurrency', type=int, default=100, help="Users sending /start at once")
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds the fake Bot API takes per call")
+    return parser.parse_args()
+
+
+def seed(database, users):
+    """Insert `users` users with a nickname, with SQL of their own"""
+    connection = sqlite3.connect(database)
+    try:
+        connection.executemany(
+            "INSERT INTO users (user_id, nickname) VALUES (?, ?)",
+            ((user_id, f"user{user_id}") for user_id in range(1, users + 1))
+        )
+        connection.commit()
+    finally:
+        connection.close()
+
+
+async def storm(application, factory, args):
+    """
+    Returns:
+        list[float]: Sorted seconds each /start took
+    """
+    from loadtest.users import process
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    durations = []
+
+    async def user(user_id):
+        async with semaphore:
+            for _ in range(args.repeat):
+                durations.append(await process(application, factory.text(user_id, '/start')))
+
+    await asyncio.gather(*(user(user_id) for user_id in range(1, args.users + 1)))
+    return sorted(durations)
+
+
+async def run(args):
+    api = FakeBotAPI(latency=args.latency)
+    base_url = await api.start()
+    # Persistence writes are pushed past the run, so only the handlers' own statements are counted
+    database = configure(
+        'starts', base_url, BOT_MODE='polling', PERSISTENCE_INTERVAL=3600,
+        THROTTLE_USER_RATE=UNLIMITED, THROTTLE_USER_BURST=UNLIMITED,
+        THROTTLE_GLOBAL_RATE=UNLIMITED, THROTTLE_GLOBAL_BURST=UNLIMITED,
+        TELEGRAM_GLOBAL_RATE=UNLIMITED, TELEGRAM_CHAT_RATE=UNLIMITED, TELEGRAM_CHAT_BURST=UNLIMITED
+    )
+
+    from sqlalchemy import event
+    from database import init_db, async_engine, read_engine
+    from loadtest.users import UpdateFactory
+    from main import build_application
+    from repository import user_cache
+    from webhook import WebhookApp
+    import metrics
+
+    init_db()
+    seed(database, args.users)
+    application = build_application()
+    lifecycle = WebhookApp(application)
+    await lifecycle.startup()
+
+    statements = []
+
+    def record(conn, cursor, statement, *rest):
+        statements.append(statement)
+
+    for engine in {async_engine.sync_engine, read_engine.sync_engine}:
+        event.listen(engine, 'before_cursor_execute', record)
+
+    factory = UpdateFactory(application.bot)
+    results = {}
+    maxsize = user_cache.maxsize
+    try:
+        for phase in PHASES:
+            user_cache.clear()
+            user_cache.hits = user_cache.misses = 0
+            user_cache.maxsize = maxsize if phase == 'cached' else 0
+            statements.clear()
+            started = time.perf_counter()
+            durations = await storm(application, factory, args)
+            results[phase] = {
+                'duration': time.perf_counter() - started,
+                'durations': durations,
+                'statements': len(statements),
+                'user_reads': sum('FROM users' in statement for statement in statements),
+                'stats': user_cache.stats,
+            }
+        exported = [line for line in (await metrics.render()).splitlines() if line.startswith('user_cache_')]
+    finally:
+        user_cache.maxsize = maxsize
+        await lifecycle.shutdown()
+        await api.stop()
+    return results, exported
+
+
+def main():
+    args = parse_args()
+    results, exported = asyncio.run(run(args))
+
+    starts = args.users * args.repeat
+    for phase, result in results.items():
+        durations = result['durations']
+        print(f"{phase}: {starts} /start in {result['duration']:.2f}s, "
+              f"{result['statements']} statements ({result['user_reads']} reading users), "
+              f"p50 {percentile(durations, 0.50) * 1000:.1f} ms, p95 {percentile(durations, 0.95) * 1000:.1f} ms")
+    saved = results['uncached']['user_reads'] - results['cached']['user_reads']
+    print(f"The cache saved {saved} users reads, {saved / starts:.0%} of them")
+    print("Exported:")
+    for line in exported:
+        print(f"  {line}")
+
+    cached = results['cached']
+    problems = []
+    if cached['user_reads'] > args.users:
+        problems.append(f"{cached['user_reads']} users reads for {args.users} users")
+    if cached['stats']['misses'] != args.users or cached['stats']['hits'] != starts - args.users:
+        problems.append(f"cache stats {cached['stats']}, expected {args.users} misses "
+                        f"and {starts - args.users} hits")
+    if problems:
+        print("\nThe user cache didn't take the storm off the database:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("\nEvery user read the users table once")
+
+
+if __name__ == '__main__':
+    main()
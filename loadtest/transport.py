@@ -0,0 +1,208 @@
+"""
+Update delivery throughput over a webhook compared with long polling
+
+Sends the same /start updates from distinct users to the real application
+both ways, against the fake Bot API and a scratch SQLite database:
+
+- webhook: concurrent senders in another process POST each update to the
+  webhook app served by uvicorn, like Telegram does with up to 40 connections
+- polling: the updates are queued in the fake Bot API and fetched with getUpdates
+
+Each mode runs in its own process, and reports how fast updates were handled
+and how long each took from being sent until its handlers had run. The webhook
+sender needs a CPU core of its own, or the webhook figures include its work:
+
+    python -m loadtest.transport --updates 2000 --senders 40
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from loadtest import configure, UNLIMITED
+from loadtest.fake_api import FakeBotAPI
+from loadtest.__main__ import percentile
+
+MODES = ('webhook', 'polling')
+SECRET = 'transport'
+# Seconds to wait for every update to be handled
+TIMEOUT = 120
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m loadtest.transport', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--updates', type=int, default=1000, help="Updates delivered, each from a different user")
+    parser.add_argument('--senders', type=int, default=40, help="Concurrent webhook connections")
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds the fake Bot API takes per call")
+    parser.add_argument('--mode', choices=MODES, help="Run only this mode, printing its results as JSON")
+    parser.add_argument('--send', nargs=2, metavar=('URL', 'PATH'),
+                        help="Only POST the updates in the JSON file at PATH to URL, printing when each was sent")
+    return parser.parse_args()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def send(url, path, senders):
+    """
+    POST every update in a JSON file to the webhook, `senders` at a time
+
+    Returns:
+        dict[int, float]: Time each update was sent, by update_id
+    """
+    import httpx
+
+    with open(path) as f:
+        queue = list(reversed(json.load(f)))
+    headers = {'X-Telegram-Bot-Api-Secret-Token': SECRET}
+    sent = {}
+
+    async def sender(client):
+        while queue:
+            update = queue.pop()
+            sent[update['update_id']] = time.time()
+            response = await client.post(url, json=update, headers=headers)
+            response.raise_for_status()
+
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=senders)) as client:
+        await asyncio.gather(*(sender(client) for _ in range(senders)))
+    return sent
+
+
+async def deliver_webhook(lifecycle, updates, senders):
+    """
+    Serve the webhook app and have a separate process send it the updates, like Telegram would
+
+    Returns:
+        dict[int, float]: Time each update was sent, by update_id
+    """
+    import uvicorn
+    from config import WEBHOOK_PATH
+
+    port = free_port()
+    # The application is started and stopped around the run, like for polling
+    server = uvicorn.Server(uvicorn.Config(lifecycle, host='127.0.0.1', port=port, lifespan='off', log_level='warning'))
+    serving = asyncio.create_task(server.serve())
+    try:
+        while not server.started:
+            await asyncio.sleep(0.05)
+
+        path = os.path.join(tempfile.mkdtemp(prefix='foodbot-transport-'), 'updates.json')
+        with open(path, 'w') as f:
+            json.dump(updates, f)
+        sender = await asyncio.create_subprocess_exec(
+            sys.executable, '-m', 'loadtest.transport', '--send', f"http://127.0.0.1:{port}{WEBHOOK_PATH}", path,
+            '--senders', str(senders), stdout=asyncio.subprocess.PIPE
+        )
+        output, _ = await sender.communicate()
+        if sender.returncode:
+            raise RuntimeError(f"Webhook sender exited with status {sender.returncode}")
+        return {int(update_id): at for update_id, at in json.loads(output.strip().splitlines()[-1]).items()}
+    finally:
+        server.should_exit = True
+        await serving
+
+
+async def run_mode(mode, count, senders, latency):
+    """
+    Returns:
+        dict: Duration, throughput and latency percentiles of handling `count` updates
+    """
+    api = FakeBotAPI(latency=latency)
+    base_url = await api.start()
+    # Measure delivery, not the update throttle
+    configure(
+        'transport', base_url, WEBHOOK_SECRET=SECRET,
+        THROTTLE_GLOBAL_RATE=UNLIMITED, THROTTLE_GLOBAL_BURST=UNLIMITED, TELEGRAM_GLOBAL_RATE=UNLIMITED
+    )
+
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    from database import init_db
+    from loadtest.users import UpdateFactory
+    from main import build_application
+    from webhook import WebhookApp
+
+    init_db()
+    application = build_application()
+    factory = UpdateFactory(application.bot)
+    updates = [factory.text(user_id, '/start').to_dict() for user_id in range(1, count + 1)]
+
+    handled = {}
+    done = asyncio.Event()
+
+    async def mark_handled(update, context):
+        handled[update.update_id] = time.time()
+        if len(handled) == count:
+            done.set()
+
+    # Runs once the bot's own handlers are done, in a group of its own
+    application.add_handler(TypeHandler(Update, mark_handled), group=1)
+
+    lifecycle = WebhookApp(application)
+    await lifecycle.startup()
+    try:
+        if mode == 'webhook':
+            sent = await deliver_webhook(lifecycle, updates, senders)
+        else:
+            # Telegram has all of them waiting when polling starts
+            sent = dict.fromkeys((update['update_id'] for update in updates), time.time())
+            api.updates.extend(updates)
+            await application.updater.start_polling(timeout=1)
+        await asyncio.wait_for(done.wait(), TIMEOUT)
+    finally:
+        if application.updater.running:
+            await application.updater.stop()
+        await lifecycle.shutdown()
+        await api.stop()
+
+    # Wall-clock times, since the webhook's updates are sent from another process
+    duration = max(handled.values()) - min(sent.values())
+    latencies = sorted(handled[update_id] - sent[update_id] for update_id in handled)
+    return {
+        'updates': count,
+        'duration_s': round(duration, 3),
+        'updates_per_s': round(count / duration, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+
+def main():
+    args = parse_args()
+    if args.send:
+        print(json.dumps(asyncio.run(send(*args.send, args.senders))))
+        return
+    if args.mode:
+        print(json.dumps(asyncio.run(run_mode(args.mode, args.updates, args.senders, args.latency))))
+        return
+
+    # Separate processes, so each mode starts with fresh application state
+    results = {}
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, '-m', 'loadtest.transport', '--mode', mode, '--updates', str(args.updates),
+             '--senders', str(args.senders), '--latency', str(args.latency)],
+            stdout=subprocess.PIPE, text=True, check=True
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{'mode':<10}{'updates':>9}{'seconds':>10}{'updates/s':>11}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for mode, stats in results.items():
+        print(
+            f"{mode:<10}{stats['updates']:>9}{stats['duration_s']:>10.2f}{stats['updates_per_s']:>11.1f}"
+            f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import asyncio
+import itertools
+import time
+
+from sqlalchemy import select
+from telegram import Update
+
+from config import NICKNAME, IMAGE_COUNT, UPLOAD_IMAGES, UPLOAD_CHECK, PEOPLE_COUNT, DELIVERY_SOURCE, CONFIRM
+from database import AsyncSession
+from models import Submission, Image
+import callbacks
+
+# Marks a step after which the conversation should have ended
+ENDED = None
+
+
+class UpdateFactory:
+    """Builds the updates Telegram would send for a private chat with the bot"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _message(self, chat_id, sender, **fields):
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': sender,
+            **fields
+        }
+
+    def _update(self, **fields):
+        return Update.de_json({'update_id': next(self._update_ids), **fields}, self.bot)
+
+    @staticmethod
+    def _user(user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}"}
+
+    def text(self, user_id, text):
+        fields = {'text': text}
+        if text.startswith('/'):
+            fields['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return self._update(message=self._message(user_id, self._user(user_id), **fields))
+
+    def photo(self, user_id, file_id, media_group_id=None):
+        sizes = [
+            {'file_id': f"{file_id}-{width}", 'file_unique_id': f"{file_id}-{width}",
+             'width': width, 'height': width * 3 // 4, 'file_size': width * 100}
+            for width in (320, 1280)
+        ]
+        fields = {'photo': sizes}
+        if media_group_id:
+            fields['media_group_id'] = media_group_id
+        return self._update(message=self._message(user_id, self._user(user_id), **fields))
+
+    def callback(self, user_id, data):
+        # The button belongs to a message the bot sent in the user's chat
+        message = self._message(user_id, self.bot.bot.to_dict(), text="Buttons")
+        return self._update(callback_query={
+            'id': str(next(self._update_ids)),
+            'from': self._user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': message
+        })
+
+
+class SimulatedUser:
+    """
+    Walks one user through the whole submission flow, then has admins approve it
+
+    Each step is timed from handing the update to the application until its
+    handlers have finished. A step fails if the conversation doesn't end up in
+    the expected state; the user then stops. All of `admin_ids` click Approve
+    at the same moment, and every click counts as an approve step.
+    """
+
+    def __init__(self, user_id, admin_ids, image_count=3, album=False):
+        self.user_id = user_id
+        self.admin_ids = admin_ids
+        self.image_count = image_count
+        # Send the food images as one album instead of one by one
+        self.album = album
+
+    def steps(self, factory):
+        """
+        Yields:
+            tuple[str, Update, int]: Step name, update and the conversation state expected afterwards
+        """
+        user_id = self.user_id
+        yield 'start', factory.text(user_id, '/start'), NICKNAME
+        yield 'nickname', factory.text(user_id, f"user{user_id}"), IMAGE_COUNT
+        yield 'image_count', factory.text(user_id, str(self.image_count)), UPLOAD_IMAGES
+        media_group_id = f"album-{user_id}" if self.album else None
+        for i in range(1, self.image_count + 1):
+            expected = UPLOAD_IMAGES if i < self.image_count else UPLOAD_CHECK
+            yield 'image', factory.photo(user_id, f"food-{user_id}-{i}", media_group_id), expected
+        yield 'check', factory.photo(user_id, f"check-{user_id}"), PEOPLE_COUNT
+        yield 'people_count', factory.text(user_id, '2'), DELIVERY_SOURCE
+        yield 'source', factory.callback(user_id, 'source_wolt'), CONFIRM
+        yield 'confirm', factory.callback(user_id, 'confirm_yes'), ENDED
+
+    async def run(self, application, factory, record, pipeline=False):
+        """
+        Args:
+            application (Application): Application with all handlers registered
+            factory (UpdateFactory): Builds the user's updates
+            record (callable): Called with (step, seconds, ok) for every step
+            pipeline (bool): Send all updates at once instead of waiting for each
+        """
+        conversations = application._conversation_handler_conversations['submission']
+        key = (self.user_id, self.user_id)
+
+        if pipeline:
+            steps = list(self.steps(factory))
+            # Hand the updates over in order without waiting, like the update fetcher does
+            tasks = [asyncio.create_task(process(application, update)) for _, update, _ in steps]
+            durations = await asyncio.gather(*tasks)
+            # Only the final state can be checked; an update handled out of order derails the flow
+            ok = conversations.get(key) == ENDED
+            for (step, _, _), seconds in zip(steps, durations):
+                record(step, seconds, ok)
+            if not ok:
+                return
+        else:
+            for step, update, expected in self.steps(factory):
+                seconds = await process(application, update)
+                ok = conversations.get(key) == expected
+                record(step, seconds, ok)
+                if not ok:
+                    return
+
+        async with AsyncSession() as session:
+            submission_id = await session.scalar(
+                select(Submission.id)
+                .where(Submission.user_id == self.user_id)
+                .order_by(Submission.created_at.desc())
+                .limit(1)
+            )
+        if submission_id is None:
+            record('approve', 0.0, False)
+            return
+
+        if pipeline:
+            await self.check_order(submission_id, record)
+
+        data = callbacks.encode('approve', submission_id)
+        clicks = [factory.callback(admin_id, data) for admin_id in self.admin_ids]
+        durations = await asyncio.gather(*(process(application, update) for update in clicks))
+        async with AsyncSession() as session:
+            status = await session.scalar(
+                select(Submission.status).where(Submission.id == submission_id)
+            )
+        for seconds in durations:
+            record('approve', seconds, status == 'approved')
+
+    async def check_order(self, submission_id, record):
+        """Record whether the food images were saved in the order they were sent"""
+        async with AsyncSession() as session:
+            file_ids = (await session.scalars(
+                select(Image.file_id)
+                .where(Image.submission_id == submission_id, Image.is_check_image.is_(False))
+                .order_by(Image.sequence)
+            )).all()
+        # Photos are saved by their largest size, "<photo>-<width>"
+        sent = [file_id.rsplit('-', 1)[0] for file_id in file_ids]
+        expected = [f"food-{self.user_id}-{i}" for i in range(1, self.image_count + 1)]
+        record('order', 0.0, sent == expected)
+
+
+async def process(application, update):
+    """
+    Process one update the way the application's update fetcher would
+
+    Returns:
+        float: Seconds until all handlers for the update finished
+    """
+    started = time.perf_counter()
+    await application.update_processor.process_update(update, application.process_update(update))
+    return time.perf_counter() - started
@@ -0,0 +1,169 @@
+"""
+Throughput of saving confirmed submissions: a commit per submission vs write-behind
+
+Saves --submissions submissions, --concurrency at a time like confirms from
+that many users, into a scratch SQLite database, two ways:
+
+- per-row: the way the bot used to, each submission and every one of its
+  images added through the ORM and committed on its own
+- write-behind: through SubmissionWriter, which inserts submissions
+  confirmed at about the same time with one multi-row INSERT per table
+  in a shared transaction
+
+    python -m loadtest.writes --submissions 2000 --concurrency 100
+
+Each way reports its throughput, commits, failed saves and the latency of
+a save. Concurrent per-row transactions can fail with "database is locked"
+on SQLite; those saves are counted, not retried. Exits with status 1 if a
+write-behind save failed, a saved submission or image is missing, or
+write-behind wasn't at least --min-speedup times the per-row throughput.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from loadtest import configure
+from loadtest.__main__ import percentile
+
+MODES = ('per-row', 'write-behind')
+# Food photos per submission, saved with a check photo
+IMAGES = 3
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m loadtest.writes', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--submissions', type=int, default=2000, help="Submissions saved each way")
+    parser.add_argument('--concurrency', type=int, default=100, help="Submissions being saved at once")
+    parser.add_argument('--min-speedup', type=float, default=2, help="Throughput write-behind has to gain")
+    return parser.parse_args()
+
+
+def submission(mode, n):
+    submission_id = f"{mode}-{n}"
+    return {
+        'submission_id': submission_id,
+        'user_id': n,
+        'nickname': f"User {n}",
+        'image_count': IMAGES,
+        'people_count': 2,
+        'delivery_source': 'Test',
+        'images': [f"{submission_id}-food-{i}" for i in range(IMAGES)],
+        'check_image': f"{submission_id}-check",
+    }
+
+
+async def save_per_row(data):
+    """The old way: the ORM inserts one row at a time, and each submission commits on its own"""
+    from database import AsyncSession
+    from models import Submission, Image
+
+    data = dict(data)
+    images, check_image = data.pop('images'), data.pop('check_image')
+    async with AsyncSession() as session:
+        row = Submission(**data)
+        session.add(row)
+        await session.flush()
+        for i, file_id in enumerate(images):
+            session.add(Image(submission_id=row.id, file_id=file_id, is_check_image=False, sequence=i + 1))
+        session.add(Image(submission_id=row.id, file_id=check_image, is_check_image=True))
+        await session.commit()
+
+
+async def count_rows(mode):
+    """
+    Returns:
+        tuple[int, int]: Submissions and images saved by `mode`
+    """
+    from sqlalchemy import select, func
+    from database import AsyncSession
+    from models import Submission, Image
+
+    async with AsyncSession() as session:
+        submissions = await session.scalar(
+            select(func.count()).select_from(Submission).where(Submission.submission_id.like(f"{mode}-%"))
+        )
+        images = await session.scalar(
+            select(func.count()).select_from(Image).join(Submission, Image.submission_id == Submission.id)
+            .where(Submission.submission_id.like(f"{mode}-%"))
+        )
+    return submissions, images
+
+
+async def run(args):
+    configure('writes')
+
+    from sqlalchemy import event
+    from database import init_db, close_db, async_engine
+    from writer import submission_writer
+
+    init_db()
+    commits = []
+    event.listen(async_engine.sync_engine, 'commit', lambda conn: commits.append(1))
+    save = {'per-row': save_per_row, 'write-behind': submission_writer.save}
+
+    results = {}
+    try:
+        for mode in MODES:
+            if mode == 'write-behind':
+                submission_writer.start()
+            semaphore = asyncio.Semaphore(args.concurrency)
+            durations = []
+
+            async def confirm(n):
+                async with semaphore:
+                    started = time.perf_counter()
+                    await save[mode](submission(mode, n))
+                    durations.append(time.perf_counter() - started)
+
+            commits.clear()
+            started = time.perf_counter()
+            saves = await asyncio.gather(
+                *(confirm(n) for n in range(1, args.submissions + 1)), return_exceptions=True
+            )
+            duration = time.perf_counter() - started
+            await submission_writer.stop()
+            results[mode] = {
+                'duration': duration,
+                'durations': sorted(durations),
+                'commits': len(commits),
+                'failed': sum(isinstance(result, Exception) for result in saves),
+                'rows': await count_rows(mode),
+            }
+    finally:
+        await close_db()
+    return results
+
+
+def main():
+    args = parse_args()
+    results = asyncio.run(run(args))
+
+    problems = []
+    throughput = {}
+    for mode, result in results.items():
+        durations = result['durations']
+        saved = args.submissions - result['failed']
+        throughput[mode] = saved / result['duration']
+        print(f"{mode}: {throughput[mode]:.1f} submissions/s, {result['commits']} commits, "
+              f"{result['failed']} failed, p50 {percentile(durations, 0.50) * 1000:.1f} ms, "
+              f"p95 {percentile(durations, 0.95) * 1000:.1f} ms")
+        if result['rows'] != (saved, saved * (IMAGES + 1)):
+            problems.append(f"{mode}: {result['rows']} submissions and images for {saved} saves")
+    if results['write-behind']['failed']:
+        problems.append(f"write-behind: {results['write-behind']['failed']} saves failed")
+
+    speedup = throughput['write-behind'] / throughput['per-row']
+    print(f"Write-behind: {speedup:.1f}x the throughput")
+    if speedup < args.min_speedup:
+        problems.append(f"write-behind {speedup:.1f}x the throughput, expected at least {args.min_speedup}x")
+    if problems:
+        print("\nSaving submissions went wrong:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("\nEvery submission was saved, and write-behind kept ahead")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,144 @@
-from telegram.ext import Application
-from telegram.request import HTTPXRequest
-from config import TOKEN
-from database import init_db
+import asyncio
+import importlib.util
+
+from telegram import Bot
+from telegram.ext import Application, ContextTypes
+from bot_request import PooledRequest
+from config import (
+    TOKEN, BOT_API_URL, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_LISTEN, WEBHOOK_PORT,
+    WEBHOOK_WORKERS, BOT_API_POOL_SIZE, BOT_API_KEEPALIVE, BOT_API_KEEPALIVE_EXPIRY, BOT_API_HTTP_VERSION,
+    BOT_API_POOL_TIMEOUT, BOT_API_READ_TIMEOUT, GET_UPDATES_POOL_SIZE, METRICS_LISTEN, METRICS_PORT,
+    UPDATE_QUEUE_LIMIT, PHASH_ENABLED, ANALYSIS_ENABLED, logger
+)
+from database import init_db, close_db
+from drafts import Draft
 from handlers import setup_handlers
+from outbox import outbox
+from persistence import DatabasePersistence, run_eviction
+from processor import PerUserUpdateProcessor, UpdateQueue
+from admins import admin_registry, run_refresh
+from writer import submission_writer
+import workers
+import metrics
 
+# Long-running tasks started with the application and cancelled when it stops
+background_tasks = []
+# Servers started with the application and closed when it stops
+servers = []
 
-def main():
-    # Initialize database
-    init_db()
 
-    # Set up application with proper request adapter
-    request = HTTPXRequest()
-    application = Application.builder().token(TOKEN).request(request).build()
+async def on_startup(application):
+    """Start background services once the application is initialized"""
+    # Pillow is optional, and these features quietly do nothing without it
+    features = {'PHASH_ENABLED': PHASH_ENABLED, 'ANALYSIS_ENABLED': ANALYSIS_ENABLED}
+    needs_pillow = [name for name, enabled in features.items() if enabled]
+    if needs_pillow and importlib.util.find_spec('PIL') is None:
+        logger.warning(f"{' and '.join(needs_pillow)} set, but Pillow isn't installed; install it or disable them")
+    await admin_registry.load()
+    background_tasks.append(asyncio.create_task(run_eviction(application)))
+    background_tasks.append(asyncio.create_task(run_refresh(application)))
+    submission_writer.start()
+    outbox.start(application.bot)
+    if METRICS_PORT:
+        servers.append(await metrics.serve(METRICS_LISTEN, METRICS_PORT))
+
+
+async def on_stop(application):
+    """Cancel background services"""
+    await submission_writer.stop()
+    await outbox.stop()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    for server in servers:
+        server.close()
+        await server.wait_closed()
+    servers.clear()
+    await workers.shutdown()
+
+
+def build_application():
+    """Build the application with all handlers registered"""
+    # Set up application with separate connection pools for regular calls and long polling
+    request = PooledRequest(
+        'bot',
+        pool_size=BOT_API_POOL_SIZE,
+        keepalive_connections=BOT_API_KEEPALIVE,
+        keepalive_expiry=BOT_API_KEEPALIVE_EXPIRY,
+        http_version=BOT_API_HTTP_VERSION,
+        pool_timeout=BOT_API_POOL_TIMEOUT,
+        read_timeout=BOT_API_READ_TIMEOUT
+    )
+    get_updates_request = PooledRequest(
+        'get_updates',
+        pool_size=GET_UPDATES_POOL_SIZE,
+        keepalive_expiry=BOT_API_KEEPALIVE_EXPIRY,
+        http_version=BOT_API_HTTP_VERSION
+    )
+    # Different users' updates are handled concurrently, each user's in order, and
+    # no more are taken off the update queue than the processor is sized for
+    processor = PerUserUpdateProcessor(max_queued_updates=UPDATE_QUEUE_LIMIT)
+    update_queue = UpdateQueue(UPDATE_QUEUE_LIMIT, maxsize=UPDATE_QUEUE_LIMIT)
+    metrics.collector(processor.collect)
+    metrics.collector(update_queue.collect)
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(BOT_API_URL)
+        .request(request)
+        .get_updates_request(get_updates_request)
+        .update_queue(update_queue)
+        .persistence(DatabasePersistence())
+        .context_types(ContextTypes(user_data=Draft))
+        .concurrent_updates(processor)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(close_db)
+        .build()
+    )
 
     # Set up all handlers
     setup_handlers(application)
 
-    # Start polling
-    application.run_polling()
+    return application
+
+
+async def set_webhook():
+    """Point Telegram at this deployment's webhook endpoint"""
+    async with Bot(TOKEN, base_url=BOT_API_URL) as bot:
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET
+        )
+
+
+def main():
+    # Initialize database
+    init_db()
+
+    if BOT_MODE == 'webhook':
+        import uvicorn
+
+        if not WEBHOOK_SECRET:
+            raise ValueError("WEBHOOK_SECRET must be set in webhook mode")
+        if WEBHOOK_WORKERS > 1:
+            # Conversations, per-user ordering and throttling live in each process's memory,
+            # so a user's updates spread over several workers would break their submission
+            raise ValueError("WEBHOOK_WORKERS must be 1: conversation state isn't shared between processes")
+        # Register the webhook once, then let every worker serve it
+        asyncio.run(set_webhook())
+        uvicorn.run(
+            'webhook:create_app',
+            factory=True,
+            host=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            workers=WEBHOOK_WORKERS
+        )
+    else:
+        # Start polling
+        build_application().run_polling()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,196 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import time
+from collections import defaultdict
+
+from config import METRICS_ENABLED, logger
+
+# Default histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Counter values keyed by (name, sorted label pairs)
+_counters = defaultdict(int)
+# Histograms keyed the same way
+_histograms = {}
+# Gauge values keyed the same way
+_gauges = {}
+# Functions refreshing gauges before each export
+_collectors = []
+
+
+class Histogram:
+    """Cumulative histogram of observed values"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """
+    Increment a counter
+
+    Args:
+        name (str): Metric name, e.g. chat_cleanup_failures_total
+        value (int): Amount to add
+        **labels: Label values distinguishing series of the same metric
+    """
+    if METRICS_ENABLED:
+        _counters[_key(name, labels)] += value
+
+
+def get(name, **labels):
+    """Current value of a counter"""
+    return _counters.get(_key(name, labels), 0)
+
+
+def observe(name, value, **labels):
+    """
+    Record a value, usually a duration in seconds, in a histogram
+
+    Args:
+        name (str): Metric name, e.g. bot_api_pool_wait_seconds
+        value (float): Observed value
+        **labels: Label values distinguishing series of the same metric
+    """
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = Histogram()
+    histogram.observe(value)
+
+
+def histogram(name, **labels):
+    """The histogram recorded for a metric, or None if nothing was observed"""
+    return _histograms.get(_key(name, labels))
+
+
+def set_gauge(name, value, **labels):
+    """Set a gauge to its current value"""
+    _gauges[_key(name, labels)] = value
+
+
+def collector(func):
+    """
+    Register a function that updates gauges right before metrics are exported
+
+    The function may be a coroutine function. Usable as a decorator.
+    """
+    _collectors.append(func)
+    return func
+
+
+def timed(name, **labels):
+    """Decorator recording how long each call of a coroutine function takes in a histogram"""
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+async def render():
+    """
+    Export all metrics in the Prometheus text format
+
+    Returns:
+        str: Exposition text
+    """
+    for func in _collectors:
+        try:
+            result = func()
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            logger.exception(f"Error collecting metrics from {func.__name__}")
+
+    lines = []
+    typed = set()
+
+    def declare(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(_counters.items()):
+        declare(name, 'counter')
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), value in sorted(_gauges.items()):
+        declare(name, 'gauge')
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), histogram in sorted(_histograms.items(), key=lambda item: item[0]):
+        declare(name, 'histogram')
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, le=bound)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+    return '\n'.join(lines) + '\n'
+
+
+async def serve(host, port, reuse_port=False):
+    """
+    Serve render() over plain HTTP for Prometheus to scrape
+
+    Runs on its own port, so metrics are never exposed on the public webhook port.
+    With `reuse_port`, several processes listen on the same port, and each scrape
+    reaches one of them.
+
+    Returns:
+        asyncio.Server: The running server
+    """
+    async def handle(reader, writer):
+        try:
+            # Every request gets the metrics; only the request line and headers are read
+            await reader.readuntil(b'\r\n\r\n')
+            body = (await render()).encode()
+            writer.write(
+                b'HTTP/1.1 200 OK\r\n'
+                b'Content-Type: text/plain; version=0.0.4\r\n'
+                b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                b'Connection: close\r\n\r\n' + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port, reuse_port=reuse_port or None)
@@ -2,6 +2,7 @@ import sqlalchemy as db
 from datetime import datetime
 
 from sqlalchemy import func
+from sqlalchemy.orm import relationship
 
 from database import Base
 
@@ -17,10 +18,14 @@ class User(Base):
 
 class Submission(Base):
     __tablename__ = 'submissions'
+    __table_args__ = (
+        # Serves the pending queue: filter on status, oldest first
+        db.Index('ix_submissions_status_created_at', 'status', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    submission_id = db.Column(db.String, unique=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'))
+    submission_id = db.Column(db.String, unique=True)  # Public ID shown to admins; joins use id
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), index=True)
     nickname = db.Column(db.String)
     image_count = db.Column(db.Integer)
     people_count = db.Column(db.Integer)
@@ -28,13 +33,104 @@ class Submission(Base):
     status = db.Column(db.String, default='pending')  # pending, approved, rejected, deleted
     created_at = db.Column(db.DateTime, default=datetime.now)
     channel_post_id = db.Column(db.Integer, nullable=True)  # ID of the post in the channel, if approved
+    # Media groups of the channel post sent so far; a post with more than 10 photos takes two
+    channel_parts_sent = db.Column(db.Integer, nullable=True)
+
+    images = relationship(
+        'Image',
+        order_by='(Image.is_check_image, Image.sequence)',
+        lazy='raise'
+    )
+
+    @property
+    def food_images(self):
+        """Food images in upload order"""
+        return [image for image in self.images if not image.is_check_image]
+
+    @property
+    def check_image(self):
+        """The payment check image, if one was uploaded"""
+        return next((image for image in self.images if image.is_check_image), None)
 
 
 class Image(Base):
     __tablename__ = 'images'
+    __table_args__ = (
+        # Serves loading a submission's food images in order and its check image
+        db.Index('ix_images_submission_check_sequence', 'submission_id', 'is_check_image', 'sequence'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    submission_id = db.Column(db.String, db.ForeignKey('submissions.submission_id'))
+    submission_id = db.Column(db.Integer, db.ForeignKey('submissions.id'))
     file_id = db.Column(db.String)
     is_check_image = db.Column(db.Boolean, default=False)
-    sequence = db.Column(db.Integer, nullable=True)
\ No newline at end of file
+    sequence = db.Column(db.Integer, nullable=True)
+    # Unlike file_id, the same for every upload of the same file
+    file_unique_id = db.Column(db.String, nullable=True, index=True)
+    # Perceptual hash, and its four 16-bit bands indexed for near-duplicate lookups
+    phash = db.Column(db.BigInteger, nullable=True)
+    phash_band0 = db.Column(db.Integer, nullable=True, index=True)
+    phash_band1 = db.Column(db.Integer, nullable=True, index=True)
+    phash_band2 = db.Column(db.Integer, nullable=True, index=True)
+    phash_band3 = db.Column(db.Integer, nullable=True, index=True)
+
+
+class SavedDraft(Base):
+    __tablename__ = 'drafts'
+
+    user_id = db.Column(db.Integer, primary_key=True)
+    data = db.Column(db.String)  # JSON list produced by Draft.to_row()
+    updated_at = db.Column(db.DateTime, default=datetime.now, index=True)
+
+
+class SavedConversation(Base):
+    __tablename__ = 'conversations'
+
+    key = db.Column(db.String, primary_key=True)  # "<handler name>:<JSON conversation key>"
+    state = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime, default=datetime.now, index=True)
+
+
+class OutboxMessage(Base):
+    __tablename__ = 'outbox'
+    __table_args__ = (
+        # Serves the worker's "what is due next" query
+        db.Index('ix_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    idempotency_key = db.Column(db.String, unique=True)  # e.g. "publish:<submission_id>"
+    kind = db.Column(db.String)  # publish, notify
+    payload = db.Column(db.String)  # JSON
+    status = db.Column(db.String, default='pending')  # pending, sending, done, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.now)
+    locked_at = db.Column(db.DateTime, nullable=True)  # When a worker claimed it, if sending
+    last_error = db.Column(db.String, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+
+class Admin(Base):
+    __tablename__ = 'admins'
+
+    user_id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String, nullable=True)
+    added_by = db.Column(db.Integer, nullable=True)  # None for admins seeded from ADMIN_IDS
+    added_at = db.Column(db.DateTime, default=datetime.now)
+
+
+class PendingAdmin(Base):
+    __tablename__ = 'pending_admins'
+
+    username = db.Column(db.String, primary_key=True)  # Lowercase, without @
+    requester_id = db.Column(db.Integer)
+    user_id = db.Column(db.Integer, nullable=True)  # Set once the user sends /verifyadmin
+    status = db.Column(db.String, default='pending')  # pending, verifying
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
+
+
+class RegistryVersion(Base):
+    __tablename__ = 'registry_versions'
+
+    name = db.Column(db.String, primary_key=True)  # e.g. "admins"
+    version = db.Column(db.Integer, default=0)  # Bumped on every change so other processes reload
@@ -0,0 +1,231 @@
+import asyncio
+import json
+from collections import defaultdict
+from contextlib import contextmanager
+
+from sqlalchemy import select, update, delete, bindparam
+
+from config import BULK_MODERATION_LIMIT, BULK_PUBLISH_TIMEOUT
+from database import AsyncSession
+from models import Submission, OutboxMessage
+from outbox import outbox, enqueue_many, get_statuses
+
+# Moderation state machine: the status each action applies to, and the status it moves to
+TRANSITIONS = {
+    'approve': ('pending', 'approved'),
+    'reject': ('pending', 'rejected'),
+    'delete': ('approved', 'deleted'),
+    # Undoes a delete whose channel post couldn't be removed
+    'restore': ('deleted', 'approved'),
+}
+# Seconds between checks of the outbox while bulk approvals are published
+PUBLISH_POLL_INTERVAL = 1
+
+
+# Submissions with a moderation callback being handled in this process
+_claimed = set()
+
+
+@contextmanager
+def claim(key):
+    """
+    Claim a submission for the duration of a moderation callback
+
+    Lets concurrent clicks on the same submission be turned away before they
+    touch the database; transition() still decides between processes.
+
+    Yields:
+        bool: False if another callback in this process holds the claim
+    """
+    if key in _claimed:
+        yield False
+        return
+    _claimed.add(key)
+    try:
+        yield True
+    finally:
+        _claimed.discard(key)
+
+
+async def transition(session, condition, action, **values):
+    """
+    Move a submission along TRANSITIONS with a single conditional UPDATE
+
+    The UPDATE only matches while the submission is in the action's starting
+    status, so of several concurrent attempts exactly one succeeds.
+
+    Args:
+        session (AsyncSession): Session the caller commits
+        condition: Selects the submission, e.g. `Submission.id == 42`
+        action (str): Key of TRANSITIONS
+        **values: Other columns to set along with the status
+
+    Returns:
+        Submission | None: The updated submission, or None if it wasn't in the starting status
+    """
+    from_status, to_status = TRANSITIONS[action]
+    return await session.scalar(
+        update(Submission)
+        .where(condition, Submission.status == from_status)
+        .values(status=to_status, **values)
+        .returning(Submission)
+    )
+
+
+def _submitter_notifications(submissions, action):
+    """Build one outbox notification per submitter covering all of their submissions"""
+    by_user = defaultdict(list)
+    for submission in submissions:
+        by_user[submission.user_id].append(submission.submission_id)
+
+    messages = []
+    for user_id, submission_ids in by_user.items():
+        count = len(submission_ids)
+        if action == 'approve':
+            text = "Your food combo submission has been approved and published to the channel!"
+            if count > 1:
+                text = f"{count} of your food combo submissions have been approved and published to the channel!"
+        else:
+            text = "Your food combo submission was not approved."
+            if count > 1:
+                text = f"{count} of your food combo submissions were not approved."
+        # Keyed by the first submission so a retried bulk action doesn't notify twice
+        key = f"notify:{action}:{min(submission_ids)}"
+        messages.append(('notify', key, {'chat_id': user_id, 'text': text}))
+    return messages
+
+
+async def _wait_for_publishing(keys, progress, timeout):
+    """
+    Poll the outbox until every publish message is done or failed, or none finished for `timeout` seconds
+
+    Returns:
+        dict[str, str]: Outbox status of each key
+    """
+    loop = asyncio.get_running_loop()
+    total = len(keys)
+    finished, deadline = 0, loop.time() + timeout
+    while True:
+        statuses = await get_statuses(keys)
+        done = sum(status in ('done', 'failed') for status in statuses.values())
+        if progress:
+            await progress(done, total)
+        if done > finished:
+            finished, deadline = done, loop.time() + timeout
+        if done == total or loop.time() >= deadline:
+            return statuses
+        await asyncio.sleep(PUBLISH_POLL_INTERVAL)
+
+
+async def bulk_moderate(action, submission_ids=None, limit=BULK_MODERATION_LIMIT, progress=None,
+                        timeout=BULK_PUBLISH_TIMEOUT):
+    """
+    Approve or reject many pending submissions at once
+
+    Statuses are changed with one UPDATE, and the channel posts are queued in
+    the outbox in the same transaction; the outbox workers publish them under
+    the rate limiter. Once publishing finishes, submitters get one
+    notification each.
+
+    Submissions that failed to publish go back to pending, unless part of the
+    post already reached the channel. If the outbox publishes nothing for
+    `timeout` seconds, the rest are left to it and notified one by one.
+
+    Args:
+        action (str): "approve" or "reject"
+        submission_ids (list[str]): Only moderate these submissions; otherwise the oldest pending ones
+        limit (int): Maximum number of submissions to moderate
+        progress (callable): Awaited with (done, total) as submissions are published
+        timeout (float): Seconds to wait for the outbox to publish another submission
+
+    Returns:
+        dict: Counts of submissions `moderated`, `failed` and back to pending, `partial`ly
+            published and left approved, and still `queued` for publishing
+    """
+    from_status, new_status = TRANSITIONS[action]
+
+    async with AsyncSession() as session:
+        stmt = select(Submission).where(Submission.status == from_status)
+        if submission_ids:
+            stmt = stmt.where(Submission.submission_id.in_(submission_ids))
+        submissions = (await session.scalars(stmt.order_by(Submission.created_at).limit(limit))).all()
+
+        # Only rows that are still pending are claimed, in case another admin got to them first
+        claimed = set((await session.scalars(
+            update(Submission)
+            .where(Submission.id.in_([s.id for s in submissions]), Submission.status == from_status)
+            .values(status=new_status)
+            .returning(Submission.id)
+        )).all())
+        submissions = [s for s in submissions if s.id in claimed]
+
+        if action == 'approve':
+            await enqueue_many(session, [
+                ('publish', f"publish:{s.submission_id}", {'submission_id': s.submission_id})
+                for s in submissions
+            ])
+        else:
+            await enqueue_many(session, _submitter_notifications(submissions, action))
+        await session.commit()
+    outbox.wake()
+
+    result = {'moderated': len(submissions), 'failed': 0, 'partial': 0, 'queued': 0}
+    if action != 'approve' or not submissions:
+        if progress:
+            await progress(len(submissions), len(submissions))
+        return result
+
+    statuses = await _wait_for_publishing(
+        [f"publish:{s.submission_id}" for s in submissions], progress, timeout
+    )
+    by_status = defaultdict(list)
+    for s in submissions:
+        by_status[statuses.get(f"publish:{s.submission_id}")].append(s.submission_id)
+    failed, queued = by_status['failed'], by_status['pending'] + by_status['sending']
+
+    async with AsyncSession() as session:
+        await enqueue_many(session, _submitter_notifications(
+            [s for s in submissions if s.submission_id in set(by_status['done'])], action
+        ))
+
+        reverted = []
+        if failed:
+            # Back to pending to be approved again, unless part of the post is already in the channel
+            reverted = (await session.scalars(
+                update(Submission)
+                .where(
+                    Submission.submission_id.in_(failed),
+                    Submission.status == new_status,
+                    Submission.channel_post_id.is_(None)
+                )
+                .values(status=from_status)
+                .returning(Submission.submission_id)
+            )).all()
+            # Otherwise approving them again would queue a duplicate that's ignored
+            await session.execute(
+                delete(OutboxMessage)
+                .where(OutboxMessage.idempotency_key.in_([f"publish:{id}" for id in reverted]))
+            )
+
+        if queued:
+            # The outbox stalled; stop waiting and have each submitter notified once their post is out.
+            # A message a worker is sending right now keeps the payload it was claimed with
+            await session.execute(
+                update(OutboxMessage.__table__)
+                .where(OutboxMessage.idempotency_key == bindparam('message_key'), OutboxMessage.status != 'done')
+                .values(payload=bindparam('new_payload')),
+                [
+                    {'message_key': f"publish:{id}", 'new_payload': json.dumps({'submission_id': id, 'notify': True})}
+                    for id in queued
+                ]
+            )
+        await session.commit()
+    outbox.wake()
+
+    result.update(
+        moderated=len(submissions) - len(reverted),
+        failed=len(reverted),
+        partial=len(failed) - len(reverted),
+        queued=len(queued)
+    )
+    return result
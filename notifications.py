@@ -0,0 +1,123 @@
+import asyncio
+
+from telegram import InputMediaPhoto, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import RetryAfter
+
+from config import NOTIFY_CONCURRENCY, logger
+from ratelimit import bot_limiter
+from utils import send_album
+import callbacks
+
+# Attempts per Bot API call when Telegram answers with 429
+MAX_ATTEMPTS = 3
+
+_semaphore = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+
+
+async def with_retry(call):
+    """Run a Bot API call, sleeping through RetryAfter responses"""
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return await call()
+        except RetryAfter as e:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(e.retry_after)
+
+
+def build_admin_bundle(submission_id, row_id, nickname, people_count, delivery_source, images, check_image,
+                       duplicates=None, check_analysis=None):
+    """
+    Build the media group and approval keyboard sent to admins for a new submission
+
+    The public `submission_id` is shown to admins; the buttons carry the shorter `row_id`.
+
+    `duplicates` lists earlier submissions with the same or nearly the same
+    photos; `check_analysis` summarizes the automatic check of the check photo.
+
+    Returns:
+        tuple[list[InputMediaPhoto], str, InlineKeyboardMarkup]: Media, keyboard text and keyboard
+    """
+    details = (
+        f"New submission received (ID: {submission_id}):\n\n"
+        f"👤 Nickname: {nickname}\n"
+        f"👥 Number of People: {people_count}\n"
+        f"🚚 Delivery Source: {delivery_source}"
+    )
+    if check_analysis:
+        details += f"\n🧾 Check photo: {check_analysis}"
+    if duplicates:
+        details += f"\n\n⚠️ Possible duplicate of: {', '.join(duplicates)}"
+
+    media = [InputMediaPhoto(media=file_id) for file_id in images]
+    if check_image:
+        media.append(InputMediaPhoto(media=check_image, caption="🧾 Check image"))
+    if media:
+        media[0] = InputMediaPhoto(media=media[0].media, caption=details)
+
+    text = f"Do you approve this submission (ID: {submission_id})?"
+    if not media:
+        text = f"{details}\n\n{text}"
+
+    keyboard = InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("✅ Approve", callback_data=callbacks.encode('approve', row_id)),
+            InlineKeyboardButton("❌ Reject", callback_data=callbacks.encode('reject', row_id))
+        ]
+    ])
+    return media, text, keyboard
+
+
+def build_channel_media(submission):
+    """
+    Build the media group published to the channel for an approved submission
+
+    Args:
+        submission (Submission): Submission with its images loaded
+
+    Returns:
+        list[InputMediaPhoto]: Food images in order, then the check image; the first item carries the caption
+    """
+    # Create caption for the post
+    caption = (
+        "🍽️ <b>Food Combo Submission</b> 🚀\n\n"
+        f"👤 <b>Nickname:</b> {submission.nickname}\n"
+        f"📍 <b>Delivery From:</b> {submission.delivery_source}\n"
+        f"👥 <b>Serves:</b> {submission.people_count}\n"
+        f"🔥 <b>Why It’s a Great Deal:</b> { 'No description provided'}\n\n"
+        "📸 <b>Check out my food combo!</b> 😍\n\n"
+        "<b>Send your combo from @wwoffers_bot</b>"
+    )
+
+    media_group = [InputMediaPhoto(media=image.file_id) for image in submission.food_images]
+    if submission.check_image:
+        media_group.append(InputMediaPhoto(media=submission.check_image.file_id))
+    if media_group:
+        media_group[0] = InputMediaPhoto(media=media_group[0].media, caption=caption, parse_mode="HTML")
+    return media_group
+
+
+async def send_bundle(bot, chat_id, media, text, reply_markup, limiter=bot_limiter):
+    """Send one media group followed by one keyboard message to a chat"""
+    async with _semaphore:
+        if media:
+            await send_album(bot, chat_id, media, limiter=limiter, retry=with_retry)
+        await limiter.acquire(chat_id)
+        await with_retry(lambda: bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup))
+
+
+async def notify_admins(bot, admin_ids, media, text, reply_markup, limiter=bot_limiter):
+    """
+    Send the same bundle to every admin concurrently
+
+    Returns:
+        int: Number of admins that were notified successfully
+    """
+    results = await asyncio.gather(
+        *(send_bundle(bot, admin_id, media, text, reply_markup, limiter) for admin_id in admin_ids),
+        return_exceptions=True
+    )
+    for admin_id, result in zip(admin_ids, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error notifying admin {admin_id}: {result}")
+    return sum(not isinstance(result, Exception) for result in results)
@@ -0,0 +1,253 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, func, or_, and_
+from telegram.error import RetryAfter
+
+from config import (
+    CHANNEL_ID, OUTBOX_CONCURRENCY, OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL, OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_BASE_BACKOFF, OUTBOX_MAX_BACKOFF, OUTBOX_LEASE, TELEGRAM_GROUP_RATE, logger
+)
+from database import AsyncSession, insert_for
+from models import OutboxMessage
+import metrics
+from notifications import build_channel_media
+from ratelimit import bot_limiter
+from repository import get_submission
+from utils import send_album, MEDIA_GROUP_LIMIT
+
+# Most media groups one channel post takes: up to 10 food photos plus the check photo
+POST_PARTS = 2
+
+
+async def enqueue(session, kind, key, payload):
+    """
+    Add a message to the outbox as part of the caller's transaction
+
+    A message whose idempotency key is already in the outbox is ignored, so
+    retried callbacks can't queue the same post twice.
+
+    Args:
+        session (AsyncSession): Session the caller commits
+        kind (str): "publish" or "notify"
+        key (str): Idempotency key
+        payload (dict): JSON-serializable arguments for the handler
+    """
+    await enqueue_many(session, [(kind, key, payload)])
+
+
+async def enqueue_many(session, messages):
+    """Like enqueue(), for a list of (kind, key, payload) tuples in one statement"""
+    if not messages:
+        return
+    insert = insert_for(session.bind)
+    await session.execute(
+        insert(OutboxMessage).on_conflict_do_nothing(index_elements=['idempotency_key']),
+        [
+            {'idempotency_key': key, 'kind': kind, 'payload': json.dumps(payload)}
+            for kind, key, payload in messages
+        ]
+    )
+
+
+async def get_statuses(keys):
+    """
+    Returns:
+        dict[str, str]: Outbox status for each of the given idempotency keys that exists
+    """
+    async with AsyncSession() as session:
+        rows = await session.execute(
+            select(OutboxMessage.idempotency_key, OutboxMessage.status)
+            .where(OutboxMessage.idempotency_key.in_(keys))
+        )
+    return dict(rows.all())
+
+
+@metrics.collector
+async def count_outbox():
+    """Export the number of outbox messages waiting, being sent and given up on"""
+    async with AsyncSession() as session:
+        rows = await session.execute(
+            select(OutboxMessage.status, func.count())
+            .where(OutboxMessage.status != 'done')
+            .group_by(OutboxMessage.status)
+        )
+    counts = dict(rows.all())
+    for status in ('pending', 'sending', 'failed'):
+        metrics.set_gauge('outbox_messages', counts.get(status, 0), status=status)
+
+
+async def _queue_approval_notice(session, submission):
+    await enqueue(session, 'notify', f"notify:approve:{submission.submission_id}", {
+        'chat_id': submission.user_id,
+        'text': "Your food combo submission has been approved and published to the channel!"
+    })
+
+
+async def _publish(bot, payload):
+    """Publish an approved submission to the channel, at most once per submission"""
+    notify = payload.get('notify')
+    async with AsyncSession() as session:
+        submission = await get_submission(session, payload['submission_id'])
+        if not submission or submission.status != 'approved':
+            return
+
+        media_group = build_channel_media(submission)
+        parts = -(-len(media_group) // MEDIA_GROUP_LIMIT)
+        # Posts published before progress was recorded have an ID but no part count
+        sent = submission.channel_parts_sent
+        if submission.channel_post_id and (sent is None or sent >= parts):
+            # Already published. Older versions queued the notice in a later transaction,
+            # which a crash could skip; an already queued notice is left as it is
+            if notify:
+                await _queue_approval_notice(session, submission)
+                await session.commit()
+            return
+
+        async def record(sent, messages):
+            # Commit after every media group, so a retry after a failure or a
+            # crash carries on with the next one instead of posting them again
+            if not submission.channel_post_id:
+                submission.channel_post_id = messages[0].message_id
+            submission.channel_parts_sent = sent
+            # Queued in the same transaction as the last media group, so it can't be lost in between
+            if sent == parts and notify:
+                await _queue_approval_notice(session, submission)
+            await session.commit()
+
+        await send_album(bot, CHANNEL_ID, media_group, limiter=bot_limiter, skip=sent or 0, on_part=record)
+
+
+async def _notify(bot, payload):
+    """Send a text message to a user"""
+    await bot_limiter.acquire(payload['chat_id'])
+    await bot.send_message(chat_id=payload['chat_id'], text=payload['text'])
+
+
+HANDLERS = {
+    'publish': _publish,
+    'notify': _notify,
+}
+
+
+class Outbox:
+    """
+    Worker pool draining the outbox table
+
+    Messages are claimed with a conditional UPDATE, so several processes can
+    drain the same table. A message claimed by a worker that crashed is picked
+    up again once its lease expires.
+    """
+
+    def __init__(self, concurrency=OUTBOX_CONCURRENCY, batch_size=OUTBOX_BATCH_SIZE,
+                 poll_interval=OUTBOX_POLL_INTERVAL):
+        self.concurrency = concurrency
+        # Channel posts are paced at TELEGRAM_GROUP_RATE media groups per second. Claim no
+        # more than can be sent in half the lease, or another worker re-claims the ones
+        # still waiting for their turn
+        paced = int(OUTBOX_LEASE / 2 * TELEGRAM_GROUP_RATE / POST_PARTS)
+        self.batch_size = max(1, min(batch_size, paced))
+        self.poll_interval = poll_interval
+        self.bot = None
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._in_flight = None
+
+    def start(self, bot):
+        self.bot = bot
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop claiming messages and wait for the ones being sent"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._in_flight:
+            await asyncio.gather(self._in_flight, return_exceptions=True)
+
+    def wake(self):
+        """Tell the workers new messages were committed"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                messages = await self._claim()
+            except Exception:
+                logger.exception("Error claiming outbox messages")
+                messages = []
+
+            if messages:
+                semaphore = asyncio.Semaphore(self.concurrency)
+
+                async def run(message):
+                    async with semaphore:
+                        await self._deliver(message)
+
+                # Finish the batch even if the worker is cancelled, so nothing is left half-sent
+                self._in_flight = asyncio.gather(*(run(message) for message in messages))
+                await asyncio.shield(self._in_flight)
+                # Delivering may have queued follow-up messages, so look again right away
+                continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self):
+        now = datetime.now()
+        due = or_(
+            and_(OutboxMessage.status == 'pending', OutboxMessage.next_attempt_at <= now),
+            and_(OutboxMessage.status == 'sending', OutboxMessage.locked_at < now - timedelta(seconds=OUTBOX_LEASE))
+        )
+        async with AsyncSession() as session:
+            ids = (
+                select(OutboxMessage.id).where(due)
+                .order_by(OutboxMessage.next_attempt_at).limit(self.batch_size)
+                .scalar_subquery()
+            )
+            # Re-checking `due` in the UPDATE makes the claim safe against other workers
+            messages = (await session.scalars(
+                update(OutboxMessage)
+                .where(OutboxMessage.id.in_(ids), due)
+                .values(status='sending', locked_at=now)
+                .returning(OutboxMessage)
+            )).all()
+            await session.commit()
+        return messages
+
+    async def _deliver(self, message):
+        values = {'status': 'done', 'locked_at': None, 'last_error': None}
+        try:
+            await HANDLERS[message.kind](self.bot, json.loads(message.payload))
+        except RetryAfter as e:
+            # Being throttled isn't the message's fault, so it doesn't use up an attempt
+            values = {
+                'status': 'pending',
+                'next_attempt_at': datetime.now() + timedelta(seconds=e.retry_after),
+                'last_error': str(e)
+            }
+        except Exception as e:
+            attempts = message.attempts + 1
+            delay = min(OUTBOX_MAX_BACKOFF, OUTBOX_BASE_BACKOFF * 2 ** message.attempts)
+            failed = attempts >= OUTBOX_MAX_ATTEMPTS
+            values = {
+                'status': 'failed' if failed else 'pending',
+                'attempts': attempts,
+                'next_attempt_at': datetime.now() + timedelta(seconds=delay),
+                'last_error': str(e)
+            }
+            logger.error(f"Error delivering outbox message {message.idempotency_key} (attempt {attempts}): {e}")
+
+        async with AsyncSession() as session:
+            await session.execute(
+                update(OutboxMessage).where(OutboxMessage.id == message.id).values(**values)
+            )
+            await session.commit()
+
+
+outbox = Outbox()
@@ -0,0 +1,212 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, insert
+from telegram.ext import BasePersistence, PersistenceInput
+
+from config import PERSISTENCE_INTERVAL, DRAFT_TTL, EVICTION_INTERVAL, logger
+from database import AsyncSession
+from drafts import Draft
+from models import SavedDraft, SavedConversation
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+class DatabasePersistence(BasePersistence):
+    """
+    Stores user drafts and conversation states in the database
+
+    Only user_data and conversations are persisted. Updates handed over by the
+    application are compared with what was last written, so unchanged drafts are
+    skipped, and everything changed in one persistence run is written in a
+    single transaction.
+    """
+
+    def __init__(self, update_interval=PERSISTENCE_INTERVAL, ttl=DRAFT_TTL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self.ttl = ttl
+        # Last value written per row, used to skip unchanged updates
+        self._written_drafts = {}
+        self._written_conversations = {}
+        # Rows waiting to be written; None means the row is deleted
+        self._dirty_drafts = {}
+        self._dirty_conversations = {}
+        self._flush_task = None
+        self._lock = asyncio.Lock()
+
+    def _cutoff(self):
+        return datetime.now() - timedelta(seconds=self.ttl)
+
+    def _mark(self, dirty, written, key, value):
+        if key not in dirty and written.get(key) == value:
+            return
+        dirty[key] = value
+        # Coalesce everything the application hands over in this run into one write
+        self._schedule()
+
+    def _schedule(self):
+        """Start a write unless one is running; a running write picks up new rows itself"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._write())
+
+    async def _write(self):
+        async with self._lock:
+            # Rows marked while a transaction is in flight go out in the next one
+            while self._dirty_drafts or self._dirty_conversations:
+                drafts, self._dirty_drafts = self._dirty_drafts, {}
+                conversations, self._dirty_conversations = self._dirty_conversations, {}
+
+                try:
+                    await self._save(drafts, conversations)
+                except Exception:
+                    logger.exception(f"Error saving conversation state, retrying in {self.update_interval}s")
+                    # Keep anything that changed again in the meantime
+                    self._dirty_drafts = {**drafts, **self._dirty_drafts}
+                    self._dirty_conversations = {**conversations, **self._dirty_conversations}
+                    asyncio.get_running_loop().call_later(self.update_interval, self._schedule)
+                    return
+
+                self._written_drafts.update(drafts)
+                self._written_conversations.update(conversations)
+
+    async def _save(self, drafts, conversations):
+        now = datetime.now()
+        async with AsyncSession() as session:
+            if drafts:
+                await session.execute(delete(SavedDraft).where(SavedDraft.user_id.in_(drafts)))
+                rows = [
+                    {'user_id': user_id, 'data': data, 'updated_at': now}
+                    for user_id, data in drafts.items() if data is not None
+                ]
+                if rows:
+                    await session.execute(insert(SavedDraft), rows)
+            if conversations:
+                await session.execute(
+                    delete(SavedConversation).where(SavedConversation.key.in_(conversations))
+                )
+                rows = [
+                    {'key': key, 'state': state, 'updated_at': now}
+                    for key, state in conversations.items() if state is not None
+                ]
+                if rows:
+                    await session.execute(insert(SavedConversation), rows)
+            await session.commit()
+
+    async def get_user_data(self):
+        async with AsyncSession() as session:
+            # Drafts abandoned longer than the TTL are dropped instead of loaded
+            await session.execute(delete(SavedDraft).where(SavedDraft.updated_at < self._cutoff()))
+            await session.commit()
+            rows = (await session.execute(select(SavedDraft.user_id, SavedDraft.data))).all()
+
+        self._written_drafts.update(rows)
+        return {user_id: Draft.from_row(json.loads(data)) for user_id, data in rows}
+
+    async def update_user_data(self, user_id, data):
+        # Users who only touched the bot without starting a draft don't need a row
+        row = _dumps(data.to_row()) if any(True for _ in data) else None
+        self._mark(self._dirty_drafts, self._written_drafts, user_id, row)
+
+    async def drop_user_data(self, user_id):
+        self._mark(self._dirty_drafts, self._written_drafts, user_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def get_conversations(self, name):
+        prefix = f"{name}:"
+        async with AsyncSession() as session:
+            await session.execute(
+                delete(SavedConversation).where(SavedConversation.updated_at < self._cutoff())
+            )
+            await session.commit()
+            rows = (await session.execute(
+                select(SavedConversation.key, SavedConversation.state)
+                .where(SavedConversation.key.startswith(prefix))
+            )).all()
+
+        self._written_conversations.update(rows)
+        return {tuple(json.loads(key[len(prefix):])): state for key, state in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        self._mark(
+            self._dirty_conversations, self._written_conversations,
+            f"{name}:{_dumps(list(key))}", new_state
+        )
+
+    async def flush(self):
+        if self._flush_task:
+            await self._flush_task
+        await self._write()
+
+    # chat_data, bot_data and callback_data are not stored
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+
+def evict_expired(application, ttl=DRAFT_TTL):
+    """
+    Drop drafts and conversations of users who have been idle longer than the TTL
+
+    Nicknames live in the users table, so an evicted user only loses an
+    unfinished submission.
+
+    Returns:
+        int: Number of users evicted
+    """
+    cutoff = time.time() - ttl
+    expired = {
+        user_id for user_id, draft in application.user_data.items()
+        if draft.touched_at < cutoff
+    }
+    for user_id in expired:
+        application.drop_user_data(user_id)
+
+    # PTB has no public API to end a conversation from outside a handler; deleting
+    # the key is what ConversationHandler itself does and is picked up by persistence
+    for conversations in application._conversation_handler_conversations.values():
+        for key in [key for key in conversations if key[-1] in expired]:
+            del conversations[key]
+
+    return len(expired)
+
+
+async def run_eviction(application, interval=EVICTION_INTERVAL):
+    """Periodically evict abandoned drafts until cancelled"""
+    while True:
+        await asyncio.sleep(interval)
+        evicted = evict_expired(application)
+        if evicted:
+            logger.info(f"Evicted {evicted} idle drafts")
@@ -0,0 +1,143 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import UPDATE_CONCURRENCY, UPDATE_QUEUE_LIMIT
+import metrics
+
+
+def ordering_key(update):
+    """
+    Returns:
+        int: ID whose updates must be handled in order: the user's, or the chat's for
+            updates without a user; None for updates that can run in any order
+    """
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
+class UpdateQueue(asyncio.Queue):
+    """
+    Update queue that hands out at most `limit` updates not yet processed
+
+    The application takes updates off its queue and starts a task for each
+    right away, however many are already running, and marks each one done
+    when it has been processed. Past the limit, updates stay in this queue
+    until earlier ones are done; once it holds `maxsize` too, polling pauses
+    and Telegram keeps the rest, and webhook requests wait.
+
+    Args:
+        limit (int): Updates taken off the queue and not yet processed
+        maxsize (int): Updates waiting in the queue; 0 means unbounded
+    """
+
+    def __init__(self, limit, maxsize=0):
+        super().__init__(maxsize)
+        self.limit = limit
+        self.taken = 0
+        self._room = asyncio.Event()
+
+    async def get(self):
+        update = await super().get()
+        while self.taken >= self.limit:
+            self._room.clear()
+            await self._room.wait()
+        self.taken += 1
+        return update
+
+    def task_done(self):
+        super().task_done()
+        # Updates dropped on shutdown are marked done without being taken
+        if self.taken:
+            self.taken -= 1
+            self._room.set()
+
+    def collect(self):
+        """Export how many updates wait in the queue"""
+        metrics.set_gauge('updates_queued', self.qsize())
+
+
+class _Lane:
+    """Lock serializing one user's updates, and how many updates hold or wait for it"""
+
+    __slots__ = ('lock', 'users')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Handles updates from different users concurrently, and each user's in order
+
+    ConversationHandler and context.user_data assume a user's updates are
+    handled one at a time, so an update waits until the previous one from the
+    same user has finished. asyncio locks are first come, first served, and the
+    application hands updates over in the order it received them.
+
+    An update only takes one of the `max_concurrent_updates` slots once it is
+    its user's turn, so a user with a backlog never holds slots other users
+    could run in. The application hands over every update it takes off its
+    queue, so pair this with an UpdateQueue of the same `max_queued_updates`
+    to bound the updates running plus waiting for their turn.
+
+    Args:
+        max_concurrent_updates (int): Updates whose handlers run at once
+        max_queued_updates (int): Updates running or waiting for their user's turn
+    """
+
+    def __init__(self, max_concurrent_updates=UPDATE_CONCURRENCY, max_queued_updates=UPDATE_QUEUE_LIMIT):
+        super().__init__(max(max_concurrent_updates, max_queued_updates))
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._lanes = {}
+        # Updates running or waiting, and updates whose handlers are running
+        self.queued = 0
+        self.running = 0
+
+    async def do_process_update(self, update, coroutine):
+        self.queued += 1
+        try:
+            key = ordering_key(update)
+            if key is None:
+                await self._run(coroutine)
+                return
+
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = self._lanes[key] = _Lane()
+            lane.users += 1
+            try:
+                async with lane.lock:
+                    await self._run(coroutine)
+            finally:
+                lane.users -= 1
+                if not lane.users:
+                    del self._lanes[key]
+        finally:
+            self.queued -= 1
+
+    async def _run(self, coroutine):
+        async with self._running:
+            self.running += 1
+            try:
+                await coroutine
+            finally:
+                self.running -= 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def collect(self):
+        """Export how many updates are running and how many wait for their user's turn"""
+        metrics.set_gauge('updates_running', self.running)
+        metrics.set_gauge('updates_waiting', self.queued - self.running)
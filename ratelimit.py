@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+from config import TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST, TELEGRAM_GROUP_RATE
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        """
+        Take tokens only if they are available right now
+
+        Returns:
+            bool: True if the tokens were taken, False otherwise
+        """
+        self._refill(time.monotonic())
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def reserve(self, tokens=1):
+        """
+        Take tokens, going into debt if needed
+
+        Returns:
+            float: Seconds the caller has to wait before its tokens are actually available
+        """
+        self._refill(time.monotonic())
+        self.tokens -= tokens
+        return max(0.0, -self.tokens / self.rate)
+
+    async def acquire(self, tokens=1):
+        """Wait until tokens are available; callers are served in FIFO order"""
+        delay = self.reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+
+    @property
+    def idle(self):
+        """True if the bucket has refilled completely and can be dropped"""
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class BotRateLimiter:
+    """Limits outgoing Bot API calls globally and per destination chat"""
+
+    # Drop idle per-chat buckets once this many are tracked
+    MAX_IDLE_CHATS = 1024
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE,
+                 chat_burst=TELEGRAM_CHAT_BURST, group_rate=TELEGRAM_GROUP_RATE):
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.chats = {}
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if len(self.chats) >= self.MAX_IDLE_CHATS:
+                self.chats = {key: b for key, b in self.chats.items() if not b.idle}
+            # Negative IDs are groups and channels, which have a stricter per-minute limit
+            if str(chat_id).startswith('-'):
+                bucket = TokenBucket(self.group_rate, capacity=1)
+            else:
+                bucket = TokenBucket(self.chat_rate, capacity=self.chat_burst)
+            self.chats[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id):
+        """Wait until one API call to `chat_id` is allowed"""
+        await self._chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+
+
+# Shared limiter for every outgoing send made by the bot
+bot_limiter = BotRateLimiter()
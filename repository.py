@@ -0,0 +1,183 @@
+from collections import namedtuple
+
+from sqlalchemy import select, update, insert, tuple_
+from sqlalchemy.orm import joinedload
+
+from cache import LRUCache
+from config import USER_CACHE_SIZE, USER_CACHE_TTL, PENDING_PAGE_SIZE
+from database import AsyncSession, ReadSession
+from dedup import hash_columns
+from models import User, Submission, Image
+import metrics
+
+# Read-only snapshot of a users row, safe to share between handlers
+CachedUser = namedtuple('CachedUser', ['user_id', 'nickname'])
+
+user_cache = LRUCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+@metrics.collector
+def report_user_cache():
+    stats = user_cache.stats
+    metrics.set_gauge('user_cache_hits', stats['hits'])
+    metrics.set_gauge('user_cache_misses', stats['misses'])
+    metrics.set_gauge('user_cache_hit_ratio', stats['hit_ratio'])
+    metrics.set_gauge('user_cache_size', stats['size'])
+
+
+async def get_user(user_id, create=False):
+    """
+    Read-through lookup of a user by Telegram ID
+
+    Args:
+        user_id (int): Telegram user ID
+        create (bool): Insert the user if it doesn't exist yet
+
+    Returns:
+        tuple[CachedUser | None, bool]: The user (None if missing and not created) and
+            whether it was created by this call
+    """
+    cached = user_cache.get(user_id)
+    if cached:
+        return cached, False
+
+    created = False
+    async with AsyncSession() as session:
+        user = await session.scalar(select(User).filter_by(user_id=user_id))
+        if not user and create:
+            user = User(user_id=user_id)
+            session.add(user)
+            await session.commit()
+            created = True
+
+    if not user:
+        return None, False
+
+    cached = CachedUser(user.user_id, user.nickname)
+    user_cache.set(user_id, cached)
+    return cached, created
+
+
+async def set_nickname(user_id, nickname):
+    """
+    Write-through update of a user's nickname
+
+    Returns:
+        bool: True if the user exists and was updated
+    """
+    async with AsyncSession() as session:
+        result = await session.execute(
+            update(User).where(User.user_id == user_id).values(nickname=nickname)
+        )
+        await session.commit()
+
+    if result.rowcount:
+        user_cache.set(user_id, CachedUser(user_id, nickname))
+        return True
+    user_cache.invalidate(user_id)
+    return False
+
+
+async def get_submission(session, submission_id):
+    """
+    Load a submission together with all of its images in one query
+
+    Args:
+        session (AsyncSession): Open database session
+        submission_id (str): Public submission ID
+
+    Returns:
+        Submission | None: The submission with `images` populated, or None if not found
+    """
+    result = await session.scalars(
+        select(Submission)
+        .options(joinedload(Submission.images))
+        .filter_by(submission_id=submission_id)
+    )
+    return result.unique().first()
+
+
+async def save_submissions(session, submissions):
+    """
+    Insert submissions and all of their images with one multi-row INSERT per table
+
+    Args:
+        session (AsyncSession): Open database session; the caller commits
+        submissions (list[dict]): Submission column values plus `images`
+            (food image file_ids in order) and `check_image` (file_id or None),
+            and optionally `image_keys` and `check_key`, the [file_unique_id, phash]
+            pairs of the same photos
+
+    Returns:
+        dict[str, int]: Row ID of each submission by its public submission_id
+    """
+    submission_rows = []
+    photos = []
+    for submission in submissions:
+        submission = dict(submission)
+        images = submission.pop('images')
+        check_image = submission.pop('check_image')
+        image_keys = submission.pop('image_keys', None) or [[None, None]] * len(images)
+        check_key = submission.pop('check_key', None) or [None, None]
+        submission_rows.append(submission)
+        photos.append((submission['submission_id'], images, image_keys, check_image, check_key))
+
+    # Images reference the integer row IDs, which only exist once the submissions are inserted
+    row_ids = dict((await session.execute(
+        insert(Submission).returning(Submission.submission_id, Submission.id), submission_rows
+    )).all())
+
+    image_rows = []
+    for submission_id, images, image_keys, check_image, check_key in photos:
+        row_id = row_ids[submission_id]
+        image_rows.extend(
+            {'submission_id': row_id, 'file_id': file_id, 'is_check_image': False, 'sequence': i + 1,
+             **hash_columns(*key)}
+            for i, (file_id, key) in enumerate(zip(images, image_keys))
+        )
+        if check_image:
+            image_rows.append(
+                {'submission_id': row_id, 'file_id': check_image, 'is_check_image': True, 'sequence': None,
+                 **hash_columns(*check_key)}
+            )
+
+    if image_rows:
+        await session.execute(insert(Image), image_rows)
+    return row_ids
+
+
+async def get_pending_page(after=None, before=None, limit=PENDING_PAGE_SIZE):
+    """
+    Keyset-paginated page of pending submissions, oldest first
+
+    Args:
+        after (tuple[datetime, int]): Return rows after this (created_at, id) key
+        before (tuple[datetime, int]): Return rows before this (created_at, id) key
+        limit (int): Page size
+
+    Returns:
+        tuple[list[Row], bool, bool]: Rows with id, submission_id, nickname, image_count
+            and created_at, and whether there are more rows before and after the page
+    """
+    key = tuple_(Submission.created_at, Submission.id)
+    stmt = select(
+        Submission.id, Submission.submission_id, Submission.nickname,
+        Submission.image_count, Submission.created_at
+    ).where(Submission.status == 'pending')
+
+    if before:
+        stmt = stmt.where(key < tuple_(*before)).order_by(Submission.created_at.desc(), Submission.id.desc())
+    else:
+        if after:
+            stmt = stmt.where(key > tuple_(*after))
+        stmt = stmt.order_by(Submission.created_at, Submission.id)
+
+    # One extra row tells whether another page follows in the direction we're reading
+    async with ReadSession() as session:
+        rows = (await session.execute(stmt.limit(limit + 1))).all()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if before:
+        return rows[::-1], more, True
+    return rows, after is not None, more
@@ -0,0 +1,60 @@
+import asyncio
+
+from telegram.ext import ApplicationHandlerStop
+
+from cache import LRUCache
+from config import (
+    THROTTLE_USER_RATE, THROTTLE_USER_BURST, THROTTLE_GLOBAL_RATE, THROTTLE_GLOBAL_BURST,
+    THROTTLE_MAX_DELAY, THROTTLE_MAX_USERS, THROTTLE_USER_TTL
+)
+from ratelimit import TokenBucket
+from utils import is_admin
+import metrics
+
+
+class UpdateThrottle:
+    """
+    Drops or defers incoming updates before they reach the handlers
+
+    Registered as a TypeHandler in a group that runs before all others. Each
+    user has a token bucket; updates over a user's limit are dropped, so a
+    flooding client never delays anyone else. Updates over the global limit
+    are deferred until a token is free, or dropped if that would take longer
+    than `max_delay`. Per-user buckets live in a bounded LRU cache that forgets
+    users idle for `user_ttl` seconds, by which time their bucket would have
+    refilled anyway.
+    """
+
+    def __init__(self, user_rate=THROTTLE_USER_RATE, user_burst=THROTTLE_USER_BURST,
+                 global_rate=THROTTLE_GLOBAL_RATE, global_burst=THROTTLE_GLOBAL_BURST,
+                 max_delay=THROTTLE_MAX_DELAY, max_users=THROTTLE_MAX_USERS, user_ttl=THROTTLE_USER_TTL):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_delay = max_delay
+        self.global_bucket = TokenBucket(global_rate, capacity=global_burst)
+        self.users = LRUCache(max_users, max(user_ttl, user_burst / user_rate))
+
+    def _user_bucket(self, user_id):
+        bucket = self.users.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, capacity=self.user_burst)
+        # Re-setting refreshes the expiry, so only idle users are forgotten
+        self.users.set(user_id, bucket)
+        return bucket
+
+    async def __call__(self, update, context):
+        user = update.effective_user
+        # Admins run bulk commands and page through submissions quickly
+        if user and not await is_admin(user.id) and not self._user_bucket(user.id).try_acquire():
+            metrics.inc('updates_throttled_total', scope='user', action='dropped')
+            raise ApplicationHandlerStop
+
+        delay = self.global_bucket.reserve()
+        if delay > self.max_delay:
+            # Give the token back; this update won't be handled
+            self.global_bucket.tokens += 1
+            metrics.inc('updates_throttled_total', scope='global', action='dropped')
+            raise ApplicationHandlerStop
+        if delay:
+            metrics.inc('updates_throttled_total', scope='global', action='deferred')
+            await asyncio.sleep(delay)
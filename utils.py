@@ -1,4 +1,13 @@
-from config import ADMIN_IDS
+import asyncio
+
+from admins import admin_registry
+from config import CLEANUP_CONCURRENCY
+import metrics
+
+# Telegram accepts at most this many items in one media group
+MEDIA_GROUP_LIMIT = 10
+# ...and at most this many message IDs in one deleteMessages call
+DELETE_MESSAGES_LIMIT = 100
 
 
 async def is_admin(user_id):
@@ -11,4 +20,81 @@ async def is_admin(user_id):
     Returns:
         bool: True if user is admin, False otherwise
     """
-    return user_id in ADMIN_IDS
\ No newline at end of file
+    return user_id in admin_registry
+
+
+async def send_album(bot, chat_id, media, limiter=None, skip=0, on_part=None, retry=None):
+    """
+    Send photos as few media groups as possible
+
+    Args:
+        bot (Bot): Bot used to send the photos
+        chat_id (int | str): Destination chat
+        media (list[InputMediaPhoto]): Photos to send, captions included
+        limiter (BotRateLimiter): Optional rate limiter awaited before each call
+        skip (int): Media groups already sent by an earlier attempt; they aren't sent again
+        on_part (callable): Optional coroutine function awaited with the number of media
+            groups sent so far and the messages of the last one, e.g. to record progress
+        retry (callable): Optional coroutine function each media group is sent through,
+            given a function sending it, e.g. to retry only the group that failed
+
+    Returns:
+        list[Message]: Sent messages, in the same order as `media`
+    """
+    messages = []
+    for part, i in enumerate(range(0, len(media), MEDIA_GROUP_LIMIT)):
+        if part < skip:
+            continue
+        chunk = media[i:i + MEDIA_GROUP_LIMIT]
+
+        async def send(chunk=chunk):
+            if limiter:
+                await limiter.acquire(chat_id)
+            # Media groups need at least two items
+            if len(chunk) == 1:
+                return [await bot.send_photo(
+                    chat_id=chat_id,
+                    photo=chunk[0].media,
+                    caption=chunk[0].caption,
+                    parse_mode=chunk[0].parse_mode
+                )]
+            return list(await bot.send_media_group(chat_id=chat_id, media=chunk))
+
+        sent = await retry(send) if retry else await send()
+        messages.extend(sent)
+        if on_part:
+            await on_part(part + 1, sent)
+    return messages
+
+
+async def delete_messages(bot, chat_id, message_ids, concurrency=CLEANUP_CONCURRENCY):
+    """
+    Delete messages from a chat using as few API calls as possible
+
+    Uses deleteMessages in batches of up to 100 IDs; if a batch fails it falls
+    back to deleting its messages one by one with bounded concurrency. Failures
+    are counted in the chat_cleanup_failures_total metric.
+
+    Args:
+        bot (Bot): Bot used to delete the messages
+        chat_id (int): Chat the messages belong to
+        message_ids (list[int]): Messages to delete
+        concurrency (int): Maximum concurrent single deletes
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def delete_one(message_id):
+        async with semaphore:
+            try:
+                await bot.delete_message(chat_id=chat_id, message_id=message_id)
+            except Exception:
+                # Usually the message was already deleted or is too old
+                metrics.inc('chat_cleanup_failures_total', method='deleteMessage')
+
+    for i in range(0, len(message_ids), DELETE_MESSAGES_LIMIT):
+        batch = message_ids[i:i + DELETE_MESSAGES_LIMIT]
+        try:
+            await bot.delete_messages(chat_id=chat_id, message_ids=batch)
+        except Exception:
+            metrics.inc('chat_cleanup_failures_total', method='deleteMessages')
+            await asyncio.gather(*(delete_one(message_id) for message_id in batch))
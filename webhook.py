@@ -0,0 +1,129 @@
+import hmac
+import json
+
+from telegram import Update
+
+from config import WEBHOOK_PATH, WEBHOOK_SECRET, logger
+
+SECRET_HEADER = b'x-telegram-bot-api-secret-token'
+
+
+class WebhookApp:
+    """
+    ASGI app that feeds Telegram webhook updates into an Application
+
+    Only requests carrying the secret token registered with Telegram are accepted,
+    so a secret is required.
+    """
+
+    def __init__(self, application, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET):
+        if not secret_token:
+            raise ValueError("WEBHOOK_SECRET must be set in webhook mode")
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logger.exception("Webhook worker failed to start")
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        """Start the application the same way run_polling() would"""
+        application = self.application
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+
+    async def shutdown(self):
+        """Finish queued updates, then stop the application"""
+        application = self.application
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+    async def _http(self, scope, receive, send):
+        method, path = scope['method'], scope['path']
+
+        if path == '/healthz' and method == 'GET':
+            if self.application.running:
+                await _respond(send, 200, {'status': 'ok'})
+            else:
+                await _respond(send, 503, {'status': 'starting'})
+            return
+
+        if path != self.path:
+            await _respond(send, 404, {'error': 'not found'})
+            return
+        if method != 'POST':
+            await _respond(send, 405, {'error': 'method not allowed'})
+            return
+
+        token = dict(scope['headers']).get(SECRET_HEADER, b'')
+        if not hmac.compare_digest(token, self.secret_token.encode()):
+            await _respond(send, 403, {'error': 'invalid secret token'})
+            return
+
+        body = await _read_body(receive)
+        try:
+            data = json.loads(body)
+            # Update.de_json() returns None for null instead of failing
+            if not isinstance(data, dict):
+                raise TypeError("Update is not a JSON object")
+            update = Update.de_json(data, self.application.bot)
+        except Exception:
+            # de_json() fails with whatever error a malformed field happens to cause,
+            # e.g. AttributeError for a string where an object belongs
+            await _respond(send, 400, {'error': 'invalid update'})
+            return
+
+        await self.application.update_queue.put(update)
+        await _respond(send, 200, {'ok': True})
+
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def _respond(send, status, payload):
+    body = json.dumps(payload).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def create_app():
+    """App factory used by each uvicorn worker process"""
+    from main import build_application
+
+    return WebhookApp(build_application())
@@ -0,0 +1,53 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from config import WORKER_PROCESSES
+import metrics
+
+# Forking a process that runs an event loop and open database connections copies
+# them into the workers; forkserver starts them clean, and spawn is the fallback where
+# it's not available
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+_pool = None
+# Jobs submitted and not finished yet, including those waiting for a free process
+_pending = 0
+
+
+async def run_in_process(func, *args):
+    """
+    Run a CPU-bound function in the shared worker process pool
+
+    Args:
+        func (callable): Module-level function, so it can be pickled
+        *args: Picklable arguments
+
+    Returns:
+        The function's return value
+    """
+    global _pool, _pending
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=WORKER_PROCESSES, mp_context=multiprocessing.get_context(START_METHOD)
+        )
+
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_pool, func, *args)
+    finally:
+        _pending -= 1
+
+
+@metrics.collector
+def count_pending():
+    metrics.set_gauge('worker_pool_pending', _pending)
+
+
+async def shutdown():
+    """Stop the worker processes, waiting for running jobs in a thread so the event loop isn't blocked"""
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await asyncio.get_running_loop().run_in_executor(None, partial(pool.shutdown, cancel_futures=True))
@@ -0,0 +1,95 @@
+import asyncio
+
+from config import WRITE_BATCH_SIZE, WRITE_BATCH_DELAY, logger
+from database import AsyncSession
+from repository import save_submissions
+
+
+class SubmissionWriter:
+    """
+    Write-behind queue for confirmed submissions
+
+    Submissions confirmed at about the same time, by any number of users, are
+    inserted in one transaction. Callers still wait until their own submission
+    is committed.
+    """
+
+    def __init__(self, batch_size=WRITE_BATCH_SIZE, batch_delay=WRITE_BATCH_DELAY):
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Write everything still queued, then stop the worker"""
+        if not self.running:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    async def save(self, submission):
+        """
+        Save one submission (see repository.save_submissions for the format)
+
+        Returns once the submission is committed; database errors are raised to the caller.
+
+        Returns:
+            int: Row ID of the saved submission
+        """
+        if not self.running:
+            row_ids = await self._write([submission])
+            return row_ids[submission['submission_id']]
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((submission, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            # Give other confirms a moment to join this transaction
+            deadline = asyncio.get_running_loop().time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), max(timeout, 0)))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._flush(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _flush(self, batch):
+        try:
+            row_ids = await self._write([submission for submission, _ in batch])
+        except Exception as e:
+            if len(batch) > 1:
+                # Retry one by one so a single bad submission doesn't fail the others
+                logger.exception(f"Error writing batch of {len(batch)} submissions, retrying individually")
+                for item in batch:
+                    await self._flush([item])
+            elif not batch[0][1].done():
+                batch[0][1].set_exception(e)
+            return
+
+        for submission, future in batch:
+            if not future.done():
+                future.set_result(row_ids[submission['submission_id']])
+
+    async def _write(self, submissions):
+        async with AsyncSession() as session:
+            row_ids = await save_submissions(session, submissions)
+            await session.commit()
+        return row_ids
+
+
+submission_writer = SubmissionWriter()